@@ -1,5 +1,19 @@
+from datetime import timedelta
 from django.contrib import admin
-from .models import Tag, Category, Items, Cart, CartItem, HomeHero, HomePageSection, Testimonial, PaymentMethod, Order, OrderItem, ShippingMethod, TaxConfiguration, DiscountCode, SavedAddress
+from django.db.models import Avg, Count, Max, Min, Q
+from django.utils import timezone
+from .models import Tag, Category, Items, Cart, CartItem, HomeHero, HomePageSection, Testimonial, PaymentMethod, Order, OrderItem, ShippingMethod, TaxConfiguration, DiscountCode, DiscountRedemption, SavedAddress, ImageJob
+from .images import enqueue_derivatives
+from .exports import streaming_export_response
+
+
+def export_action(name, fmt):
+    """Admin action streaming the selected rows (or the whole filtered list) as `fmt`"""
+    @admin.action(description=f"Export selected as {fmt.upper()}")
+    def action(modeladmin, request, queryset):
+        return streaming_export_response(name, fmt, queryset=queryset)
+    action.__name__ = f'export_{fmt}'
+    return action
 
 
 @admin.register(Tag)
@@ -44,8 +58,9 @@ class CartAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
     
     def get_total_items(self, obj):
-        return sum(item.quantity for item in obj.items.all())
+        return obj.total_quantity
     get_total_items.short_description = 'Total Items'
+    get_total_items.admin_order_field = 'total_quantity'
 
 
 @admin.register(CartItem)
@@ -61,8 +76,9 @@ class ItemsAdmin(admin.ModelAdmin):
     list_display = ('name', 'price', 'Category', 'is_featured', 'is_on_sale', 'is_latest_arrival', 'available', 'display_order')
     list_filter = ('Category', 'available', 'is_featured', 'is_on_sale', 'is_latest_arrival', 'Tag', 'created_at')
     search_fields = ('name', 'description')
+    actions = [export_action('items', 'csv'), export_action('items', 'jsonl')]
     prepopulated_fields = {'slug': ('name',)}
-    readonly_fields = ('created_at', 'discount_percentage')
+    readonly_fields = ('created_at', 'discount_percentage', 'effective_price')
     filter_horizontal = ('Tag',)
     fieldsets = (
         ('Basic Information', {
@@ -79,7 +95,7 @@ class ItemsAdmin(admin.ModelAdmin):
             'fields': ('Tag',)
         }),
         ('Metadata', {
-            'fields': ('created_at', 'discount_percentage'),
+            'fields': ('created_at', 'discount_percentage', 'effective_price'),
             'classes': ('collapse',)
         }),
     )
@@ -182,6 +198,8 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ('status', 'payment_status', 'payment_method', 'discount_code', 'created_at')
     search_fields = ('order_number', 'user__username', 'user__email', 'guest_email', 'delivery_last_name', 'discount_code__code')
     readonly_fields = ('order_number', 'created_at', 'updated_at', 'paid_at', 'shipped_at', 'delivered_at')
+    date_hierarchy = 'created_at'
+    actions = [export_action('orders', 'csv'), export_action('orders', 'jsonl')]
     inlines = [OrderItemInline]
     fieldsets = (
         ('Order Information', {
@@ -230,6 +248,8 @@ class OrderItemAdmin(admin.ModelAdmin):
     list_filter = ('order__status', 'order__created_at')
     search_fields = ('order__order_number', 'item_name', 'item__name')
     readonly_fields = ('item_name', 'item_price', 'subtotal')
+    date_hierarchy = 'order__created_at'
+    actions = [export_action('order_items', 'csv'), export_action('order_items', 'jsonl')]
 
 
 @admin.register(ShippingMethod)
@@ -313,6 +333,18 @@ class DiscountCodeAdmin(admin.ModelAdmin):
     )
 
 
+@admin.register(DiscountRedemption)
+class DiscountRedemptionAdmin(admin.ModelAdmin):
+    list_display = ('discount', 'order', 'user', 'email', 'created_at')
+    list_filter = ('created_at',)
+    search_fields = ('discount__code', 'order__order_number', 'user__username', 'email')
+    list_select_related = ('discount', 'order', 'user')
+    readonly_fields = ('discount', 'order', 'user', 'email', 'created_at')
+    
+    def has_add_permission(self, request):
+        return False
+
+
 @admin.register(SavedAddress)
 class SavedAddressAdmin(admin.ModelAdmin):
     list_display = ('user', 'label', 'address_type', 'city', 'state', 'country', 'is_default', 'is_active', 'created_at')
@@ -339,3 +371,39 @@ class SavedAddressAdmin(admin.ModelAdmin):
     )
 
 # Register your models here.
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('image', 'status', 'attempts', 'duration', 'created_at', 'finished_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('image', 'error')
+    readonly_fields = ('image', 'status', 'attempts', 'error', 'duration', 'created_at', 'started_at', 'finished_at')
+    actions = ['retry_jobs']
+    change_list_template = 'admin/resin_apps/imagejob/change_list.html'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def retry_jobs(self, request, queryset):
+        """Queue the selected images again"""
+        images = set(queryset.exclude(status=ImageJob.PENDING).values_list('image', flat=True))
+        for image in images:
+            enqueue_derivatives(image)
+        self.message_user(request, f"Queued {len(images)} images again.")
+    retry_jobs.short_description = "Retry selected jobs"
+    
+    def changelist_view(self, request, extra_context=None):
+        """Show queue depth and recent processing times above the list"""
+        since = timezone.now() - timedelta(hours=24)
+        stats = ImageJob.objects.aggregate(
+            pending=Count('id', filter=Q(status=ImageJob.PENDING)),
+            running=Count('id', filter=Q(status=ImageJob.RUNNING)),
+            failed=Count('id', filter=Q(status=ImageJob.FAILED)),
+            oldest_pending=Min('created_at', filter=Q(status=ImageJob.PENDING)),
+            avg_duration=Avg('duration', filter=Q(status=ImageJob.DONE, finished_at__gte=since)),
+            max_duration=Max('duration', filter=Q(status=ImageJob.DONE, finished_at__gte=since)),
+        )
+        extra_context = extra_context or {}
+        extra_context['queue_stats'] = stats
+        return super().changelist_view(request, extra_context=extra_context)
@@ -0,0 +1,238 @@
+"""
+Read-only JSON catalog API (items, categories, tags) for the mobile app.
+
+- Cursor pagination reuses KeysetPaginator, so every page is one seek
+  query; there is no COUNT.
+- `?fields=id,name,price` returns only those fields and loads only the
+  columns they need (.only()). The ordering keys are always loaded so
+  cursors can be encoded.
+- Querysets are built with select_related('Category') and a
+  prefetch_related('Tag') that loads only captions, and only when those
+  fields are requested. A page costs at most two queries whatever its size.
+- Responses carry an ETag and Last-Modified from the catalog version (see
+  conditional.py), answer revalidation with 304, and are public and
+  cacheable for API_CACHE_MAX_AGE seconds. Nothing in them depends on the
+  caller, so no authentication or session is consulted (see
+  middleware.StatelessApiMiddleware).
+"""
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db.models import Count, Prefetch, Q
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from rest_framework import serializers, viewsets
+from rest_framework.pagination import BasePagination
+from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from .conditional import catalog_condition
+from .models import Category, Items, Tag
+from .pagination import CURSOR_PARAM, KeysetPaginator
+
+FIELDS_PARAM = 'fields'
+
+
+def _api_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _api_cache_max_age():
+    return _api_setting('API_CACHE_MAX_AGE', 60)
+
+
+class KeysetCursorPagination(BasePagination):
+    """DRF pagination over KeysetPaginator: {"next", "previous", "results"}"""
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = _api_setting('API_PAGE_SIZE', 24)
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, page_size))
+        except ValueError:
+            pass
+        page_size = min(max(page_size, 1), _api_setting('API_MAX_PAGE_SIZE', 100))
+        self.page = KeysetPaginator(queryset, view.ordering, page_size).page(request.query_params.get(CURSOR_PARAM))
+        return list(self.page)
+
+    def _link(self, cursor):
+        if cursor is None:
+            return None
+        params = self.request.query_params.copy()
+        params[CURSOR_PARAM] = cursor
+        return self.request.build_absolute_uri(f'{self.request.path}?{params.urlencode()}')
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self._link(self.page.next_cursor),
+            'previous': self._link(self.page.previous_cursor),
+            'results': data,
+        })
+
+
+class SparseFieldsSerializer(serializers.ModelSerializer):
+    """Drops every field not named in ?fields= (when given)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        requested = requested_fields(self.context.get('request'))
+        if requested:
+            for name in set(self.fields) - requested:
+                self.fields.pop(name)
+
+
+def requested_fields(request):
+    """Set of field names from ?fields=, or None for all fields"""
+    if request is None:
+        return None
+    raw = request.query_params.get(FIELDS_PARAM, '')
+    names = {name.strip() for name in raw.split(',') if name.strip()}
+    return names or None
+
+
+class CategorySerializer(SparseFieldsSerializer):
+    item_count = serializers.IntegerField(read_only=True)
+    shop_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Category
+        fields = ('id', 'name', 'description', 'display_order', 'item_count', 'shop_url', 'updated_at')
+
+    def get_shop_url(self, category):
+        return self.context['request'].build_absolute_uri(f"{reverse('shop')}?category={category.id}")
+
+
+class TagSerializer(SparseFieldsSerializer):
+    class Meta:
+        model = Tag
+        fields = ('id', 'caption')
+
+
+class ItemCategorySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Category
+        fields = ('id', 'name')
+
+
+class ItemSerializer(SparseFieldsSerializer):
+    category = ItemCategorySerializer(source='Category', read_only=True)
+    tags = serializers.SlugRelatedField(source='Tag', slug_field='caption', many=True, read_only=True)
+    images = serializers.SerializerMethodField()
+    url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Items
+        fields = (
+            'id', 'slug', 'name', 'description', 'price', 'sale_price', 'effective_price',
+            'is_on_sale', 'is_featured', 'is_latest_arrival', 'category', 'tags', 'images',
+            'url', 'created_at', 'updated_at',
+        )
+
+    def get_images(self, item):
+        request = self.context['request']
+        return [
+            request.build_absolute_uri(default_storage.url(image.name))
+            for image in (item.image1, item.image2, item.image3) if image
+        ]
+
+    def get_url(self, item):
+        return self.context['request'].build_absolute_uri(reverse('item-details', kwargs={'slug': item.slug}))
+
+
+class CatalogViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    Base for the catalog endpoints. `field_columns` maps each API field to
+    the model columns it reads; `ordering` is the keyset (last key unique).
+    """
+    authentication_classes = ()
+    permission_classes = (AllowAny,)
+    renderer_classes = (JSONRenderer,)
+    pagination_class = KeysetCursorPagination
+    field_columns = {}
+    ordering = ('id',)
+
+    def base_queryset(self):
+        raise NotImplementedError
+
+    def get_queryset(self):
+        queryset = self.base_queryset()
+        requested = requested_fields(self.request)
+        if requested is None:
+            return queryset
+        columns = {'id', *(key.lstrip('-') for key in self.ordering)}
+        if self.lookup_field != 'pk':
+            columns.add(self.lookup_field)
+        for name in requested:
+            columns.update(self.field_columns.get(name, ()))
+        # Annotations aren't columns; .only() takes model fields
+        model_fields = {field.name for field in queryset.model._meta.concrete_fields} | {'Category__id', 'Category__name'}
+        return queryset.only(*sorted(columns & model_fields))
+
+    @method_decorator(catalog_condition(public_max_age=_api_cache_max_age))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(catalog_condition(public_max_age=_api_cache_max_age))
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+class ItemViewSet(CatalogViewSet):
+    """Available items, in shop display order; ?category=<id> filters"""
+    serializer_class = ItemSerializer
+    lookup_field = 'slug'
+    ordering = ('display_order', '-created_at', 'id')
+    field_columns = {
+        'slug': ('slug',),
+        'name': ('name',),
+        'description': ('description',),
+        'price': ('price',),
+        'sale_price': ('sale_price',),
+        'effective_price': ('effective_price',),
+        'is_on_sale': ('is_on_sale',),
+        'is_featured': ('is_featured',),
+        'is_latest_arrival': ('is_latest_arrival',),
+        'category': ('Category', 'Category__id', 'Category__name'),
+        'images': ('image1', 'image2', 'image3'),
+        'url': ('slug',),
+        'created_at': ('created_at',),
+        'updated_at': ('updated_at',),
+    }
+
+    def base_queryset(self):
+        requested = requested_fields(self.request)
+        queryset = Items.objects.filter(available=True)
+        category = self.request.query_params.get('category', '')
+        if category.isdigit():
+            queryset = queryset.filter(Category_id=int(category))
+        if requested is None or 'category' in requested:
+            queryset = queryset.select_related('Category')
+        if requested is None or 'tags' in requested:
+            queryset = queryset.prefetch_related(Prefetch('Tag', queryset=Tag.objects.only('id', 'caption')))
+        return queryset
+
+
+class CategoryViewSet(CatalogViewSet):
+    """Categories with available items, with their item counts"""
+    serializer_class = CategorySerializer
+    ordering = ('display_order', 'name', 'id')
+    field_columns = {
+        'name': ('name',),
+        'description': ('description',),
+        'display_order': ('display_order',),
+        'updated_at': ('updated_at',),
+    }
+
+    def base_queryset(self):
+        return Category.objects.annotate(
+            item_count=Count('items', filter=Q(items__available=True))
+        ).filter(item_count__gt=0)
+
+
+class TagViewSet(CatalogViewSet):
+    serializer_class = TagSerializer
+    ordering = ('caption', 'id')
+    field_columns = {'caption': ('caption',)}
+
+    def base_queryset(self):
+        return Tag.objects.all()
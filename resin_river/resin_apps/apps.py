@@ -6,4 +6,5 @@ class ResinAppsConfig(AppConfig):
     name = 'resin_apps'
     
     def ready(self):
-        import resin_apps.signals  # Import signals to register them
\ No newline at end of file
+        import resin_apps.signals  # Import signals to register them
+        import resin_apps.checks  # Register system checks
@@ -0,0 +1,70 @@
+"""
+Adding items to a signed-in user's cart.
+
+The views used to get_or_create the Cart and the CartItem and then `+=` in
+Python, so two concurrent adds (a double-click, a second tab) could both
+read the old quantity and one would be lost, or both try to insert the
+line and one would fail with IntegrityError. Instead the increment happens
+in the database, in one statement:
+
+    INSERT INTO cartitem (cart_id, item_id, quantity, added_at)
+    SELECT id, <item>, <quantity>, <now> FROM cart WHERE user_id = <user>
+    ON CONFLICT (cart_id, item_id) DO UPDATE SET quantity = quantity + excluded.quantity
+
+On databases without INSERT ... ON CONFLICT, an `F()` UPDATE is tried
+first and the line is inserted only if there wasn't one, retrying the
+UPDATE if a concurrent add inserted it in between. Either way no signals
+are sent, so the header counter (Cart.total_quantity) is incremented the
+same way and the cart's quote version bumped here.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Cart, CartItem
+from .pricing import invalidate_cart
+
+
+def _upsert(user, item_id, quantity):
+    """Add `quantity` of the item in one statement; False if the user has no cart yet"""
+    qn = connection.ops.quote_name
+    cart_item = CartItem._meta
+    field = cart_item.get_field
+    sql = (
+        f"INSERT INTO {qn(cart_item.db_table)} "
+        f"({qn(field('cart').column)}, {qn(field('item').column)}, {qn(field('quantity').column)}, {qn(field('added_at').column)}) "
+        f"SELECT {qn(Cart._meta.pk.column)}, %s, %s, %s FROM {qn(Cart._meta.db_table)} "
+        f"WHERE {qn(Cart._meta.get_field('user').column)} = %s "
+        f"ON CONFLICT ({qn(field('cart').column)}, {qn(field('item').column)}) "
+        f"DO UPDATE SET {qn(field('quantity').column)} = "
+        f"{qn(cart_item.db_table)}.{qn(field('quantity').column)} + EXCLUDED.{qn(field('quantity').column)}"
+    )
+    added_at = field('added_at').get_db_prep_value(timezone.now(), connection)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [item_id, quantity, added_at, user.pk])
+        return cursor.rowcount > 0
+
+
+def _update_or_insert(cart, item_id, quantity):
+    lines = CartItem.objects.filter(cart=cart, item_id=item_id)
+    if lines.update(quantity=F('quantity') + quantity):
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.bulk_create([CartItem(cart=cart, item_id=item_id, quantity=quantity)])
+    except IntegrityError:
+        # Inserted by a concurrent add since the UPDATE
+        lines.update(quantity=F('quantity') + quantity)
+
+
+def add_to_cart(user, item_id, quantity=1):
+    """Atomically add `quantity` of an item to the user's cart (creating either if needed)"""
+    with transaction.atomic():
+        if connection.features.supports_update_conflicts_with_target:
+            if not _upsert(user, item_id, quantity):
+                Cart.objects.get_or_create(user=user)
+                _upsert(user, item_id, quantity)
+        else:
+            cart, _ = Cart.objects.get_or_create(user=user)
+            _update_or_insert(cart, item_id, quantity)
+        Cart.objects.filter(user=user).update(total_quantity=F('total_quantity') + quantity)
+        invalidate_cart(user.pk)
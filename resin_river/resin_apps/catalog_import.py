@@ -0,0 +1,274 @@
+"""
+Bulk catalog import.
+
+Rows (dicts from CSV or JSONL, see `read_rows`) are upserted into Items by
+slug in batches, each in its own transaction: one in_bulk() lookup resolves
+the batch's slugs, new items go through bulk_create and existing ones
+through bulk_update (ItemsQuerySet keeps effective_price, updated_at and the
+catalog caches in step), categories and tags are matched by name and created
+in bulk, and tags are attached with bulk inserts into the through table.
+Bulk writes send no signals, so each batch also refreshes the search index,
+queues related-item rebuilds, bumps the catalog version when tags change
+and queues image derivatives itself. Memory is
+bounded by the batch size, not the file size.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from django.utils.text import slugify
+from .conditional import invalidate_catalog
+from .images import enqueue_derivatives
+from .models import Category, Items, Tag
+from .navigation import invalidate_nav_categories
+from .related import mark_stale
+from .search import get_search_backend
+
+TEXT_FIELDS = ('name', 'description', 'image1', 'image2', 'image3')
+DECIMAL_FIELDS = ('price', 'sale_price')
+BOOLEAN_FIELDS = ('available', 'is_featured', 'is_on_sale', 'is_latest_arrival')
+INTEGER_FIELDS = ('display_order',)
+IMAGE_FIELDS = ('image1', 'image2', 'image3')
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't', 'on'}
+BULK_UPDATE_BATCH_SIZE = 200
+
+
+class RowError(ValueError):
+    """A row that can't be imported"""
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.skipped = 0
+        self.categories_created = 0
+        self.tags_created = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+def read_rows(stream, fmt, tag_separator='|'):
+    """
+    Yield (line_number, row) from a CSV (with a header) or JSONL stream. CSV
+    tags are split on `tag_separator`; JSONL tags may be a list or a string.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            if 'tags' in row:
+                row['tags'] = [tag for tag in (row['tags'] or '').split(tag_separator)]
+            yield reader.line_num, row
+    elif fmt == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, RowError(f"invalid JSON: {e}")
+                continue
+            if isinstance(row.get('tags'), str):
+                row['tags'] = row['tags'].split(tag_separator)
+            yield line_number, row
+    else:
+        raise ValueError(f"Unknown format {fmt!r}")
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _current(item, name):
+    value = getattr(item, name)
+    return (value.name or '') if name in IMAGE_FIELDS else value
+
+
+def clean_row(row):
+    """Normalize one input row into (slug, item fields, category name or None, tags or None)"""
+    if not isinstance(row, dict):
+        raise RowError("row is not an object")
+    fields = {}
+    for name in TEXT_FIELDS:
+        if name in row:
+            fields[name] = _text(row[name])
+    for name in DECIMAL_FIELDS:
+        if name in row:
+            value = _text(row[name])
+            try:
+                fields[name] = Decimal(value) if value else None
+            except InvalidOperation:
+                raise RowError(f"{name} is not a number: {value!r}")
+    for name in BOOLEAN_FIELDS:
+        if name in row:
+            value = row[name]
+            fields[name] = value if isinstance(value, bool) else _text(value).lower() in TRUE_VALUES
+    for name in INTEGER_FIELDS:
+        if name in row:
+            value = _text(row[name])
+            try:
+                fields[name] = int(value) if value else 0
+            except ValueError:
+                raise RowError(f"{name} is not an integer: {value!r}")
+    if fields.get('price', 0) is None:
+        raise RowError("price can't be empty")
+
+    slug = slugify(_text(row.get('slug')) or fields.get('name', ''))
+    if not slug:
+        raise RowError("row has neither a slug nor a name")
+    category = _text(row['category']) if 'category' in row else None
+    tags = None
+    if 'tags' in row:
+        tags = sorted({_text(tag) for tag in (row['tags'] or []) if _text(tag)})
+    return slug, fields, category, tags
+
+
+class CatalogImporter:
+    """Upsert cleaned rows into the catalog, `batch_size` rows per transaction"""
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.stats = ImportStats()
+        # Name -> id, filled as batches reference them; bounded by the catalog's
+        # category and tag count, not the number of rows
+        self.category_ids = {}
+        self.tag_ids = {}
+
+    def run(self, rows, on_batch=None, on_error=None):
+        """
+        Import (line_number, row) pairs; `on_batch(stats)` is called after
+        each committed batch and `on_error(line_number, message)` for each
+        skipped row
+        """
+        batch = {}
+        for line_number, row in rows:
+            self.stats.rows += 1
+            try:
+                if isinstance(row, Exception):
+                    raise row
+                slug, fields, category, tags = clean_row(row)
+            except RowError as e:
+                self.stats.skipped += 1
+                if on_error:
+                    on_error(line_number, str(e))
+                continue
+            # A slug repeated in one batch keeps its last row
+            batch[slug] = (line_number, fields, category, tags)
+            if len(batch) >= self.batch_size:
+                self.import_batch(batch, on_error)
+                batch = {}
+                if on_batch:
+                    on_batch(self.stats)
+        if batch:
+            self.import_batch(batch, on_error)
+            if on_batch:
+                on_batch(self.stats)
+        if self.stats.categories_created:
+            invalidate_nav_categories()
+        return self.stats
+
+    def _resolve(self, model, field, names, cache):
+        """Ids for `names` (a set) on `model.field`, creating the missing rows in bulk"""
+        missing = names - cache.keys()
+        if missing:
+            cache.update(model.objects.filter(**{f'{field}__in': missing}).values_list(field, 'id'))
+            new = [model(**{field: name}) for name in sorted(missing - cache.keys())]
+            if new:
+                model.objects.bulk_create(new)
+                cache.update((getattr(obj, field), obj.id) for obj in new)
+            if model is Category:
+                self.stats.categories_created += len(new)
+            else:
+                self.stats.tags_created += len(new)
+        return cache
+
+    def import_batch(self, batch, on_error=None):
+        with transaction.atomic():
+            category_ids = self._resolve(
+                Category, 'name', {category for _, _, category, _ in batch.values() if category}, self.category_ids,
+            )
+            tag_ids = self._resolve(
+                Tag, 'caption', {tag for _, _, _, tags in batch.values() for tag in tags or ()}, self.tag_ids,
+            )
+            existing = Items.objects.in_bulk(list(batch), field_name='slug')
+
+            to_create, to_update, update_fields, images = [], [], set(), set()
+            for slug, (line_number, fields, category, _) in batch.items():
+                if category is not None:
+                    fields['Category_id'] = category_ids[category] if category else None
+                item = existing.get(slug)
+                if item is None:
+                    if not fields.get('name') or fields.get('price') is None:
+                        self.stats.skipped += 1
+                        if on_error:
+                            on_error(line_number, "new items need a name and a price")
+                        continue
+                    item = Items(slug=slug, **fields)
+                    to_create.append(item)
+                    images.update(fields[name] for name in IMAGE_FIELDS if fields.get(name))
+                else:
+                    changed = {name for name, value in fields.items() if _current(item, name) != value}
+                    for name in changed:
+                        if name in IMAGE_FIELDS:
+                            images.add(fields[name])
+                        setattr(item, name, fields[name])
+                    if changed:
+                        to_update.append(item)
+                        update_fields.update(changed)
+                    else:
+                        # Re-imported rows that match the catalog aren't rewritten
+                        self.stats.unchanged += 1
+
+            if to_create:
+                Items.objects.bulk_create(to_create)
+            if to_update:
+                # Small UPDATE batches: bulk_update's CASE per column grows with the batch
+                Items.objects.bulk_update(to_update, sorted(update_fields), batch_size=BULK_UPDATE_BATCH_SIZE)
+            self.stats.created += len(to_create)
+            self.stats.updated += len(to_update)
+
+            items = {item.slug: item.id for item in to_create}
+            items.update((slug, item.id) for slug, item in existing.items())
+            retagged = self._set_tags(items, batch, tag_ids)
+            if retagged:
+                # In place of m2m_changed; item writes bump it through ItemsQuerySet
+                invalidate_catalog()
+            touched = {item.id for item in to_create + to_update} | retagged
+            get_search_backend().index_items(sorted(touched))
+            mark_stale(touched)
+        for name in images:
+            if name:
+                enqueue_derivatives(name)
+
+    def _set_tags(self, items, batch, tag_ids):
+        """
+        Replace the tags of items whose row has a tags column, with bulk
+        through-table writes; returns the ids of items whose tags changed
+        """
+        through = Items.Tag.through
+        tagged = {items[slug]: tags for slug, (_, _, _, tags) in batch.items() if tags is not None and slug in items}
+        if not tagged:
+            return set()
+        wanted = {(item_id, tag_ids[tag]) for item_id, tags in tagged.items() for tag in tags}
+        current = {
+            (item_id, tag_id): row_id
+            for row_id, item_id, tag_id in through.objects.filter(items_id__in=tagged).values_list('id', 'items_id', 'tag_id')
+        }
+        stale = {pair: row_id for pair, row_id in current.items() if pair not in wanted}
+        added = sorted(wanted - current.keys())
+        if stale:
+            through.objects.filter(id__in=stale.values()).delete()
+        through.objects.bulk_create(
+            [through(items_id=item_id, tag_id=tag_id) for item_id, tag_id in added], ignore_conflicts=True,
+        )
+        return {item_id for item_id, _ in list(stale) + added}
@@ -0,0 +1,30 @@
+"""
+System checks for deployment settings the app relies on.
+
+Every cache in resin_apps (nav, catalog ETags, homepage, discounts, quotes,
+tax and shipping tables) is invalidated by bumping a version key in the
+default cache. A per-process backend keeps those bumps inside the worker
+that made them, so the other workers go on serving stale data; it is an
+error unless CACHE_SINGLE_PROCESS says there is only one process.
+"""
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend in PROCESS_LOCAL_CACHES and not getattr(settings, 'CACHE_SINGLE_PROCESS', settings.DEBUG):
+        return [Error(
+            f"The default cache ({backend.rsplit('.', 1)[-1]}) is not shared between processes, "
+            "so cache invalidation won't reach other workers.",
+            hint="Set CACHE_BACKEND/CACHE_LOCATION to a shared backend such as Redis, "
+                 "or CACHE_SINGLE_PROCESS=True if the site runs in a single process.",
+            id='resin_apps.E001',
+        )]
+    return []
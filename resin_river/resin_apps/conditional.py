@@ -0,0 +1,116 @@
+"""
+Conditional GET for catalog pages.
+
+Product, shop and home pages are built from catalog data plus a little
+per-visitor state (login, cart badge, session cart/wish list/recently viewed,
+pending messages). CATALOG_VERSION_KEY holds the time of the last catalog
+change; signals.py and bulk Items writes bump it. The
+`catalog_condition` decorator turns the version, the requested URL and the
+visitor state into an ETag and uses the version time as Last-Modified, so a
+revalidation is answered with 304 from one cache read (plus the cart badge
+lookup for signed-in users) before the view runs its listing queries or
+renders a template.
+"""
+import hashlib
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import wraps
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from .models import Cart
+
+CATALOG_VERSION_KEY = 'catalog:version'
+VIEWER_SESSION_KEYS = ('cart_dict', 'cart_list', 'wish_list', 'recently_viewed', '_messages')
+
+
+def get_catalog_version():
+    """
+    Return the catalog version (time of the last change in ns), initialising
+    it from the clock if missing; None if the cache doesn't keep it
+    """
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def _bump_catalog_version():
+    # Never move backwards, so Last-Modified keeps increasing across workers
+    previous = cache.get(CATALOG_VERSION_KEY) or 0
+    cache.set(CATALOG_VERSION_KEY, max(time.time_ns(), previous + 1), timeout=None)
+
+
+def invalidate_catalog():
+    """
+    Mark the catalog changed now and again once the current transaction
+    commits (see navigation.invalidate_nav_categories)
+    """
+    _bump_catalog_version()
+    transaction.on_commit(_bump_catalog_version)
+
+
+def _viewer_state(request):
+    """Everything outside the catalog that changes how a catalog page renders"""
+    user = request.user
+    state = [user.pk, request.COOKIES.get(CookieStorage.cookie_name)]
+    state.extend(request.session.get(key) for key in VIEWER_SESSION_KEYS)
+    if user.is_authenticated:
+        state.append(Cart.objects.filter(user=user).values_list('total_quantity', flat=True).first())
+    return state
+
+
+def _validators(request, extra_versions, per_visitor=True):
+    """(etag, last_modified) for this request, computed once per request"""
+    if not hasattr(request, '_catalog_validators'):
+        version = get_catalog_version()
+        if version is None:
+            request._catalog_validators = (None, None)
+        else:
+            visitor = _viewer_state(request) if per_visitor else None
+            key = repr((request.get_full_path(), version, [f() for f in extra_versions], visitor))
+            request._catalog_validators = (
+                hashlib.md5(key.encode()).hexdigest(),
+                datetime.fromtimestamp(version / 1e9, tz=dt_timezone.utc),
+            )
+    return request._catalog_validators
+
+
+def catalog_condition(*extra_versions, public_max_age=None):
+    """
+    Decorator for catalog page views: send ETag/Last-Modified and answer
+    matching conditional requests with 304 without calling the view.
+    `extra_versions` are callables for other cached inputs the page shows
+    (e.g. the homepage version). With `public_max_age` the response is the
+    same for every visitor (e.g. the JSON API), so visitor state is left out
+    and shared caches may keep it for that many seconds; pass a callable to
+    read the setting per request.
+    """
+    per_visitor = public_max_age is None
+
+    def etag(request, *args, **kwargs):
+        return _validators(request, extra_versions, per_visitor)[0]
+
+    def last_modified(request, *args, **kwargs):
+        return _validators(request, extra_versions, per_visitor)[1]
+
+    def decorator(view):
+        conditional_view = condition(etag_func=etag, last_modified_func=last_modified)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if not response.has_header('ETag'):
+                return response
+            if per_visitor:
+                # Personalised pages: browsers may keep them but must revalidate
+                patch_cache_control(response, private=True, no_cache=True)
+            else:
+                max_age = public_max_age() if callable(public_max_age) else public_max_age
+                patch_cache_control(response, public=True, max_age=max_age)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,182 @@
+"""
+Discount code lookups and attempt throttling.
+
+Codes are matched case-insensitively on UPPER(code), which has an
+expression index (an iexact lookup compiles to LIKE and can't use one).
+Each lookup is cached per normalized code and discount version, and so is
+a miss, so brute-forcing unknown codes costs cache reads rather than
+queries. DiscountCode signals bump the version, which drops every cached
+entry at once (a new code is never hidden by an old negative entry).
+
+Failed attempts are rate-limited with a token bucket per session and per
+client IP, kept in the shared cache: DISCOUNT_ATTEMPT_BURST failures at
+once, refilled at DISCOUNT_ATTEMPTS_PER_MINUTE. Behind a reverse proxy
+REMOTE_ADDR is the proxy's, so DISCOUNT_CLIENT_IP_HEADER names the header
+it sets (e.g. HTTP_X_FORWARDED_FOR) and the last address in it, the one
+the trusted proxy appended, is used instead. Buckets are read and
+written without a lock, so concurrent requests can occasionally both take
+the last token; the limit is approximate, which is enough to keep guessing
+off the database.
+
+Redemption is one conditional UPDATE that increments usage_count only
+while the code is active, in its validity window, under usage_limit and
+under per_user_limit for the customer (counted from the DiscountRedemption
+ledger), followed by the ledger insert. Run inside the transaction that
+creates the order, the check and the increment can't be split by another
+checkout (the database serializes writes to the row), so the limits hold
+under concurrency and a failed checkout leaves no trace.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Upper
+from django.utils import timezone
+from .models import DiscountCode, DiscountRedemption
+
+DISCOUNT_VERSION_KEY = 'discount:version'
+MISSING = 'missing'
+
+
+def _discount_timeout():
+    return getattr(settings, 'DISCOUNT_CACHE_TIMEOUT', 60 * 5)
+
+
+def _attempt_burst():
+    return getattr(settings, 'DISCOUNT_ATTEMPT_BURST', 10)
+
+
+def _attempts_per_minute():
+    return getattr(settings, 'DISCOUNT_ATTEMPTS_PER_MINUTE', 10)
+
+
+def _client_ip_header():
+    return getattr(settings, 'DISCOUNT_CLIENT_IP_HEADER', '')
+
+
+def client_ip(request):
+    """The visitor's address, read from the trusted proxy's header if one is configured"""
+    header = _client_ip_header()
+    forwarded = request.META.get(header, '') if header else ''
+    if forwarded:
+        # Addresses before the last were sent by the client and can be forged
+        return forwarded.split(',')[-1].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def normalize_code(code):
+    return (code or '').strip().upper()
+
+
+class DiscountUnavailable(Exception):
+    """The code can't be redeemed for this order; str() is the reason to show"""
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def get_discount_version():
+    """Return the current discount version, initialising it if missing"""
+    version = cache.get(DISCOUNT_VERSION_KEY)
+    if version is None:
+        cache.add(DISCOUNT_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(DISCOUNT_VERSION_KEY, 0)
+    return version
+
+
+def _bump_discount_version():
+    try:
+        cache.incr(DISCOUNT_VERSION_KEY)
+    except ValueError:
+        cache.set(DISCOUNT_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_discounts():
+    """Drop every cached code (and quote) now and once the current transaction commits"""
+    _bump_discount_version()
+    transaction.on_commit(_bump_discount_version)
+
+
+def get_discount_code(code):
+    """The DiscountCode matching `code` (any case), or None; both are cached"""
+    normalized = normalize_code(code)
+    if not normalized:
+        return None
+    key = 'discount:code:%s:%s' % (get_discount_version(), hashlib.md5(normalized.encode()).hexdigest())
+    discount = cache.get(key)
+    if discount is None:
+        discount = (
+            DiscountCode.objects.alias(code_upper=Upper('code')).filter(code_upper=normalized).order_by('id').first()
+            or MISSING
+        )
+        cache.set(key, discount, _discount_timeout())
+    return None if discount == MISSING else discount
+
+
+def redeem_discount(discount, order, user=None, email=''):
+    """
+    Count one use of `discount` for `order` and record it in the ledger, or
+    raise DiscountUnavailable. Call inside the order's transaction.
+    """
+    if user is not None and not user.is_authenticated:
+        user = None
+    email = '' if user is not None else normalize_email(email)
+    now = timezone.now()
+
+    if user is None and not email:
+        # Nothing identifies a guest without an email
+        per_user = Q()
+    else:
+        redemptions = DiscountRedemption.objects.filter(discount=OuterRef('pk'))
+        redemptions = redemptions.filter(user=user) if user is not None else redemptions.filter(email=email)
+        used = redemptions.order_by().values('discount').annotate(used=Count('pk')).values('used')[:1]
+        per_user = Q(per_user_limit=0) | Q(per_user_limit__gt=Coalesce(Subquery(used), 0))
+
+    updated = DiscountCode.objects.filter(
+        Q(usage_limit__isnull=True) | Q(usage_limit=0) | Q(usage_count__lt=F('usage_limit')),
+        Q(valid_from__isnull=True) | Q(valid_from__lte=now),
+        Q(valid_until__isnull=True) | Q(valid_until__gte=now),
+        per_user,
+        pk=discount.pk, is_active=True,
+    ).update(usage_count=F('usage_count') + 1)
+    # Cached codes carry usage_count; either way they are stale now
+    invalidate_discounts()
+    if not updated:
+        discount.refresh_from_db()
+        is_valid, message = discount.is_valid(user=user, email=email)
+        raise DiscountUnavailable(message if not is_valid else "This discount code can no longer be used.")
+
+    return DiscountRedemption.objects.create(discount=discount, order=order, user=user, email=email)
+
+
+class DiscountAttemptThrottle:
+    """
+    Token buckets for the visitor's session and IP. Check `allowed` before
+    looking a code up and call `spend()` when the attempt fails, so a
+    shopper re-sending a code that applies is never limited.
+    """
+
+    def __init__(self, request):
+        self.burst = _attempt_burst()
+        self.per_second = _attempts_per_minute() / 60
+        self.now = time.time()
+        keys = ['discount:attempts:ip:%s' % client_ip(request)]
+        if request.session.session_key:
+            keys.append('discount:attempts:session:%s' % request.session.session_key)
+        self.buckets = {}
+        for key in keys:
+            tokens, stamp = cache.get(key) or (self.burst, self.now)
+            self.buckets[key] = min(self.burst, tokens + (self.now - stamp) * self.per_second)
+
+    @property
+    def allowed(self):
+        return all(tokens >= 1 for tokens in self.buckets.values())
+
+    def spend(self):
+        # Long enough for an empty bucket to refill completely
+        timeout = int(self.burst / self.per_second) + 1 if self.per_second else None
+        for key, tokens in self.buckets.items():
+            cache.set(key, (max(tokens - 1, 0), self.now), timeout)
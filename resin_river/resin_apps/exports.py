@@ -0,0 +1,127 @@
+"""
+Streaming CSV/JSONL exports of items, orders and order items.
+
+Rows are read with values().iterator(chunk_size=EXPORT_CHUNK_SIZE) and
+encoded one at a time, so no model instances are built and memory stays
+flat whatever the table size. The same generators back the admin actions
+(StreamingHttpResponse) and `manage.py export_data`.
+"""
+import csv
+import json
+from datetime import datetime, time, timedelta
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import Items, Order, OrderItem
+
+EXPORT_CHUNK_SIZE = 2000
+
+# name -> (model, date field for --since/--until, [(column, values() lookup)])
+EXPORTS = {
+    'items': (Items, 'created_at', [
+        ('id', 'id'), ('slug', 'slug'), ('name', 'name'), ('category', 'Category__name'),
+        ('description', 'description'), ('price', 'price'), ('sale_price', 'sale_price'),
+        ('effective_price', 'effective_price'), ('available', 'available'), ('is_featured', 'is_featured'),
+        ('is_on_sale', 'is_on_sale'), ('is_latest_arrival', 'is_latest_arrival'),
+        ('display_order', 'display_order'), ('image1', 'image1'), ('image2', 'image2'), ('image3', 'image3'),
+        ('created_at', 'created_at'), ('updated_at', 'updated_at'),
+    ]),
+    'orders': (Order, 'created_at', [
+        ('id', 'id'), ('order_number', 'order_number'), ('username', 'user__username'),
+        ('guest_email', 'guest_email'), ('contact_email_phone', 'contact_email_phone'),
+        ('status', 'status'), ('payment_status', 'payment_status'), ('payment_method', 'payment_method__method_type'),
+        ('payment_transaction_id', 'payment_transaction_id'), ('discount_code', 'discount_code__code'),
+        ('subtotal', 'subtotal'), ('shipping_cost', 'shipping_cost'), ('tax_amount', 'tax_amount'),
+        ('discount_amount', 'discount_amount'), ('total', 'total'),
+        ('delivery_first_name', 'delivery_first_name'), ('delivery_last_name', 'delivery_last_name'),
+        ('delivery_address', 'delivery_address'), ('delivery_city', 'delivery_city'),
+        ('delivery_state', 'delivery_state'), ('delivery_postal_code', 'delivery_postal_code'),
+        ('delivery_country', 'delivery_country'), ('delivery_phone', 'delivery_phone'),
+        ('created_at', 'created_at'), ('paid_at', 'paid_at'), ('shipped_at', 'shipped_at'),
+        ('delivered_at', 'delivered_at'),
+    ]),
+    'order_items': (OrderItem, 'order__created_at', [
+        ('id', 'id'), ('order_number', 'order__order_number'), ('order_created_at', 'order__created_at'),
+        ('order_status', 'order__status'), ('item_id', 'item_id'), ('item_slug', 'item__slug'),
+        ('item_name', 'item_name'), ('item_price', 'item_price'), ('quantity', 'quantity'),
+        ('subtotal', 'subtotal'),
+    ]),
+}
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+
+
+def parse_bound(value, end=False):
+    """
+    Parse a --since/--until value. A date covers the whole day (an `end`
+    date includes that day); a datetime is used as given.
+    """
+    if not value:
+        return None
+    try:
+        day = parse_date(value)
+        moment = None if day else parse_datetime(value)
+    except ValueError:
+        day = moment = None
+    if day is not None:
+        moment = datetime.combine(day + timedelta(days=1) if end else day, time.min)
+    elif moment is None:
+        raise ValueError(f"Not a date or datetime: {value!r}")
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(name, queryset=None, since=None, until=None):
+    """Yield one dict per row of export `name` (optionally restricted to `queryset`), in pk order"""
+    model, date_field, columns = EXPORTS[name]
+    queryset = model._default_manager.all() if queryset is None else queryset
+    if since is not None:
+        queryset = queryset.filter(**{f'{date_field}__gte': since})
+    if until is not None:
+        queryset = queryset.filter(**{f'{date_field}__lt': until})
+    lookups = [lookup for _, lookup in columns]
+    for row in queryset.order_by('pk').values_list(*lookups).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {column: value for (column, _), value in zip(columns, row)}
+
+
+class _Echo:
+    """File-like object whose write() returns the line csv.writer produced"""
+
+    def write(self, value):
+        return value
+
+
+def _csv_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def render_csv(name, rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([column for column, _ in EXPORTS[name][2]])
+    for row in rows:
+        yield writer.writerow([_csv_value(value) for value in row.values()])
+
+
+def render_jsonl(name, rows):
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def render(name, fmt, rows):
+    """Encoded lines of `rows` in format `fmt` ('csv' or 'jsonl')"""
+    renderer = render_csv if fmt == 'csv' else render_jsonl
+    return renderer(name, rows)
+
+
+def streaming_export_response(name, fmt, queryset=None, since=None, until=None):
+    """StreamingHttpResponse downloading export `name` as `fmt`"""
+    response = StreamingHttpResponse(
+        render(name, fmt, export_rows(name, queryset, since, until)), content_type=FORMATS[fmt],
+    )
+    filename = f'{name}-{timezone.localdate():%Y%m%d}.{fmt}'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,165 @@
+"""
+Shop sidebar facets.
+
+Category, availability and price-bucket counts for the shop's current
+filters come from one GROUP BY category with conditional Counts. Each facet
+counts the items matching every *other* active filter (picking a category
+still shows what the other categories hold), and the per-category rows are
+summed in Python for the availability and price facets. The result, which
+also carries the listing total, is cached per normalized filter set and
+catalog version (see conditional.py).
+"""
+import hashlib
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min, OuterRef, Q, Subquery
+from .conditional import get_catalog_version
+from .models import Category, Items
+from .search import get_search_backend
+
+AVAILABILITY_CHOICES = ('in_stock', 'out_of_stock')
+
+
+def _price_buckets():
+    return getattr(settings, 'SHOP_PRICE_BUCKETS', (0, 50, 100, 250, 500, 1000))
+
+
+def _facets_timeout():
+    return getattr(settings, 'SHOP_FACETS_CACHE_TIMEOUT', 60 * 15)
+
+
+def _decimal(value):
+    try:
+        value = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return value.normalize() if value.is_finite() else None
+
+
+class ShopFilters:
+    """The facet-relevant part of a shop query string, normalized"""
+
+    def __init__(self, category=None, availability='', min_price=None, max_price=None, search=''):
+        self.category = category
+        self.availability = availability
+        self.min_price = min_price
+        self.max_price = max_price
+        self.search = search
+
+    @classmethod
+    def from_query(cls, params):
+        category = params.get('category', '')
+        availability = params.get('availability', '')
+        return cls(
+            category=int(category) if category.isdigit() else None,
+            availability=availability if availability in AVAILABILITY_CHOICES else '',
+            min_price=_decimal(params.get('min_price')) if params.get('min_price') else None,
+            max_price=_decimal(params.get('max_price')) if params.get('max_price') else None,
+            search=' '.join(params.get('search', '').split()),
+        )
+
+    def cache_key(self):
+        raw = repr((self.category, self.availability, self.min_price, self.max_price, self.search.lower()))
+        return 'shop:facets:%s:%s' % (get_catalog_version(), hashlib.md5(raw.encode()).hexdigest())
+
+    def availability_q(self):
+        # The shop only lists available items, so "out of stock" lists nothing
+        if self.availability == 'out_of_stock':
+            return Q(pk__in=[])
+        return Q(available=True)
+
+    def category_q(self):
+        return Q(Category_id=self.category) if self.category is not None else Q()
+
+    def price_q(self):
+        q = Q()
+        if self.min_price is not None:
+            q &= Q(effective_price__gte=self.min_price)
+        if self.max_price is not None:
+            q &= Q(effective_price__lte=self.max_price)
+        return q
+
+
+def _bucket_ranges():
+    edges = list(_price_buckets())
+    return [
+        (Decimal(low), Decimal(high) if high is not None else None)
+        for low, high in zip(edges, edges[1:] + [None])
+    ]
+
+
+def _build_facets(filters):
+    items = Items.objects.all()
+    if filters.search:
+        items = get_search_backend().filter_queryset(items, filters.search)
+
+    available, price = filters.availability_q(), filters.price_q()
+    buckets = _bucket_ranges()
+    aggregates = {
+        'listed': Count('id', filter=available & price),
+        'in_stock': Count('id', filter=Q(available=True) & price),
+        'out_of_stock': Count('id', filter=Q(available=False) & price),
+        'min_price': Min('effective_price', filter=available),
+        'max_price': Max('effective_price', filter=available),
+    }
+    for index, (low, high) in enumerate(buckets):
+        in_bucket = Q(effective_price__gte=low) & (Q(effective_price__lt=high) if high is not None else Q())
+        aggregates[f'bucket_{index}'] = Count('id', filter=available & in_bucket)
+    # Cover image for categories without one, as on the homepage, so the
+    # template doesn't query category.items per category
+    first_item_image = Items.objects.filter(
+        Category=OuterRef('Category_id')
+    ).order_by('display_order', '-created_at').values('image1')[:1]
+    rows = list(
+        items.values('Category_id', 'Category__name', 'Category__featured_image', 'Category__display_order')
+        .annotate(first_item_image=Subquery(first_item_image), **aggregates).order_by()
+    )
+
+    # Availability and price facets honour the category filter; the category
+    # facet itself does not
+    selected = [row for row in rows if filters.category is None or row['Category_id'] == filters.category]
+    prices = [row for row in selected if row['min_price'] is not None]
+
+    categories = []
+    for row in rows:
+        if row['Category_id'] is None or not row['listed']:
+            continue
+        category = Category(
+            id=row['Category_id'], name=row['Category__name'],
+            featured_image=row['Category__featured_image'], display_order=row['Category__display_order'],
+        )
+        category.item_count = row['listed']
+        category.first_item_image = row['first_item_image']
+        categories.append(category)
+    categories.sort(key=lambda category: (category.display_order, category.name))
+
+    return {
+        'categories': categories,
+        'in_stock_count': sum(row['in_stock'] for row in selected),
+        'out_of_stock_count': sum(row['out_of_stock'] for row in selected),
+        'price_range': {
+            'min_price': min((row['min_price'] for row in prices), default=None),
+            'max_price': max((row['max_price'] for row in prices), default=None),
+        },
+        'price_buckets': [
+            {
+                'min_price': low,
+                # Bucket edges are exclusive above; the filter is inclusive
+                'max_price': high - Decimal('0.01') if high is not None else None,
+                'count': sum(row[f'bucket_{index}'] for row in selected),
+            }
+            for index, (low, high) in enumerate(buckets)
+        ],
+        'total': sum(row['listed'] for row in selected),
+    }
+
+
+def get_shop_facets(filters):
+    """Facet counts and the listing total for `filters` (a ShopFilters), cached"""
+    key = filters.cache_key()
+    facets = cache.get(key)
+    if facets is None:
+        facets = _build_facets(filters)
+        cache.set(key, facets, _facets_timeout())
+    return facets
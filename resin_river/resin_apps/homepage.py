@@ -0,0 +1,138 @@
+"""
+Cached homepage data layer.
+
+The homepage context only changes when an admin edits the hero, homepage
+sections, testimonials, categories or items, so it is built once and kept in
+the cache until one of those models is saved or deleted (see signals.py),
+or items are written in bulk (ItemsQuerySet in models.py, e.g. imports).
+"""
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator, EmptyPage
+from django.db.models import Count, OuterRef, Subquery
+from .models import Items, Category, HomeHero, HomePageSection, Testimonial
+from .pagination import KeysetPaginator, InvalidCursor
+
+HOMEPAGE_VERSION_KEY = 'homepage:version'
+HOMEPAGE_ITEMS_PER_PAGE = 12
+
+
+def get_homepage_version():
+    """Return the current homepage cache version, initialising it if missing"""
+    version = cache.get(HOMEPAGE_VERSION_KEY)
+    if version is None:
+        cache.add(HOMEPAGE_VERSION_KEY, 1, timeout=None)
+        version = cache.get(HOMEPAGE_VERSION_KEY, 1)
+    return version
+
+
+def invalidate_homepage_cache():
+    """Bump the homepage cache version so every cached page is rebuilt"""
+    try:
+        cache.incr(HOMEPAGE_VERSION_KEY)
+    except ValueError:
+        cache.set(HOMEPAGE_VERSION_KEY, 1, timeout=None)
+
+
+def _homepage_timeout():
+    return getattr(settings, 'HOMEPAGE_CACHE_TIMEOUT', 60 * 15)
+
+
+def _build_sections():
+    """Build the page-independent homepage sections"""
+    # Get active hero (first by display_order, then by updated_at)
+    hero = HomeHero.objects.filter(is_active=True).first()
+
+    # Featured categories with their item count and a fallback cover image name,
+    # so the template does not query category.items per category
+    first_item_image = Items.objects.filter(
+        Category=OuterRef('pk')
+    ).order_by('display_order', '-created_at').values('image1')[:1]
+    featured_categories = list(
+        Category.objects.filter(is_featured=True).annotate(
+            item_count=Count('items'),
+            first_item_image=Subquery(first_item_image),
+        )[:5]
+    )
+
+    available = Items.objects.filter(available=True).order_by('display_order', '-created_at')
+
+    return {
+        'hero': hero,
+        'featured_categories': featured_categories,
+        'sale_items': list(available.filter(is_on_sale=True)),
+        'collection_items': list(available.filter(is_featured=True)),
+        'latest_arrivals': list(available.filter(is_latest_arrival=True)[:2]),
+        'promotional_banner': HomePageSection.objects.filter(section_type='promotional', is_active=True).first(),
+        'testimonial': Testimonial.objects.filter(is_active=True).first(),
+    }
+
+
+HOMEPAGE_ITEM_ORDERING = ('display_order', '-created_at', 'id')
+
+
+def _homepage_items():
+    return Items.objects.filter(available=True)
+
+
+def _build_items_page(page_number):
+    """Paginate available items and detach the page from its queryset"""
+    all_items = _homepage_items().order_by(*HOMEPAGE_ITEM_ORDERING)
+    paginator = Paginator(all_items, HOMEPAGE_ITEMS_PER_PAGE)
+    try:
+        page = paginator.page(page_number)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+
+    # count/num_pages are cached on the paginator at this point; drop the
+    # queryset so pickling the page doesn't evaluate the whole catalog
+    page.object_list = list(page.object_list)
+    paginator.object_list = []
+    return page
+
+
+def _items_keyset_paginator():
+    return KeysetPaginator(_homepage_items(), HOMEPAGE_ITEM_ORDERING, HOMEPAGE_ITEMS_PER_PAGE)
+
+
+def get_homepage_context(page_number=None, cursor=None):
+    """
+    Return the homepage template context, served from cache when possible.
+
+    The item grid is keyset-paginated by `cursor` unless settings select
+    numbered pages or a legacy `page_number` is given.
+    """
+    use_cursor = getattr(settings, 'CATALOG_PAGINATION', 'cursor') == 'cursor' and (cursor or page_number is None)
+    if use_cursor:
+        if cursor:
+            try:
+                _items_keyset_paginator().decode_cursor(cursor)
+            except InvalidCursor:
+                cursor = None
+        page_token = 'cursor:' + hashlib.md5(cursor.encode()).hexdigest() if cursor else 'cursor:first'
+    else:
+        try:
+            page_number = max(int(page_number), 1)
+        except (TypeError, ValueError):
+            page_number = 1
+        page_token = f'page:{page_number}'
+
+    version = get_homepage_version()
+    sections_key = f'homepage:{version}:sections'
+    page_key = f'homepage:{version}:{page_token}'
+
+    cached = cache.get_many([sections_key, page_key])
+    sections = cached.get(sections_key)
+    if sections is None:
+        sections = _build_sections()
+        cache.set(sections_key, sections, _homepage_timeout())
+
+    latest_posts_page = cached.get(page_key)
+    if latest_posts_page is None:
+        latest_posts_page = _items_keyset_paginator().page(cursor) if use_cursor else _build_items_page(page_number)
+        cache.set(page_key, latest_posts_page, _homepage_timeout())
+
+    context = dict(sections)
+    context['latest_posts_page'] = latest_posts_page
+    return context
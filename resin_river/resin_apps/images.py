@@ -0,0 +1,217 @@
+"""
+Resized WebP/JPEG derivatives of uploaded images.
+
+Every image field listed in IMAGE_FIELDS gets fixed-width variants (see
+VARIANTS) stored next to the original as `<name>.<variant>.<webp|jpg>`, e.g.
+`images/table.jpg` -> `images/table.jpg.card.webp`; keeping the original
+extension stops `table.jpg` and `table.png` sharing derivatives. Derivatives are generated
+when an image is uploaded (see signals.py) and backfilled by
+`manage.py generate_image_derivatives`. Templates use the `responsive_image`
+and `image_variant_url` tags, which fall back to the original upload until
+its derivatives exist.
+
+Uploads don't resize inside the saving request: signals.py queues an
+ImageJob and `manage.py process_image_jobs` works through the queue on a
+bounded process pool, recording status, timings and failures.
+"""
+import hashlib
+import io
+import time
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+from .models import ImageJob
+
+# Variant name -> target width in pixels, smallest first
+VARIANTS = {
+    'card': 400,
+    'detail': 900,
+    'zoom': 1600,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+# (app_label.model_name) -> image fields that get derivatives
+IMAGE_FIELDS = {
+    'resin_apps.items': ('image1', 'image2', 'image3'),
+    'resin_apps.homehero': ('image',),
+    'resin_apps.category': ('featured_image',),
+    'resin_apps.homepagesection': ('image',),
+}
+VARIANTS_CACHE_TIMEOUT = 60 * 60 * 24
+MISSING_CACHE_TIMEOUT = 60 * 5
+
+
+def variant_name(name, variant, extension):
+    """Storage name of one derivative of `name`"""
+    return f'{name}.{variant}.{extension}'
+
+
+def _variants_cache_key(name):
+    # v2: variant names keep the source extension
+    return 'images:variants:v2:' + hashlib.md5(name.encode()).hexdigest()
+
+
+def image_fields_for(instance):
+    """Names of the image fields on `instance` that get derivatives"""
+    return IMAGE_FIELDS.get(instance._meta.label_lower, ())
+
+
+def _flatten(image, background=(255, 255, 255)):
+    """RGB copy of `image` with any transparency composited onto white"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        flat = Image.new('RGB', image.size, background)
+        flat.paste(image, mask=image.getchannel('A'))
+        return flat
+    return image.convert('RGB')
+
+
+def generate_derivatives(name, storage=None):
+    """
+    Write every variant of the stored image `name` and return {variant: width}.
+
+    Variants wider than the original are skipped (the smallest is always
+    written). EXIF orientation is applied and metadata is not copied.
+    """
+    storage = storage or default_storage
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        largest = max(VARIANTS.values())
+        # Let the JPEG decoder downscale by a power of two while reading; a
+        # square box keeps enough pixels whichever way EXIF rotates the image
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    webp_source = image.convert('RGBA' if has_alpha else 'RGB')
+    jpeg_source = _flatten(image)
+
+    written = {}
+    for variant, width in VARIANTS.items():
+        if written and width > image.width:
+            break
+        width = min(width, image.width)
+        height = max(1, round(image.height * width / image.width))
+        for extension, options in FORMATS.items():
+            base = webp_source if extension == 'webp' else jpeg_source
+            resized = base.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            buffer = io.BytesIO()
+            resized.save(buffer, **options)
+            target = variant_name(name, variant, extension)
+            if storage.exists(target):
+                storage.delete(target)
+            storage.save(target, ContentFile(buffer.getvalue()))
+        written[variant] = width
+
+    remember_variants(name, written)
+    return written
+
+
+def remember_variants(name, variants):
+    cache.set(_variants_cache_key(name), variants, VARIANTS_CACHE_TIMEOUT)
+
+
+def delete_derivatives(name, storage=None):
+    storage = storage or default_storage
+    for variant in VARIANTS:
+        for extension in FORMATS:
+            target = variant_name(name, variant, extension)
+            if storage.exists(target):
+                storage.delete(target)
+    cache.delete(_variants_cache_key(name))
+
+
+def available_variants(name, storage=None):
+    """Return {variant: width} of the derivatives that exist for `name` (cached)"""
+    if not name:
+        return {}
+    key = _variants_cache_key(name)
+    variants = cache.get(key)
+    if variants is None:
+        storage = storage or default_storage
+        variants = {
+            variant: width for variant, width in VARIANTS.items()
+            if storage.exists(variant_name(name, variant, 'jpg'))
+        }
+        cache.set(key, variants, VARIANTS_CACHE_TIMEOUT if variants else MISSING_CACHE_TIMEOUT)
+    return variants
+
+
+def init_worker():
+    """Process pool initializer: configure Django in spawned workers"""
+    import django
+    django.setup()
+
+
+def generate_in_worker(name):
+    """Pool task: generate derivatives for `name`, returning (name, variants, error, seconds)"""
+    started = time.perf_counter()
+    try:
+        variants, error = generate_derivatives(name), None
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        variants, error = None, f'{type(e).__name__}: {e}'
+    return name, variants, error, time.perf_counter() - started
+
+
+def enqueue_derivatives(name):
+    """Queue derivative generation for `name` (no-op if a job is already pending)"""
+    if name:
+        ImageJob.objects.bulk_create([ImageJob(image=name)], ignore_conflicts=True)
+
+
+def claim_jobs(limit):
+    """Mark up to `limit` pending jobs as running and return them, oldest first"""
+    claimed = []
+    candidates = ImageJob.objects.filter(status=ImageJob.PENDING).order_by('created_at', 'id').values_list('id', flat=True)[:limit]
+    for pk in list(candidates):
+        # Conditional UPDATE so two workers never claim the same job
+        updated = ImageJob.objects.filter(pk=pk, status=ImageJob.PENDING).update(
+            status=ImageJob.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        if updated:
+            claimed.append(ImageJob.objects.get(pk=pk))
+    return claimed
+
+
+def _requeue(job, **fields):
+    """Put `job` back in the queue, or fail it if the image was queued again meanwhile"""
+    try:
+        with transaction.atomic():
+            ImageJob.objects.filter(pk=job.pk).update(status=ImageJob.PENDING, **fields)
+    except IntegrityError:
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.FAILED, finished_at=timezone.now(), error='Superseded by a newer job',
+        )
+
+
+def finish_job(job, variants=None, error=None, duration=None, max_attempts=3):
+    """Record the outcome of a claimed job; failures are retried up to `max_attempts`"""
+    if error is None:
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.DONE, finished_at=timezone.now(), duration=duration, error='',
+        )
+        # Workers may run against a per-process cache backend
+        remember_variants(job.image, variants)
+    elif job.attempts < max_attempts:
+        _requeue(job, error=error, duration=duration)
+    else:
+        ImageJob.objects.filter(pk=job.pk).update(
+            status=ImageJob.FAILED, finished_at=timezone.now(), duration=duration, error=error,
+        )
+
+
+def requeue_stale_jobs(older_than):
+    """Return jobs left running by a worker that died (started more than `older_than` seconds ago) to the queue"""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    stale = list(ImageJob.objects.filter(status=ImageJob.RUNNING, started_at__lt=cutoff))
+    for job in stale:
+        _requeue(job, error='Worker stopped before finishing')
+    return len(stale)
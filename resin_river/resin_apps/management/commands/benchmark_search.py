@@ -0,0 +1,87 @@
+import random
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from resin_apps.models import Category, Items
+from resin_apps.search import IcontainsSearchBackend, SQLiteFTSSearchBackend
+
+SYLLABLES = "ka lo mi ne ru sa te vi zo ba de fu gi ho ja".split()
+WORDS = (
+    "resin river walnut oak epoxy table coffee dining console shelf wall art "
+    "geode ocean blue emerald amber live edge slab bench stool lamp clock tray "
+    "coaster board serving handmade custom glossy matte marble pearl smoke gold"
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare FTS5 search with the old icontains query on a synthetic catalog. "
+        "Runs inside a transaction that is rolled back, so no data is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100000, help="Synthetic catalog size")
+        parser.add_argument('--queries', type=int, default=30, help="Number of search terms to time")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        # Real catalog text is Zipf-distributed: a few words are everywhere,
+        # most are rare. Rank 1 is the most common word.
+        self.vocabulary = WORDS + sorted({
+            ''.join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(4000)
+        })
+        self.weights = [1 / (rank + 1) for rank in range(len(self.vocabulary))]
+        with transaction.atomic():
+            self.build_catalog(rng, options['items'])
+            started = time.perf_counter()
+            SQLiteFTSSearchBackend().rebuild()
+            self.stdout.write(f"Built FTS index in {time.perf_counter() - started:.2f}s")
+
+            terms = [
+                ' '.join(rng.sample(self.vocabulary[:1500], rng.choice((1, 2))))
+                for _ in range(options['queries'])
+            ]
+            for backend in (IcontainsSearchBackend(), SQLiteFTSSearchBackend()):
+                self.report(backend, terms)
+            transaction.set_rollback(True)
+
+    def build_catalog(self, rng, count):
+        categories = Category.objects.bulk_create(
+            [Category(name=f"{rng.choice(WORDS).title()} {i}") for i in range(50)]
+        )
+        batch = []
+        for i in range(count):
+            batch.append(Items(
+                Category=rng.choice(categories),
+                name=' '.join(self.words(rng, 3)).title(),
+                description=' '.join(self.words(rng, 40)),
+                price=rng.randint(20, 2000),
+                image1='images/benchmark.jpg',
+                slug=f"benchmark-item-{i}",
+            ))
+            if len(batch) == 5000:
+                Items.objects.bulk_create(batch)
+                batch = []
+        Items.objects.bulk_create(batch)
+        self.stdout.write(f"Created {count} synthetic items")
+
+    def words(self, rng, count):
+        return rng.choices(self.vocabulary, weights=self.weights, k=count)
+
+    def report(self, backend, terms):
+        """Time what the shop does per search: the first page plus the total"""
+        timings = []
+        for term in terms:
+            started = time.perf_counter()
+            queryset = backend.filter_queryset(Items.objects.filter(available=True), term)
+            list(queryset.order_by('search_rank', 'id')[:12])
+            queryset.count()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(int(len(timings) * 0.95) - 1, 0)]
+        self.stdout.write(
+            f"{type(backend).__name__:<24} mean {statistics.mean(timings):8.2f} ms  "
+            f"median {statistics.median(timings):8.2f} ms  p95 {p95:8.2f} ms"
+        )
@@ -0,0 +1,126 @@
+import re
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from resin_apps.models import Category, Items, Order, Cart, CartItem, DiscountCode
+
+# Small admin-managed tables where a full scan is expected and cheap
+SMALL_TABLES = {
+    'resin_apps_category',
+    'resin_apps_homehero',
+    'resin_apps_homepagesection',
+    'resin_apps_testimonial',
+    'resin_apps_paymentmethod',
+    'resin_apps_shippingmethod',
+    'resin_apps_taxconfiguration',
+    'django_site',
+}
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?$')
+
+
+class Command(BaseCommand):
+    help = (
+        "Render the catalog and account views, run EXPLAIN QUERY PLAN on every "
+        "query they issue and fail if a hot query falls back to a full table scan. "
+        "Sample rows are created inside a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--allow-scan', action='append', default=[], help="Extra table allowed to be scanned")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print every plan, not only failures")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("check_query_plans reads SQLite EXPLAIN QUERY PLAN output")
+        # Sample rows are written with the current models
+        executor = MigrationExecutor(connection)
+        unapplied = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if unapplied:
+            raise CommandError(
+                f"The database has {len(unapplied)} unapplied migration(s); "
+                "run 'python manage.py migrate' first."
+            )
+        allowed = SMALL_TABLES | set(options['allow_scan'])
+
+        problems = []
+        checked = 0
+        with transaction.atomic():
+            pages = self.sample_pages()
+            for label, url, user in pages:
+                for sql in self.capture(url, user):
+                    plan = self.explain(sql)
+                    checked += 1
+                    scanned = [
+                        table for table in (self.full_scan_table(line) for line in plan)
+                        if table and table not in allowed
+                    ]
+                    if scanned:
+                        problems.append((label, sql, plan))
+                    elif options['verbose_plans']:
+                        self.stdout.write(f"[{label}] {sql}\n    " + "\n    ".join(plan))
+            transaction.set_rollback(True)
+
+        for label, sql, plan in problems:
+            self.stdout.write(self.style.ERROR(f"[{label}] full scan:\n  {sql}\n    " + "\n    ".join(plan)))
+        if problems:
+            raise CommandError(f"{len(problems)} of {checked} queries fall back to a full table scan")
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} queries across {len(pages)} pages: no full scans"))
+
+    def sample_pages(self):
+        """Make sure every view has rows to work with and list the URLs to render"""
+        category = Category.objects.create(name="Query plan check")
+        item = Items.objects.create(
+            Category=category, name="Query plan check", description="Query plan check",
+            price=Decimal('10.00'), image1='images/query-plan-check.jpg', slug='query-plan-check',
+        )
+        user = get_user_model().objects.create_user(username='query-plan-check')
+        Order.objects.create(
+            user=user, contact_email_phone='check@example.com', delivery_last_name='Check',
+            delivery_address='1 Check Way', delivery_city='Lagos', delivery_state='Lagos',
+            delivery_country='Nigeria', delivery_phone='000', subtotal=Decimal('10.00'), total=Decimal('10.00'),
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), item=item)
+        DiscountCode.objects.create(code='QUERY-PLAN-CHECK', discount_value=Decimal('10'))
+
+        shop = reverse('shop')
+        pages = [
+            ('index', reverse('index'), None),
+            ('item-details', reverse('item-details', kwargs={'slug': item.slug}), None),
+            ('cart-list', reverse('cart-list'), user),
+            ('checkout discount', f"{reverse('checkout')}?discount_code=query-plan-check", user),
+            ('order-history', reverse('order-history'), user),
+            ('user-dashboard', reverse('user-dashboard'), user),
+            ('shop category', f'{shop}?category={category.id}', None),
+            ('shop price filter', f'{shop}?min_price=5&max_price=50&sort=price_asc', None),
+            ('shop search', f'{shop}?search=check', None),
+        ]
+        for sort in ('display_order', 'name_asc', 'name_desc', 'price_asc', 'price_desc', 'newest'):
+            pages.append((f'shop sort={sort}', f'{shop}?sort={sort}', None))
+        return pages
+
+    def capture(self, url, user):
+        """Return the SELECTs issued while rendering `url` with caches disabled"""
+        dummy_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=dummy_cache, ALLOWED_HOSTS=['testserver']):
+            client = Client()
+            if user:
+                client.force_login(user)
+            with CaptureQueriesContext(connection) as context:
+                response = client.get(url)
+        if response.status_code != 200:
+            raise CommandError(f"{url} returned {response.status_code}")
+        return [query['sql'] for query in context.captured_queries if query['sql'].lstrip().upper().startswith('SELECT')]
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def full_scan_table(self, line):
+        match = FULL_SCAN_RE.match(line.strip())
+        return match.group(1) if match else None
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from resin_apps.exports import EXPORTS, FORMATS, export_rows, parse_bound, render
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream items, orders or order items to CSV or JSONL. --since/--until "
+        "take a date (whole day, inclusive) or a datetime."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(EXPORTS), help="What to export")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv', help="Output format")
+        parser.add_argument('--output', '-o', default='-', help="File to write, or - for stdout")
+        parser.add_argument('--since', help="Only rows created on or after this date/datetime")
+        parser.add_argument('--until', help="Only rows created up to this date (inclusive) or before this datetime")
+
+    def handle(self, *args, **options):
+        try:
+            since = parse_bound(options['since'])
+            until = parse_bound(options['until'], end=True)
+        except ValueError as e:
+            raise CommandError(e)
+
+        name, path = options['dataset'], options['output']
+        lines = render(name, options['format'], export_rows(name, since=since, until=until))
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        written = 0
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            for line in lines:
+                f.write(line)
+                written += 1
+        rows = written - 1 if options['format'] == 'csv' else written
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} {name} rows to {path}"))
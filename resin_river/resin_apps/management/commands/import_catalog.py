@@ -0,0 +1,42 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from resin_apps.catalog_import import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert items (by slug), categories and tags from a CSV or JSONL file. "
+        "Columns: slug, name, description, price, sale_price, category, tags, "
+        "image1-3, available, is_featured, is_on_sale, is_latest_arrival, "
+        "display_order; missing columns leave existing values alone."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or - for stdin")
+        parser.add_argument('--format', choices=('csv', 'jsonl'), help="Input format (default: from the file extension)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows written per transaction")
+        parser.add_argument('--tag-separator', default='|', help="Separator between tags in a CSV tags column")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+        importer = CatalogImporter(batch_size=max(options['batch_size'], 1))
+
+        def on_batch(stats):
+            self.stdout.write(f"{stats.rows} rows ({stats.rows_per_second:.0f} rows/s)")
+
+        def on_error(line_number, message):
+            self.stderr.write(f"line {line_number}: {message}")
+
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Can't open {path}: {e}")
+        with stream:
+            stats = importer.run(read_rows(stream, fmt, options['tag_separator']), on_batch, on_error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.rows} rows in {stats.elapsed:.2f}s ({stats.rows_per_second:.0f} rows/s): "
+            f"{stats.created} created, {stats.updated} updated, {stats.unchanged} unchanged, {stats.skipped} skipped, "
+            f"{stats.categories_created} categories and {stats.tags_created} tags created"
+        ))
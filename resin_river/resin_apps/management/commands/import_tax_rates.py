@@ -0,0 +1,37 @@
+import csv
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from resin_apps.catalog_import import TRUE_VALUES
+from resin_apps.tax import load_tax_rates
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert tax rates from a CSV with a header: country, state, tax_rate "
+        "and optionally is_active. A blank state is the country-wide rate."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV file to import, or - for stdin")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f"Can't open {path}: {e}")
+        with stream:
+            reader = csv.DictReader(stream)
+            missing = {'country', 'state', 'tax_rate'} - set(reader.fieldnames or ())
+            if missing:
+                raise CommandError(f"Missing columns: {', '.join(sorted(missing))}")
+            rows = (
+                (row['country'], row['state'], row['tax_rate'],
+                 (row.get('is_active') or 'true').strip().lower() in TRUE_VALUES)
+                for row in reader
+            )
+            try:
+                count = load_tax_rates(rows)
+            except ValueError as e:
+                raise CommandError(e)
+        self.stdout.write(self.style.SUCCESS(f"Loaded {count} tax rates"))
@@ -0,0 +1,68 @@
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from resin_apps.images import claim_jobs, finish_job, generate_in_worker, init_worker, requeue_stale_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        "Work through queued image jobs (resizing and re-encoding uploads) on a "
+        "bounded process pool. Runs until stopped unless --once is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1), help="Worker processes")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+        parser.add_argument('--poll-interval', type=float, default=5.0, help="Seconds between queue polls when idle")
+        parser.add_argument('--max-attempts', type=int, default=3, help="Attempts before a job is marked failed")
+        parser.add_argument('--stale-after', type=int, default=30 * 60, help="Seconds before a running job is assumed lost")
+
+    def handle(self, *args, **options):
+        workers = max(options['workers'], 1)
+        requeued = requeue_stale_jobs(options['stale_after'])
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} jobs left running by a previous worker")
+
+        processed = 0
+        while True:
+            try:
+                processed += self.run_pool(workers, options)
+                break
+            except BrokenProcessPool:
+                # A worker process died (e.g. out of memory); start a fresh pool
+                self.stderr.write("Worker process died; restarting the pool")
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} image jobs"))
+
+    def run_pool(self, workers, options):
+        processed = 0
+        in_flight = {}
+        # Keep the pool busy without claiming more jobs than it can start soon
+        limit = workers * 2
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+            try:
+                while True:
+                    close_old_connections()
+                    if len(in_flight) < limit:
+                        for job in claim_jobs(limit - len(in_flight)):
+                            in_flight[pool.submit(generate_in_worker, job.image)] = job
+                    if not in_flight:
+                        if options['once']:
+                            return processed
+                        time.sleep(options['poll_interval'])
+                        continue
+
+                    done, _ = wait(in_flight, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                    for future in done:
+                        job = in_flight.pop(future)
+                        _, variants, error, duration = future.result()
+                        finish_job(job, variants, error, duration, max_attempts=options['max_attempts'])
+                        processed += 1
+                        if error:
+                            self.stderr.write(f"{job.image}: {error}")
+            except BrokenProcessPool:
+                for job in in_flight.values():
+                    finish_job(job, error="Worker process died", max_attempts=options['max_attempts'])
+                raise
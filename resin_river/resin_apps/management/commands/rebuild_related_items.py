@@ -0,0 +1,17 @@
+import time
+from django.core.management.base import BaseCommand
+from resin_apps.related import rebuild_related_items
+
+
+class Command(BaseCommand):
+    help = "Rebuild the precomputed \"You May Also Like\" lists (only queued items unless --full)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Rebuild every item, not only the queued ones")
+        parser.add_argument('--batch-size', type=int, default=500, help="Items scored per batch")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rebuilt = rebuild_related_items(full=options['full'], batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt related items for {rebuilt} items in {elapsed:.2f}s"))
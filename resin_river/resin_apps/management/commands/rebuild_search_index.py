@@ -0,0 +1,19 @@
+import time
+from django.core.management.base import BaseCommand
+from resin_apps.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the shop search index from all items"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help="Rows inserted per batch")
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        started = time.perf_counter()
+        indexed = backend.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} items with {type(backend).__name__} in {elapsed:.2f}s"
+        ))
@@ -0,0 +1,154 @@
+"""
+Media file serving for MEDIA_URL.
+
+Replaces django.conf.urls.static (DEBUG-only, no caching headers, no
+ranges). Responses carry a strong ETag built from the file's mtime and size
+and a Last-Modified date, answer If-None-Match / If-Modified-Since with 304,
+honour single byte ranges (with If-Range) and send a public Cache-Control
+of MEDIA_MAX_AGE. Generated image variants get the same: their names carry
+no content hash and regeneration rewrites them in place, so caches
+revalidate them against the ETag like any other upload.
+
+With settings.MEDIA_SENDFILE set to 'x-accel-redirect' (nginx) or
+'x-sendfile' (Apache/lighttpd) the view only computes headers and hands the
+file body to the front-end server.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+def _max_age():
+    return getattr(settings, 'MEDIA_MAX_AGE', 60 * 60 * 24)
+
+
+def _not_modified(request, etag, mtime):
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = parse_etags(if_none_match)
+        return '*' in tags or etag in tags or f'W/{etag}' in tags
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def _byte_range(request, etag, mtime, size):
+    """
+    Return (start, end) for a satisfiable single Range header, None to send
+    the whole file, or False when the range can't be satisfied
+    """
+    header = request.META.get('HTTP_RANGE', '')
+    match = RANGE_RE.match(header.strip())
+    if not match or match.group(1) == match.group(2) == '':
+        # Absent, multi-range or malformed: a full response is always allowed
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range:
+        if_range_date = parse_http_date_safe(if_range)
+        if if_range != etag and (if_range_date is None or int(mtime) > if_range_date):
+            return None
+
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _offload_header(name, full_path):
+    """(header, value) handing the body to the front-end server, or None"""
+    mode = getattr(settings, 'MEDIA_SENDFILE', '')
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        return 'X-Accel-Redirect', posixpath.join(prefix, name)
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', full_path
+    return None
+
+
+@require_safe
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT with validators, ranges and optional sendfile offload"""
+    name = posixpath.normpath(path).lstrip('/')
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, name)
+        stat = os.stat(full_path)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404("File not found")
+    if not os.path.isfile(full_path):
+        raise Http404("File not found")
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': f'public, max-age={_max_age()}',
+        'Accept-Ranges': 'bytes',
+    }
+    if _not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+        for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+            response[header] = headers[header]
+        return response
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+
+    offload = _offload_header(name, full_path)
+    if offload:
+        # The front-end server handles Range itself for offloaded responses
+        header, value = offload
+        headers[header] = value
+        return HttpResponse(content_type=content_type, headers=headers)
+
+    byte_range = _byte_range(request, etag, stat.st_mtime, stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416, headers=headers)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return response
+
+    if byte_range is None:
+        start, end, status = 0, stat.st_size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+    length = end - start + 1
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, status=status, headers=headers)
+    elif status == 200:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+    else:
+        response = StreamingHttpResponse(
+            _read_range(full_path, start, length), content_type=content_type, status=status, headers=headers,
+        )
+    if status == 206:
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = str(length)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,32 @@
+"""
+Project middleware.
+"""
+from importlib import import_module
+from django.conf import settings
+from django.urls import reverse
+
+
+class StatelessApiMiddleware:
+    """
+    Give JSON API requests a throwaway session. Nothing in the API depends
+    on the visitor, but middleware further in (allauth's AccountMiddleware
+    reads the session after every 2xx response) would otherwise mark the
+    real one accessed, so SessionMiddleware would add Vary: Cookie and
+    shared caches wouldn't store the public responses. Goes right after
+    SessionMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.SessionStore = import_module(settings.SESSION_ENGINE).SessionStore
+
+    def __call__(self, request):
+        if not request.path_info.startswith(reverse('api-root')):
+            return self.get_response(request)
+        session = request.session
+        # Never saved: SessionMiddleware only looks at the original
+        request.session = self.SessionStore()
+        try:
+            return self.get_response(request)
+        finally:
+            request.session = session
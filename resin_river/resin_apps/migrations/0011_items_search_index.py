@@ -0,0 +1,35 @@
+from django.db import migrations
+
+FTS_TABLE = 'resin_apps_items_fts'
+
+
+def create_search_index(apps, schema_editor):
+    """Create and fill the FTS5 shop search index (SQLite only)"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "name, description, category, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+    )
+    schema_editor.execute(
+        f"INSERT INTO {FTS_TABLE} (rowid, name, description, category) "
+        "SELECT i.id, i.name, i.description, COALESCE(c.name, '') "
+        "FROM resin_apps_items i LEFT JOIN resin_apps_category c ON c.id = i.Category_id"
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0010_savedaddress'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
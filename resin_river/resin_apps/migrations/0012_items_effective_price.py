@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 13:04
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def backfill_effective_price(apps, schema_editor):
+    """Fill effective_price in id-ordered batches so large catalogs use bounded memory"""
+    Items = apps.get_model('resin_apps', 'Items')
+    last_id = 0
+    while True:
+        batch = list(
+            Items.objects.filter(id__gt=last_id).order_by('id').only('id', 'price', 'sale_price')[:BATCH_SIZE]
+        )
+        if not batch:
+            break
+        for item in batch:
+            if item.sale_price is not None and item.sale_price > 0:
+                item.effective_price = item.sale_price
+            else:
+                item.effective_price = item.price
+        Items.objects.bulk_update(batch, ['effective_price'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0011_items_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='items',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, help_text='Price charged (sale price if set, else price); kept in sync automatically', max_digits=10),
+        ),
+        migrations.RunPython(backfill_effective_price, migrations.RunPython.noop),
+        # Index after the backfill so the bulk writes don't maintain it row by row
+        migrations.AlterField(
+            model_name='items',
+            name='effective_price',
+            field=models.DecimalField(db_index=True, decimal_places=2, default=0, editable=False, help_text='Price charged (sale price if set, else price); kept in sync automatically', max_digits=10),
+        ),
+    ]
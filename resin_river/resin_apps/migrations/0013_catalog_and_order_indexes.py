@@ -0,0 +1,63 @@
+# Generated by Django 5.2 on 2026-10-18 13:06
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0012_items_effective_price'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True)), fields=['display_order', '-created_at', 'id'], name='items_avail_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True)), fields=['effective_price', 'id'], name='items_avail_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True)), fields=['name', 'id'], name='items_avail_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True)), fields=['-created_at', '-id'], name='items_avail_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True)), fields=['Category', 'display_order', '-created_at', 'id'], name='items_avail_cat_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True), ('is_on_sale', True)), fields=['display_order', '-created_at'], name='items_sale_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True), ('is_featured', True)), fields=['display_order', '-created_at'], name='items_featured_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(condition=models.Q(('available', True), ('is_latest_arrival', True)), fields=['display_order', '-created_at'], name='items_latest_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='items',
+            index=models.Index(fields=['available'], name='items_available_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'payment_status'], name='order_user_payment_idx'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2 on 2026-10-18 13:08
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def mark_all_items_stale(apps, schema_editor):
+    """Queue every existing item so the first rebuild_related_items run fills the table"""
+    Items = apps.get_model('resin_apps', 'Items')
+    StaleRelatedItems = apps.get_model('resin_apps', 'StaleRelatedItems')
+    StaleRelatedItems.objects.bulk_create(
+        (StaleRelatedItems(item_id=pk) for pk in Items.objects.values_list('id', flat=True).iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0013_catalog_and_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StaleRelatedItems',
+            fields=[
+                ('item', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='resin_apps.items')),
+                ('marked_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RelatedItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveSmallIntegerField()),
+                ('score', models.FloatField()),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='resin_apps.items')),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_from', to='resin_apps.items')),
+            ],
+            options={
+                'ordering': ['item', 'rank'],
+                'constraints': [models.UniqueConstraint(fields=('item', 'rank'), name='related_item_rank_uniq')],
+            },
+        ),
+        migrations.RunPython(mark_all_items_stale, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2 on 2026-10-18 13:11
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_total_quantity(apps, schema_editor):
+    Cart = apps.get_model('resin_apps', 'Cart')
+    CartItem = apps.get_model('resin_apps', 'CartItem')
+    item_total = CartItem.objects.filter(cart=OuterRef('pk')).values('cart').annotate(
+        total=Sum('quantity')
+    ).values('total')
+    Cart.objects.update(total_quantity=Coalesce(Subquery(item_total), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0014_related_items'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='total_quantity',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Sum of item quantities, shown on the header badge'),
+        ),
+        migrations.RunPython(backfill_total_quantity, migrations.RunPython.noop),
+    ]
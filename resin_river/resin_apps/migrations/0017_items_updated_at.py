@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+def backfill_updated_at(apps, schema_editor):
+    """Start existing items at their creation time rather than the migration time"""
+    Items = apps.get_model('resin_apps', 'Items')
+    Items.objects.filter(created_at__isnull=False).update(updated_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0016_image_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='items',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.RunPython(backfill_updated_at, migrations.RunPython.noop),
+    ]
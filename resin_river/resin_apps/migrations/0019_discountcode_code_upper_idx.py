@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 13:43
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0018_category_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discountcode',
+            index=models.Index(django.db.models.functions.text.Upper('code'), name='discountcode_code_upper_idx'),
+        ),
+    ]
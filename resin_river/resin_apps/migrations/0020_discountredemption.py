@@ -0,0 +1,47 @@
+# Generated by Django 5.2 on 2026-10-18 13:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_redemptions(apps, schema_editor):
+    Order = apps.get_model('resin_apps', 'Order')
+    DiscountRedemption = apps.get_model('resin_apps', 'DiscountRedemption')
+    orders = Order.objects.filter(discount_code__isnull=False).values_list('id', 'discount_code_id', 'user_id', 'guest_email')
+    DiscountRedemption.objects.bulk_create([
+        DiscountRedemption(
+            order_id=order_id, discount_id=discount_id, user_id=user_id,
+            email='' if user_id else (guest_email or '').strip().lower(),
+        )
+        for order_id, discount_id, user_id, guest_email in orders.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resin_apps', '0019_discountcode_code_upper_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiscountRedemption',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(blank=True, help_text='Lower-cased guest email (guest orders only)', max_length=254)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('discount', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='redemptions', to='resin_apps.discountcode')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='discount_redemption', to='resin_apps.order')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='discount_redemptions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Discount Redemption',
+                'verbose_name_plural': 'Discount Redemptions',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['discount', 'user'], name='redemption_discount_user_idx'), models.Index(fields=['discount', 'email'], name='redemption_discount_email_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_redemptions, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models.functions import Coalesce, Upper
+from django.db.models.lookups import GreaterThan
 from django.conf import settings
+from django.utils import timezone
 
 # Create your models here.
 
@@ -14,6 +17,7 @@ class Category(models.Model):
     display_order = models.PositiveIntegerField(default=0, help_text="Order in which categories appear (lower numbers first)")
     featured_image = models.ImageField(upload_to='categories/', blank=True, null=True, help_text="Optional: Custom image for homepage display")
     description = models.TextField(blank=True, help_text="Description for homepage collections section")
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -23,12 +27,82 @@ class Category(models.Model):
         return self.name
 
 
+def effective_price_expression(values=None):
+    """SQL for the effective price, optionally from the values an UPDATE is writing"""
+    values = values or {}
+    price = values.get('price', models.F('price'))
+    sale_price = values.get('sale_price', models.F('sale_price'))
+    if not hasattr(price, 'resolve_expression'):
+        price = models.Value(price, output_field=models.DecimalField())
+    if not hasattr(sale_price, 'resolve_expression'):
+        sale_price = models.Value(sale_price, output_field=models.DecimalField())
+    return models.Case(
+        models.When(GreaterThan(sale_price, 0), then=sale_price),
+        default=price,
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+    )
+
+
+NAV_FIELDS = {'available', 'Category', 'Category_id'}
+
+
+def _invalidate_catalog_caches(nav=False):
+    # Bulk writes send no signals; see conditional.py, homepage.py and navigation.py
+    from .conditional import invalidate_catalog
+    from .homepage import invalidate_homepage_cache
+    invalidate_catalog()
+    invalidate_homepage_cache()
+    if nav:
+        from .navigation import invalidate_nav_categories
+        invalidate_nav_categories()
+
+
+class ItemsQuerySet(models.QuerySet):
+    """Keeps updated_at, the denormalized effective_price and catalog caches in sync on bulk writes"""
+
+    def update(self, **kwargs):
+        if 'price' in kwargs or 'sale_price' in kwargs:
+            kwargs['effective_price'] = effective_price_expression(kwargs)
+        kwargs.setdefault('updated_at', timezone.now())
+        rows = super().update(**kwargs)
+        if rows:
+            _invalidate_catalog_caches(nav=bool(NAV_FIELDS.intersection(kwargs)))
+        return rows
+    update.alters_data = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.effective_price = obj.compute_effective_price()
+        created = super().bulk_create(objs, *args, **kwargs)
+        if created:
+            _invalidate_catalog_caches(nav=True)
+        return created
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if 'price' in fields or 'sale_price' in fields:
+            for obj in objs:
+                obj.effective_price = obj.compute_effective_price()
+            fields = list(fields) + ['effective_price']
+        if 'updated_at' not in fields:
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            fields = list(fields) + ['updated_at']
+        rows = super().bulk_update(objs, fields, *args, **kwargs)
+        if rows:
+            _invalidate_catalog_caches(nav=bool(NAV_FIELDS.intersection(fields)))
+        return rows
+
+
 class Items(models.Model):
     Category = models.ForeignKey(Category, related_name='items', on_delete= models.SET_NULL, null=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
     sale_price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True, help_text="If set, item will appear in Sale section")
+    effective_price = models.DecimalField(max_digits=10, decimal_places=2, default=0, db_index=True, editable=False, help_text="Price charged (sale price if set, else price); kept in sync automatically")
     image1 = models.ImageField(upload_to='images/')
     image2 = models.ImageField(upload_to='images/', blank=True, null=True)
     image3 = models.ImageField(upload_to='images/', blank=True, null=True)
@@ -39,14 +113,46 @@ class Items(models.Model):
     is_latest_arrival = models.BooleanField(default=False, help_text="Show in Latest Arrivals section")
     display_order = models.PositiveIntegerField(default=0, help_text="Order in product listings (lower numbers first)")
     created_at = models.DateTimeField(auto_now_add=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
     slug = models.SlugField(default="", unique=True, null=True)
+
+    objects = ItemsQuerySet.as_manager()
     
     class Meta:
         verbose_name_plural = 'Items'
         ordering = ['display_order', '-created_at']
+        # Listings always filter on available and seek/sort on one of the
+        # shop orderings; see `manage.py check_query_plans`
+        indexes = [
+            models.Index(fields=['display_order', '-created_at', 'id'], condition=models.Q(available=True), name='items_avail_order_idx'),
+            models.Index(fields=['effective_price', 'id'], condition=models.Q(available=True), name='items_avail_price_idx'),
+            models.Index(fields=['name', 'id'], condition=models.Q(available=True), name='items_avail_name_idx'),
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(available=True), name='items_avail_newest_idx'),
+            models.Index(fields=['Category', 'display_order', '-created_at', 'id'], condition=models.Q(available=True), name='items_avail_cat_order_idx'),
+            models.Index(fields=['display_order', '-created_at'], condition=models.Q(available=True, is_on_sale=True), name='items_sale_order_idx'),
+            models.Index(fields=['display_order', '-created_at'], condition=models.Q(available=True, is_featured=True), name='items_featured_order_idx'),
+            models.Index(fields=['display_order', '-created_at'], condition=models.Q(available=True, is_latest_arrival=True), name='items_latest_order_idx'),
+            models.Index(fields=['available'], name='items_available_idx'),
+        ]
 
     def __str__(self):
         return self.name
+
+    def compute_effective_price(self):
+        """The price charged: sale price when one is set, else list price"""
+        if self.sale_price is not None and self.sale_price > 0:
+            return self.sale_price
+        return self.price
+
+    def save(self, *args, **kwargs):
+        self.effective_price = self.compute_effective_price()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            update_fields = set(update_fields) | {'updated_at'}
+            if 'price' in update_fields or 'sale_price' in update_fields:
+                update_fields.add('effective_price')
+            kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
     
     @property
     def discount_percentage(self):
@@ -59,12 +165,22 @@ class Items(models.Model):
 
 class Cart(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='cart')
+    total_quantity = models.PositiveIntegerField(default=0, editable=False, help_text="Sum of item quantities, shown on the header badge")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"Cart({self.user.username})"
 
+    def sync_total_quantity(self):
+        """Recompute total_quantity from the cart's items in a single UPDATE"""
+        item_total = CartItem.objects.filter(cart=models.OuterRef('pk')).values('cart').annotate(
+            total=models.Sum('quantity')
+        ).values('total')
+        Cart.objects.filter(pk=self.pk).update(
+            total_quantity=Coalesce(models.Subquery(item_total), 0)
+        )
+
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
@@ -264,6 +380,11 @@ class Order(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Order'
         verbose_name_plural = 'Orders'
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['user', 'payment_status'], name='order_user_payment_idx'),
+        ]
     
     def __str__(self):
         return f"Order {self.order_number} - {self.get_status_display()}"
@@ -296,6 +417,29 @@ class OrderItem(models.Model):
         return f"{self.item_name} x {self.quantity} - Order {self.order.order_number}"
 
 
+class RelatedItem(models.Model):
+    """Precomputed "You May Also Like" entry; rebuilt by `manage.py rebuild_related_items`"""
+    item = models.ForeignKey(Items, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(Items, on_delete=models.CASCADE, related_name='related_from')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        ordering = ['item', 'rank']
+        constraints = [
+            models.UniqueConstraint(fields=['item', 'rank'], name='related_item_rank_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.item_id} -> {self.related_id} ({self.score:g})"
+
+
+class StaleRelatedItems(models.Model):
+    """Items whose related-items inputs (tags, category, orders) changed since the last rebuild"""
+    item = models.OneToOneField(Items, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    marked_at = models.DateTimeField(auto_now=True)
+
+
 class ShippingMethod(models.Model):
     """Model for configurable shipping methods"""
     name = models.CharField(max_length=100, help_text="Shipping method name (e.g., 'Standard Shipping', 'Express')")
@@ -391,11 +535,13 @@ class DiscountCode(models.Model):
         ordering = ['-created_at']
         verbose_name = 'Discount Code'
         verbose_name_plural = 'Discount Codes'
+        # Case-insensitive code lookups (see discounts.py)
+        indexes = [models.Index(Upper('code'), name='discountcode_code_upper_idx')]
     
     def __str__(self):
         return f"{self.code} - {self.get_discount_type_display()}"
     
-    def is_valid(self, user=None, order_total=None):
+    def is_valid(self, user=None, order_total=None, email=None):
         """Check if discount code is valid"""
         if not self.is_active:
             return False, "This discount code is not active."
@@ -412,6 +558,17 @@ class DiscountCode(models.Model):
         if self.usage_limit and self.usage_count >= self.usage_limit:
             return False, "This discount code has reached its usage limit."
         
+        # Check per-user limit (signed-in user, else guest email)
+        if self.per_user_limit and self.pk:
+            if user is not None and user.is_authenticated:
+                used = self.redemptions.filter(user=user).count()
+            elif email:
+                used = self.redemptions.filter(email=email.strip().lower()).count()
+            else:
+                used = 0
+            if used >= self.per_user_limit:
+                return False, "You have already used this discount code."
+        
         # Check minimum order total
         if self.minimum_order_total and order_total and order_total < self.minimum_order_total:
             return False, f"Minimum order total of ${self.minimum_order_total} required for this code."
@@ -430,6 +587,27 @@ class DiscountCode(models.Model):
         return discount
 
 
+class DiscountRedemption(models.Model):
+    """One use of a discount code, counted for per_user_limit (see discounts.redeem_discount)"""
+    discount = models.ForeignKey(DiscountCode, on_delete=models.CASCADE, related_name='redemptions')
+    order = models.OneToOneField(Order, on_delete=models.CASCADE, related_name='discount_redemption')
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='discount_redemptions')
+    email = models.CharField(max_length=254, blank=True, help_text="Lower-cased guest email (guest orders only)")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Discount Redemption'
+        verbose_name_plural = 'Discount Redemptions'
+        indexes = [
+            models.Index(fields=['discount', 'user'], name='redemption_discount_user_idx'),
+            models.Index(fields=['discount', 'email'], name='redemption_discount_email_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.discount_id} on order {self.order_id}"
+
+
 class SavedAddress(models.Model):
     """Model for saving user delivery addresses"""
     ADDRESS_TYPE_CHOICES = [
@@ -471,4 +649,40 @@ class SavedAddress(models.Model):
         # If this is set as default, unset other default addresses for this user
         if self.is_default:
             SavedAddress.objects.filter(user=self.user, is_default=True).exclude(id=self.id).update(is_default=False)
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+
+class ImageJob(models.Model):
+    """Queued derivative generation for one uploaded image; see `manage.py process_image_jobs`"""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    image = models.CharField(max_length=255, help_text="Storage name of the original upload")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    duration = models.FloatField(null=True, blank=True, help_text="Processing time in seconds")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='imagejob_status_created_idx'),
+        ]
+        constraints = [
+            # At most one queued job per image
+            models.UniqueConstraint(fields=['image'], condition=models.Q(status='pending'), name='imagejob_one_pending_per_image'),
+        ]
+
+    def __str__(self):
+        return f"{self.image} ({self.status})"
@@ -0,0 +1,82 @@
+"""
+Cached navigation categories.
+
+The nav menu is rendered by every page (including cart, checkout, account
+and error pages) through categories_context, but the category list and its
+available-item counts only change when an admin edits catalog data. The list
+is cached under a version key in the shared cache and memoized per process,
+so a render costs one cache read of the version. Signals (see signals.py)
+and bulk Items writes bump the version; with a shared cache backend (see
+settings.CACHES) every worker picks the change up on its next render.
+"""
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from .models import Category
+
+NAV_VERSION_KEY = 'nav:categories:version'
+NAV_CATEGORIES_LIMIT = 10
+
+# Per-process (version, expires, categories) copy of the last list read
+# from the shared cache; replaced as a whole so threads never see a mix
+_local = (None, 0, None)
+
+
+def _nav_timeout():
+    return getattr(settings, 'NAV_CATEGORIES_CACHE_TIMEOUT', 60 * 60)
+
+
+def get_nav_version():
+    """Return the current nav categories version, initialising it if missing"""
+    version = cache.get(NAV_VERSION_KEY)
+    if version is None:
+        # Seed from the clock, not 1, so a version evicted from the cache
+        # can't come back as a value some worker has already memoized
+        cache.add(NAV_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(NAV_VERSION_KEY, 0)
+    return version
+
+
+def _bump_nav_version():
+    try:
+        cache.incr(NAV_VERSION_KEY)
+    except ValueError:
+        cache.set(NAV_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_nav_categories():
+    """
+    Drop the cached nav categories now and again once the current
+    transaction commits, so a worker that rebuilt the list from
+    uncommitted-to-it data in between doesn't keep it
+    """
+    _bump_nav_version()
+    transaction.on_commit(_bump_nav_version)
+
+
+def _build_nav_categories():
+    return list(
+        Category.objects.annotate(
+            item_count=Count('items', filter=Q(items__available=True))
+        ).filter(item_count__gt=0).order_by('display_order', 'name')[:NAV_CATEGORIES_LIMIT]
+    )
+
+
+def get_nav_categories():
+    """Return the nav category list (annotated with item_count), served from cache"""
+    global _local
+    version = get_nav_version()
+    local_version, expires, categories = _local
+    if local_version == version and expires > time.monotonic():
+        return categories
+
+    key = f'nav:categories:{version}'
+    categories = cache.get(key)
+    if categories is None:
+        categories = _build_nav_categories()
+        cache.set(key, categories, _nav_timeout())
+
+    _local = (version, time.monotonic() + _nav_timeout(), categories)
+    return categories
@@ -0,0 +1,215 @@
+"""
+Keyset (cursor) pagination for catalog listings.
+
+Django's Paginator runs a COUNT(*) and an OFFSET scan, so deep pages get
+slower as the catalog grows. KeysetPaginator instead seeks past the last row
+of the previous page using the active sort tuple, so page N costs the same as
+page 1. The exact total becomes an optional, cached estimate (cached_count).
+"""
+import base64
+import binascii
+import hashlib
+import json
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
+from django.db.models import F, Q
+
+CURSOR_PARAM = 'cursor'
+COUNT_CACHE_TIMEOUT = 60 * 5
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        # Keep full precision; DjangoJSONEncoder truncates microseconds
+        return value.isoformat()
+    return value
+
+
+class KeysetPage:
+    """A page of results plus the cursors needed to move either way"""
+    cursor_mode = True
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset by seeking on an ordering tuple.
+
+    The last key must be unique (normally 'id' or '-id') so every row has a
+    distinct position. Keys may be model fields or annotations on the
+    queryset; nullable keys sort NULL as the lowest value.
+    """
+
+    def __init__(self, queryset, ordering, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.keys = []
+        for name in ordering:
+            desc = name.startswith('-')
+            field_name = name.lstrip('-')
+            try:
+                field = queryset.model._meta.get_field(field_name)
+            except FieldDoesNotExist:
+                # Annotated keys (e.g. search_rank) seek on their output field
+                field = queryset.query.annotations[field_name].output_field
+            self.keys.append((field_name, desc, field))
+
+    def _order_by(self, reverse=False):
+        order = []
+        for name, desc, field in self.keys:
+            descending = desc != reverse
+            if field.null:
+                expression = F(name).desc(nulls_last=True) if descending else F(name).asc(nulls_first=True)
+                order.append(expression)
+            else:
+                order.append(f'-{name}' if descending else name)
+        return order
+
+    def _beyond(self, values, reverse=False):
+        """Q object matching rows strictly after `values` in scan order"""
+        condition = Q(pk__in=[])
+        equal = Q()
+        for (name, desc, field), value in zip(self.keys, values):
+            increasing = desc == reverse
+            if value is None:
+                step = Q(**{f'{name}__isnull': False}) if increasing else Q(pk__in=[])
+                same = Q(**{f'{name}__isnull': True})
+            else:
+                step = Q(**{f'{name}__gt' if increasing else f'{name}__lt': value})
+                if field.null and not increasing:
+                    step |= Q(**{f'{name}__isnull': True})
+                same = Q(**{name: value})
+            condition |= equal & step
+            equal &= same
+        return condition
+
+    def encode_cursor(self, obj, reverse=False):
+        payload = {
+            'r': int(reverse),
+            'k': [_encode_value(getattr(obj, name)) for name, _, _ in self.keys],
+        }
+        raw = json.dumps(payload, separators=(',', ':')).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            raw_values = payload['k']
+            reverse = bool(payload.get('r'))
+            if len(raw_values) != len(self.keys):
+                raise InvalidCursor(cursor)
+            values = [
+                None if value is None else field.to_python(value)
+                for (_, _, field), value in zip(self.keys, raw_values)
+            ]
+        except (ValueError, KeyError, TypeError, AttributeError, binascii.Error, ValidationError) as e:
+            raise InvalidCursor(cursor) from e
+        return values, reverse
+
+    def page(self, cursor=None):
+        """Return the page after (or, for a reverse cursor, before) `cursor`"""
+        values, reverse = (None, False)
+        if cursor:
+            try:
+                values, reverse = self.decode_cursor(cursor)
+            except InvalidCursor:
+                values, reverse = (None, False)
+
+        queryset = self.queryset.order_by(*self._order_by(reverse))
+        if values is not None:
+            queryset = queryset.filter(self._beyond(values, reverse))
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+
+        if reverse:
+            if not rows:
+                return self.page()
+            rows.reverse()
+            next_cursor = self.encode_cursor(rows[-1])
+            previous_cursor = self.encode_cursor(rows[0], reverse=True) if has_more else None
+        else:
+            next_cursor = self.encode_cursor(rows[-1]) if has_more else None
+            previous_cursor = self.encode_cursor(rows[0], reverse=True) if values is not None and rows else None
+        return KeysetPage(rows, next_cursor, previous_cursor)
+
+
+def cached_count(queryset, timeout=COUNT_CACHE_TIMEOUT):
+    """
+    Return queryset.count(), cached by its SQL for `timeout` seconds.
+
+    Used as a cheap total for cursor-paginated listings; it may lag behind
+    catalog edits by up to `timeout`.
+    """
+    sql, params = queryset.query.sql_with_params()
+    digest = hashlib.md5(f'{sql}|{params!r}'.encode()).hexdigest()
+    key = f'catalog:count:{digest}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+def paginate_catalog(request, queryset, ordering, per_page, total=None):
+    """
+    Paginate a catalog listing according to settings.CATALOG_PAGINATION.
+
+    Returns (page, total). In 'cursor' mode total is a cached estimate (or
+    None when settings.CATALOG_TOTALS is off); legacy ?page=N links without a
+    cursor are still served by the numbered Paginator. A `total` the caller
+    already knows (e.g. from the shop facets) saves the COUNT query.
+    """
+    mode = getattr(settings, 'CATALOG_PAGINATION', 'cursor')
+    cursor = request.GET.get(CURSOR_PARAM)
+    if mode == 'cursor' and (cursor or 'page' not in request.GET):
+        page = KeysetPaginator(queryset, ordering, per_page).page(cursor)
+        if not getattr(settings, 'CATALOG_TOTALS', True):
+            total = None
+        elif total is None:
+            total = cached_count(queryset)
+        return page, total
+
+    paginator = Paginator(queryset.order_by(*ordering), per_page)
+    if total is not None:
+        paginator.count = total
+    page_number = request.GET.get('page', 1)
+    try:
+        page = paginator.page(page_number)
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+    return page, paginator.count
@@ -0,0 +1,253 @@
+"""
+Cart pricing.
+
+CartPricer loads the visitor's cart once and prices it: line totals,
+subtotal, shipping, tax and discount, returned as a CartQuote. A signed-in
+user's cart is one select_related query and a session cart one id__in
+query. The pricer is memoized on the request and its quotes per set of
+checkout choices, so the cart page, checkout (which prices the cart more
+than once per POST) and the header badge share a single load.
+
+Quotes are also cached across requests for CART_QUOTE_CACHE_TIMEOUT
+seconds, keyed by the cart version, the catalog version (prices), the
+discount, tax and shipping versions (see discounts.py, tax.py and
+shipping.py) and the checkout choices, so the AJAX recalculations on the
+checkout page are a cache hit. A signed-in cart's version is a per-user
+cache key bumped by every CartItem write (signals.py; bulk cart writes call
+invalidate_cart themselves); a session cart's version is a hash of its
+contents.
+"""
+import hashlib
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.functional import cached_property
+from .conditional import get_catalog_version
+from .discounts import get_discount_code, get_discount_version
+from .models import CartItem, Items
+from .shipping import get_shipping_table, get_shipping_version
+from .tax import get_tax_rate, get_tax_version
+
+ZERO = Decimal('0')
+CART_VERSION_KEY = 'cart:version:%s'
+
+
+def _quote_timeout():
+    return getattr(settings, 'CART_QUOTE_CACHE_TIMEOUT', 60)
+
+
+def _get_version(key):
+    """Version stored at `key`, initialised from the clock; None if the cache doesn't keep it"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    previous = cache.get(key) or 0
+    cache.set(key, max(time.time_ns(), previous + 1), timeout=None)
+
+
+def _invalidate(key):
+    # Again on commit, so a quote cached mid-transaction isn't kept
+    _bump_version(key)
+    transaction.on_commit(lambda: _bump_version(key))
+
+
+def invalidate_cart(user_id):
+    """Mark a signed-in user's cart changed (drops its cached quotes)"""
+    _invalidate(CART_VERSION_KEY % user_id)
+
+
+def get_cart_version(request):
+    """Version of the request's cart, or None if it can't be cached"""
+    user = request.user
+    if user.is_authenticated:
+        return _get_version(CART_VERSION_KEY % user.pk)
+    session = request.session
+    if session.get('cart_list') and not session.get('cart_dict'):
+        # Not yet migrated to cart_dict; loading the cart rewrites the session
+        return None
+    return hashlib.md5(repr(sorted(session.get('cart_dict', {}).items())).encode()).hexdigest()
+
+
+class CartQuote:
+    """Prices of one cart for one set of checkout choices"""
+
+    def __init__(self, cart_items, subtotal, shipping, shipping_method, tax_rate, estimated_tax,
+                 discount_amount, applied_discount, discount_error=None):
+        self.cart_items = cart_items
+        self.subtotal = subtotal
+        self.shipping = shipping
+        self.shipping_method = shipping_method
+        self.tax_rate = tax_rate
+        self.estimated_tax = estimated_tax
+        self.discount_amount = discount_amount
+        self.applied_discount = applied_discount
+        # Why a code that exists was rejected (None if applied or unknown)
+        self.discount_error = discount_error
+        self.total = max(subtotal + shipping + estimated_tax - discount_amount, ZERO)
+
+    @property
+    def item_count(self):
+        return sum(line['quantity'] for line in self.cart_items)
+
+
+class CartPricer:
+    """The request's cart, loaded once, and its quotes"""
+
+    def __init__(self, request):
+        self.request = request
+        self._quotes = {}
+
+    @classmethod
+    def for_request(cls, request):
+        pricer = getattr(request, '_cart_pricer', None)
+        if pricer is None:
+            pricer = request._cart_pricer = cls(request)
+        return pricer
+
+    @classmethod
+    def loaded_for(cls, request):
+        """The request's pricer if it has already loaded the cart, else None"""
+        pricer = getattr(request, '_cart_pricer', None)
+        return pricer if pricer is not None and 'cart_items' in pricer.__dict__ else None
+
+    def _user(self):
+        user = self.request.user
+        return user if user.is_authenticated else None
+
+    @cached_property
+    def cart_items(self):
+        """
+        Cart lines as dicts: item, quantity, item_total and cart_item_id
+        (signed-in carts) or item_id (session carts)
+        """
+        lines = []
+        user = self._user()
+        if user is not None:
+            for cart_item in CartItem.objects.filter(cart__user=user).select_related('item').order_by('id'):
+                lines.append({
+                    'item': cart_item.item,
+                    'quantity': cart_item.quantity,
+                    'item_total': cart_item.item.effective_price * cart_item.quantity,
+                    'cart_item_id': cart_item.id,
+                })
+            return lines
+
+        session = self.request.session
+        cart_dict = session.get('cart_dict', {})
+        # Migrate old cart_list format to cart_dict if needed
+        cart_list = session.get('cart_list', [])
+        if cart_list and not cart_dict:
+            for item_id in cart_list:
+                cart_dict[str(item_id)] = cart_dict.get(str(item_id), 0) + 1
+            session['cart_dict'] = cart_dict
+            del session['cart_list']
+            session.modified = True
+        if cart_dict:
+            item_ids = [int(item_id) for item_id in cart_dict]
+            for item in Items.objects.filter(id__in=item_ids, available=True):
+                quantity = cart_dict.get(str(item.id), 0)
+                if quantity > 0:
+                    lines.append({
+                        'item': item,
+                        'quantity': quantity,
+                        'item_total': item.effective_price * quantity,
+                        'item_id': item.id,
+                    })
+        return lines
+
+    @cached_property
+    def subtotal(self):
+        return sum((line['item_total'] for line in self.cart_items), ZERO)
+
+    @cached_property
+    def item_count(self):
+        return sum(line['quantity'] for line in self.cart_items)
+
+    def invalidate(self):
+        """Forget the loaded cart and quotes (after changing the cart mid-request)"""
+        for name in ('cart_items', 'subtotal', 'item_count'):
+            self.__dict__.pop(name, None)
+        self._quotes.clear()
+
+    def shipping_options(self, country=None):
+        """[{'method', 'cost'}] for the methods that ship to `country`, for this cart"""
+        return get_shipping_table().options_for(country, self.subtotal, self.item_count)
+
+    def shipping_for(self, shipping_method_id=None, country=None):
+        """
+        (method, cost) for the chosen method if it ships to `country`, else
+        the first method that does
+        """
+        methods = get_shipping_table().methods_for(country)
+        method = None
+        if shipping_method_id:
+            method = next((m for m in methods if str(m.id) == str(shipping_method_id)), None)
+        if method is None and methods:
+            method = methods[0]
+        if method is None:
+            return None, ZERO
+        return method, method.calculate_cost(self.subtotal, self.item_count)
+
+    def tax_rate_for(self, country, state=None):
+        """Tax rate for a destination: the state's rate, else the country-wide one"""
+        return get_tax_rate(country, state)
+
+    def discount_for(self, code):
+        """(discount, None) if `code` applies to this cart, else (None, reason or None if unknown)"""
+        discount = get_discount_code(code)
+        if discount is None:
+            return None, None
+        is_valid, message = discount.is_valid(user=self._user(), order_total=self.subtotal)
+        return (discount, None) if is_valid else (None, message)
+
+    def _quote_cache_key(self, choices):
+        versions = (
+            get_cart_version(self.request), get_catalog_version(), get_discount_version(),
+            get_tax_version(), get_shipping_version(),
+        )
+        if None in versions:
+            return None
+        owner = self.request.user.pk if self.request.user.is_authenticated else 'session'
+        raw = repr((owner, versions, choices))
+        return 'cart:quote:%s' % hashlib.md5(raw.encode()).hexdigest()
+
+    def quote(self, shipping_method_id=None, discount_code=None, delivery_country=None, delivery_state=None):
+        """CartQuote for these checkout choices; memoized per request and cached briefly"""
+        key = (
+            str(shipping_method_id or ''), (discount_code or '').strip().lower(),
+            (delivery_country or '').strip().lower(), (delivery_state or '').strip().lower(),
+        )
+        if key in self._quotes:
+            return self._quotes[key]
+        cache_key = self._quote_cache_key(key)
+        quote = cache.get(cache_key) if cache_key else None
+        if quote is not None:
+            # Later quotes and the badge reuse the cached lines
+            self.__dict__.setdefault('cart_items', quote.cart_items)
+        else:
+            subtotal = self.subtotal
+            shipping_method, shipping = self.shipping_for(shipping_method_id, delivery_country)
+            tax_rate = self.tax_rate_for(delivery_country, delivery_state)
+            discount, discount_error = self.discount_for(discount_code)
+            quote = CartQuote(
+                cart_items=self.cart_items,
+                subtotal=subtotal,
+                shipping=shipping,
+                shipping_method=shipping_method,
+                tax_rate=tax_rate,
+                estimated_tax=subtotal * tax_rate,
+                discount_amount=discount.calculate_discount(subtotal) if discount else ZERO,
+                applied_discount=discount,
+                discount_error=discount_error,
+            )
+            if cache_key:
+                cache.set(cache_key, quote, _quote_timeout())
+        self._quotes[key] = quote
+        return quote
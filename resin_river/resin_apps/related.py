@@ -0,0 +1,220 @@
+"""
+Precomputed "You May Also Like" lists.
+
+Candidates are scored by shared tags, co-purchase (orders containing both
+items) and same category, and the best RELATED_ITEMS_K per item are stored
+in RelatedItem so the product page reads them with one indexed lookup.
+Signals (see signals.py) queue items whose inputs change in
+StaleRelatedItems; `manage.py rebuild_related_items` rebuilds only those,
+plus the items whose lists point at them, unless --full is given. Order
+lines are queued per transaction instead (`mark_order_stale`): a checkout
+saving N lines costs one lookup and one upsert at commit, not N of each.
+"""
+import heapq
+import threading
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .conditional import invalidate_catalog
+from .models import Items, OrderItem, RelatedItem, StaleRelatedItems
+
+TAG_WEIGHT = 3.0
+CO_PURCHASE_WEIGHT = 2.0
+CATEGORY_WEIGHT = 1.0
+ITEM_ORDERING = ('display_order', '-created_at', 'id')
+# Orders that never completed say nothing about what goes together
+IGNORED_ORDER_STATUSES = ('cancelled', 'refunded')
+
+
+def _top_k():
+    return getattr(settings, 'RELATED_ITEMS_K', 8)
+
+
+def mark_stale(item_ids):
+    """Queue items for the next incremental rebuild"""
+    item_ids = {pk for pk in item_ids if pk is not None}
+    if not item_ids:
+        return
+    now = timezone.now()
+    StaleRelatedItems.objects.bulk_create(
+        [StaleRelatedItems(item_id=pk, marked_at=now) for pk in item_ids],
+        update_conflicts=True,
+        unique_fields=['item'],
+        update_fields=['marked_at'],
+    )
+
+
+_pending = threading.local()
+
+
+def _flush_order_stale():
+    order_ids, item_ids = _pending.__dict__.pop('orders', (set(), set()))
+    # Only items that still exist; a line's item may have been deleted since
+    mark_stale(
+        Items.objects.filter(Q(pk__in=item_ids) | Q(order_items__order_id__in=order_ids))
+        .values_list('pk', flat=True).distinct()
+    )
+
+
+def mark_order_stale(order_id, item_id):
+    """
+    Queue every item of the order once the current transaction commits;
+    `item_id` is queued even if its line is gone by then
+    """
+    connection = transaction.get_connection()
+    if any(func is _flush_order_stale for _, func, _ in connection.run_on_commit):
+        order_ids, item_ids = _pending.orders
+        order_ids.add(order_id)
+        item_ids.add(item_id)
+    else:
+        # First line in this transaction; anything left over was rolled back
+        _pending.orders = ({order_id}, {item_id})
+        transaction.on_commit(_flush_order_stale)
+
+
+def get_related_items(item, limit=4):
+    """Return up to `limit` available related items, falling back to the category before the first build"""
+    related = list(
+        Items.objects.filter(related_from__item=item, available=True).order_by('related_from__rank')[:limit]
+    )
+    if related or RelatedItem.objects.filter(item=item).exists():
+        return related
+    return list(
+        Items.objects.filter(Category=item.Category_id, available=True)
+        .exclude(pk=item.pk).order_by(*ITEM_ORDERING)[:limit]
+    )
+
+
+class RelatedItemsBuilder:
+    """Scores and stores related items for a batch of item ids"""
+
+    def __init__(self, k=None):
+        self.k = k or _top_k()
+
+    def score(self, item_ids):
+        """Return {item_id: [(related_id, score), ...]} best first"""
+        item_ids = list(item_ids)
+        items = dict(Items.objects.filter(id__in=item_ids).values_list('id', 'Category'))
+        scores = {pk: Counter() for pk in items}
+
+        # Shared tags, counted against available items only
+        through = Items.Tag.through
+        item_tags = defaultdict(set)
+        for pk, tag_id in through.objects.filter(items_id__in=items).values_list('items_id', 'tag_id'):
+            item_tags[pk].add(tag_id)
+        tag_members = defaultdict(list)
+        candidate_category = {}
+        tag_rows = through.objects.filter(
+            tag_id__in=through.objects.filter(items_id__in=items).values('tag_id'), items__available=True,
+        ).values_list('tag_id', 'items_id', 'items__Category')
+        for tag_id, pk, category_id in tag_rows:
+            tag_members[tag_id].append(pk)
+            candidate_category[pk] = category_id
+        for pk, tags in item_tags.items():
+            for tag_id in tags:
+                scores[pk].update(dict.fromkeys(tag_members[tag_id], TAG_WEIGHT))
+
+        # Co-purchase: one point per order that contains both items
+        order_lines = OrderItem.objects.exclude(order__status__in=IGNORED_ORDER_STATUSES)
+        item_orders = defaultdict(set)
+        for pk, order_id in order_lines.filter(item_id__in=items).values_list('item_id', 'order_id'):
+            item_orders[pk].add(order_id)
+        order_members = defaultdict(set)
+        order_rows = order_lines.filter(
+            order_id__in=order_lines.filter(item_id__in=items).values('order_id'), item__available=True,
+        ).values_list('order_id', 'item_id', 'item__Category')
+        for order_id, pk, category_id in order_rows:
+            order_members[order_id].add(pk)
+            candidate_category[pk] = category_id
+        for pk, orders in item_orders.items():
+            for order_id in orders:
+                scores[pk].update(dict.fromkeys(order_members[order_id], CO_PURCHASE_WEIGHT))
+
+        # Same category: a small boost for scored candidates, and the first
+        # k+1 items in listing order as filler for sparsely tagged items
+        category_ids = {category_id for category_id in items.values() if category_id is not None}
+        category_head = {
+            category_id: list(
+                Items.objects.filter(Category=category_id, available=True)
+                .order_by(*ITEM_ORDERING).values_list('id', flat=True)[:self.k + 1]
+            )
+            for category_id in category_ids
+        }
+
+        result = {}
+        for pk, category_id in items.items():
+            candidates = scores[pk]
+            candidates.pop(pk, None)
+            for candidate in candidates:
+                if category_id is not None and candidate_category.get(candidate) == category_id:
+                    candidates[candidate] += CATEGORY_WEIGHT
+            head = category_head.get(category_id, [])
+            position = {candidate: index for index, candidate in enumerate(head)}
+            for candidate in head:
+                if candidate != pk and candidate not in candidates:
+                    candidates[candidate] = CATEGORY_WEIGHT
+            best = heapq.nsmallest(
+                self.k, candidates.items(),
+                key=lambda entry: (-entry[1], position.get(entry[0], len(head)), entry[0]),
+            )
+            result[pk] = best
+        return result
+
+    def build(self, item_ids):
+        """Rebuild and store the lists for `item_ids`; returns the rows written"""
+        item_ids = list(item_ids)
+        scored = self.score(item_ids)
+        rows = [
+            RelatedItem(item_id=pk, related_id=related_id, rank=rank, score=score)
+            for pk, best in scored.items()
+            for rank, (related_id, score) in enumerate(best)
+        ]
+        with transaction.atomic():
+            RelatedItem.objects.filter(item_id__in=item_ids).delete()
+            RelatedItem.objects.bulk_create(rows)
+        return rows
+
+
+def rebuild_related_items(full=False, batch_size=500):
+    """
+    Rebuild stored related-items lists and return the number of items rebuilt.
+
+    Incremental runs rebuild the queued items, every item whose list points
+    at one of them, and the new neighbours of the queued items (scores are
+    symmetric, so those lists may now include a queued item). Neighbours are
+    not propagated any further.
+    """
+    builder = RelatedItemsBuilder()
+    started = timezone.now()
+    if full:
+        pending = list(Items.objects.order_by('id').values_list('id', flat=True))
+    else:
+        stale = list(StaleRelatedItems.objects.values_list('item_id', flat=True))
+        pending = set(stale)
+        for start in range(0, len(stale), batch_size):
+            chunk = stale[start:start + batch_size]
+            pending.update(RelatedItem.objects.filter(related_id__in=chunk).values_list('item_id', flat=True))
+        pending = sorted(pending)
+
+    rebuilt = set()
+    neighbours = set()
+    for start in range(0, len(pending), batch_size):
+        chunk = pending[start:start + batch_size]
+        rows = builder.build(chunk)
+        rebuilt.update(chunk)
+        if not full:
+            neighbours.update(row.related_id for row in rows)
+    extra = sorted(neighbours - rebuilt)
+    for start in range(0, len(extra), batch_size):
+        chunk = extra[start:start + batch_size]
+        builder.build(chunk)
+        rebuilt.update(chunk)
+
+    # Anything queued while we were running stays queued for the next run
+    StaleRelatedItems.objects.filter(marked_at__lte=started).delete()
+    if rebuilt:
+        # Product pages show these lists; drop their ETags
+        invalidate_catalog()
+    return len(rebuilt)
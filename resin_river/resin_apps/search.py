@@ -0,0 +1,146 @@
+"""
+Shop search backends.
+
+The default backend on SQLite keeps an FTS5 index of item name, description
+and category name, updated incrementally from model signals (see signals.py)
+and rebuilt in bulk by `manage.py rebuild_search_index`. Other databases fall
+back to the original icontains query. A different backend can be selected
+with settings.SEARCH_BACKEND (dotted path to a SearchBackend subclass).
+"""
+import re
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+from .models import Items
+
+FTS_TABLE = 'resin_apps_items_fts'
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class SearchBackend:
+    """Base class for shop search backends"""
+
+    def filter_queryset(self, queryset, query):
+        """Restrict an Items queryset to matches, annotated with search_rank (lower is better)"""
+        raise NotImplementedError
+
+    def index_items(self, items):
+        """Add or refresh the given items in the index"""
+
+    def remove_items(self, item_ids):
+        """Drop the given item ids from the index"""
+
+    def rebuild(self, batch_size=2000):
+        """Rebuild the whole index; returns the number of items indexed"""
+        return 0
+
+
+class IcontainsSearchBackend(SearchBackend):
+    """Unindexed substring search over name, description and category"""
+
+    def filter_queryset(self, queryset, query):
+        return queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query) |
+            Q(Category__name__icontains=query)
+        ).annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+
+class SQLiteFTSSearchBackend(SearchBackend):
+    """
+    SQLite FTS5 index ranked with bm25 (name weighted over category and
+    description). The best SEARCH_MAX_RANKED matches are ordered by relevance,
+    any further matches follow in id order.
+    """
+    rank_expression = f'bm25({FTS_TABLE}, 10.0, 1.0, 5.0)'
+
+    @staticmethod
+    def build_match(query):
+        """Turn free text into an FTS5 query: every word must prefix-match"""
+        tokens = TOKEN_RE.findall(query)
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def filter_queryset(self, queryset, query):
+        match = self.build_match(query)
+        if not match:
+            return queryset.none().annotate(search_rank=Value(0.0, output_field=FloatField()))
+
+        # Rank once inside FTS5 (one pass over the matches) and carry the top
+        # positions into the ORM; a correlated bm25() per row is quadratic
+        limit = getattr(settings, 'SEARCH_MAX_RANKED', 500)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY {self.rank_expression} LIMIT %s',
+                [match, limit],
+            )
+            ranked_ids = [row[0] for row in cursor.fetchall()]
+
+        rank = Case(
+            *[When(id=pk, then=Value(float(position))) for position, pk in enumerate(ranked_ids)],
+            default=Value(float(limit)),
+            output_field=FloatField(),
+        )
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match])
+        ).annotate(search_rank=rank)
+
+    def _rows(self, queryset):
+        return queryset.values_list('id', 'name', 'description', 'Category__name')
+
+    def _insert(self, cursor, rows):
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, name, description, category) VALUES (%s, %s, %s, %s)',
+            [(pk, name, description, category or '') for pk, name, description, category in rows],
+        )
+
+    def index_items(self, items):
+        ids = [item.pk if hasattr(item, 'pk') else item for item in items]
+        if not ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in ids])
+            self._insert(cursor, self._rows(Items.objects.filter(id__in=ids)))
+
+    def remove_items(self, item_ids):
+        item_ids = list(item_ids)
+        if not item_ids:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in item_ids])
+
+    def rebuild(self, batch_size=2000):
+        indexed = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            batch = []
+            for row in self._rows(Items.objects.order_by('id')).iterator(chunk_size=batch_size):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    self._insert(cursor, batch)
+                    indexed += len(batch)
+                    batch = []
+            if batch:
+                self._insert(cursor, batch)
+                indexed += len(batch)
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+        return indexed
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Return the configured search backend (FTS5 on SQLite, icontains otherwise)"""
+    global _backend
+    if _backend is None:
+        backend_path = getattr(settings, 'SEARCH_BACKEND', None)
+        if backend_path:
+            _backend = import_string(backend_path)()
+        elif connection.vendor == 'sqlite':
+            _backend = SQLiteFTSSearchBackend()
+        else:
+            _backend = IcontainsSearchBackend()
+    return _backend
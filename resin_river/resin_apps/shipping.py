@@ -0,0 +1,145 @@
+"""
+Compiled shipping-rate table.
+
+ShippingMethod.available_countries is free text ("US, ca,GB"), so checkout
+never filtered by it. The active methods are compiled once into a table
+with, for every country named anywhere, the methods that ship there
+(restricted and unrestricted together, in display order), plus the
+unrestricted methods for every other destination. Finding the eligible
+methods and their costs for a destination is then one dict lookup. Codes
+are case-folded and whitespace-collapsed, as in tax.py, and country names
+(the checkout field is free text, "United States" by default) are mapped to
+their ISO 3166 codes on both sides, so "US" and "United States" match. Like the tax table,
+it lives in the shared cache under a version key, is memoized per process,
+and ShippingMethod signals bump the version for every worker (which needs
+the shared cache required by the resin_apps.E001 check). The per-process
+copy also expires after SHIPPING_TABLE_CACHE_TIMEOUT as a safety net.
+"""
+import functools
+import time
+from importlib import resources
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import ShippingMethod
+from .tax import normalize_region
+
+SHIPPING_VERSION_KEY = 'shipping:rates:version'
+
+# Per-process (version, expires, table) copy of the last table read from the
+# shared cache; replaced as a whole so threads never see a mix
+_local = (None, 0, None)
+
+
+def _shipping_timeout():
+    return getattr(settings, 'SHIPPING_TABLE_CACHE_TIMEOUT', 60 * 60)
+
+
+# Names shoppers type that aren't the tz database's name for the country
+COUNTRY_ALIASES = {
+    'usa': 'US', 'u.s.': 'US', 'u.s.a.': 'US', 'united states of america': 'US', 'america': 'US',
+    'uk': 'GB', 'u.k.': 'GB', 'united kingdom': 'GB', 'great britain': 'GB', 'britain': 'GB',
+    'england': 'GB', 'scotland': 'GB', 'wales': 'GB', 'northern ireland': 'GB',
+    'south korea': 'KR', 'north korea': 'KP', 'russian federation': 'RU', 'holland': 'NL',
+    'czech republic': 'CZ', 'ivory coast': 'CI', 'vatican': 'VA', 'uae': 'AE',
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _country_names():
+    """{normalized country name: normalized ISO 3166 code}"""
+    try:
+        # Shipped with the tzdata requirement
+        table = resources.files('tzdata').joinpath('zoneinfo/iso3166.tab').read_text(encoding='utf-8')
+    except (ModuleNotFoundError, OSError):
+        table = ''
+    names = {}
+    for line in table.splitlines():
+        if line and not line.startswith('#'):
+            code, name = line.split('\t', 1)
+            names[normalize_region(name)] = normalize_region(code)
+            names.setdefault(normalize_region(name.replace('&', 'and')), normalize_region(code))
+    names.update((name, normalize_region(code)) for name, code in COUNTRY_ALIASES.items())
+    return names
+
+
+def country_code(value):
+    """Normalized ISO code for a country given by code or name ('United States' -> 'us')"""
+    value = normalize_region(value)
+    return _country_names().get(value, value)
+
+
+def parse_countries(value):
+    """Normalized country codes from an available_countries value (empty = everywhere)"""
+    return {code for code in (country_code(part) for part in (value or '').split(',')) if code}
+
+
+def get_shipping_version():
+    """Return the current shipping table version, initialising it if missing"""
+    version = cache.get(SHIPPING_VERSION_KEY)
+    if version is None:
+        cache.add(SHIPPING_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(SHIPPING_VERSION_KEY, 0)
+    return version
+
+
+def _bump_shipping_version():
+    try:
+        cache.incr(SHIPPING_VERSION_KEY)
+    except ValueError:
+        cache.set(SHIPPING_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_shipping_rates():
+    """Reload the shipping table everywhere, now and once the current transaction commits"""
+    _bump_shipping_version()
+    transaction.on_commit(_bump_shipping_version)
+
+
+class ShippingTable:
+    """Active shipping methods indexed by the countries they ship to"""
+
+    def __init__(self, methods):
+        # methods: active ShippingMethods in display order
+        self.methods = methods
+        restrictions = [(method, parse_countries(method.available_countries)) for method in methods]
+        self.everywhere = [method for method, countries in restrictions if not countries]
+        codes = set().union(*(countries for _, countries in restrictions))
+        self.by_country = {
+            code: [method for method, countries in restrictions if not countries or code in countries]
+            for code in codes
+        }
+
+    def methods_for(self, country):
+        """Methods that ship to `country`; every method if the destination isn't known yet"""
+        country = country_code(country)
+        if not country:
+            return self.methods
+        return self.by_country.get(country, self.everywhere)
+
+    def options_for(self, country, order_total, item_count):
+        """[{'method', 'cost'}] for the methods that ship to `country`"""
+        return [
+            {'method': method, 'cost': method.calculate_cost(order_total, item_count)}
+            for method in self.methods_for(country)
+        ]
+
+
+def _build_table():
+    return ShippingTable(list(ShippingMethod.objects.filter(is_active=True).order_by('display_order', 'name')))
+
+
+def get_shipping_table():
+    global _local
+    version = get_shipping_version()
+    local_version, expires, table = _local
+    if local_version == version and expires > time.monotonic():
+        return table
+
+    key = f'shipping:rates:{version}'
+    table = cache.get(key)
+    if table is None:
+        table = _build_table()
+        cache.set(key, table, _shipping_timeout())
+    _local = (version, time.monotonic() + _shipping_timeout(), table)
+    return table
@@ -2,8 +2,21 @@
 Django signals for cart migration and other post-login actions
 """
 from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, post_save, post_delete, pre_delete, m2m_changed
 from django.dispatch import receiver
-from .models import Cart, CartItem, Items
+from .models import Cart, CartItem, Items, Category, HomeHero, HomePageSection, Testimonial, Order, OrderItem, RelatedItem, Tag, ShippingMethod, TaxConfiguration, DiscountCode
+from .homepage import invalidate_homepage_cache
+from .search import get_search_backend
+from .related import mark_order_stale, mark_stale
+from .navigation import invalidate_nav_categories
+from .conditional import invalidate_catalog
+from .discounts import invalidate_discounts
+from .pricing import invalidate_cart
+from .shipping import invalidate_shipping_rates
+from .tax import invalidate_tax_rates
+from .images import enqueue_derivatives, image_fields_for
 
 
 @receiver(user_logged_in)
@@ -27,36 +40,265 @@ def migrate_session_cart_to_database(sender, request, user, **kwargs):
     if not cart_dict:
         return  # No session cart to migrate
     
-    # Get or create user's database cart
-    cart, _ = Cart.objects.get_or_create(user=user)
-    
-    # Migrate items from session to database
-    migrated_count = 0
+    quantities = {}
     for item_id_str, quantity in cart_dict.items():
         try:
-            item_id = int(item_id_str)
-            item = Items.objects.get(id=item_id, available=True)
-            
-            # Get or create cart item
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                item=item
-            )
-            
-            if created:
-                cart_item.quantity = quantity
-            else:
-                # Add to existing quantity
-                cart_item.quantity += quantity
-            
-            cart_item.save()
-            migrated_count += 1
-        except (ValueError, Items.DoesNotExist):
+            quantities[int(item_id_str)] = quantity
+        except ValueError:
             continue  # Skip invalid items
     
+    # A fixed number of queries whatever the cart size: the items still on
+    # sale, the lines already in the database cart, then one bulk insert and
+    # one bulk update (bulk writes send no signals, hence the manual sync)
+    with transaction.atomic():
+        cart, _ = Cart.objects.get_or_create(user=user)
+        available = set(Items.objects.filter(id__in=quantities, available=True).values_list('id', flat=True))
+        item_ids = [item_id for item_id in quantities if item_id in available]
+        existing = {cart_item.item_id: cart_item for cart_item in CartItem.objects.filter(cart=cart, item_id__in=item_ids)}
+        for item_id, cart_item in existing.items():
+            # Add to existing quantity
+            cart_item.quantity = F('quantity') + quantities[item_id]
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, item_id=item_id, quantity=quantities[item_id])
+            for item_id in item_ids if item_id not in existing
+        ])
+        CartItem.objects.bulk_update(existing.values(), ['quantity'])
+        if item_ids:
+            cart.sync_total_quantity()
+            invalidate_cart(user.pk)
+    migrated_count = len(item_ids)
+    
     # Clear session cart after migration
     if migrated_count > 0:
         request.session.pop('cart_dict', None)
         request.session.pop('cart_list', None)
         request.session.modified = True
 
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def sync_cart_total_quantity(sender, instance, **kwargs):
+    """
+    Keep the header badge counter (Cart.total_quantity) in step with cart rows
+    """
+    Cart(pk=instance.cart_id).sync_total_quantity()
+
+
+@receiver(post_save, sender=CartItem)
+@receiver(post_delete, sender=CartItem)
+def invalidate_cart_quotes(sender, instance, **kwargs):
+    """
+    Cached checkout quotes key off the cart version
+    """
+    if CartItem.cart.is_cached(instance):
+        user_id = instance.cart.user_id
+    else:
+        user_id = Cart.objects.filter(pk=instance.cart_id).values_list('user_id', flat=True).first()
+    if user_id is not None:
+        invalidate_cart(user_id)
+
+
+@receiver(post_save, sender=DiscountCode)
+@receiver(post_delete, sender=DiscountCode)
+def invalidate_discounts_on_change(sender, **kwargs):
+    """
+    Drop cached code lookups (including unknown codes) and quotes
+    """
+    invalidate_discounts()
+
+
+@receiver(post_save, sender=ShippingMethod)
+@receiver(post_delete, sender=ShippingMethod)
+def invalidate_shipping_rates_on_change(sender, **kwargs):
+    """
+    Reload the compiled shipping table (and with it every cached quote)
+    """
+    invalidate_shipping_rates()
+
+
+@receiver(post_save, sender=TaxConfiguration)
+@receiver(post_delete, sender=TaxConfiguration)
+def invalidate_tax_rates_on_change(sender, **kwargs):
+    """
+    Reload the compiled tax table (and with it every cached quote)
+    """
+    invalidate_tax_rates()
+
+
+@receiver(post_save, sender=HomeHero)
+@receiver(post_delete, sender=HomeHero)
+@receiver(post_save, sender=HomePageSection)
+@receiver(post_delete, sender=HomePageSection)
+@receiver(post_save, sender=Testimonial)
+@receiver(post_delete, sender=Testimonial)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Items)
+@receiver(post_delete, sender=Items)
+def invalidate_homepage_on_change(sender, **kwargs):
+    """
+    Drop the cached homepage whenever content shown on it changes
+    """
+    invalidate_homepage_cache()
+
+
+@receiver(post_save, sender=Items)
+def index_item_for_search(sender, instance, **kwargs):
+    """
+    Keep the shop search index in step with item edits
+    """
+    get_search_backend().index_items([instance])
+
+
+@receiver(post_delete, sender=Items)
+def remove_item_from_search(sender, instance, **kwargs):
+    get_search_backend().remove_items([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_items(sender, instance, created, **kwargs):
+    """
+    Category names are indexed with each item, so re-index its items on rename
+    """
+    if not created:
+        get_search_backend().index_items(instance.items.values_list('id', flat=True))
+
+
+@receiver(pre_delete, sender=Category)
+def remember_category_items(sender, instance, **kwargs):
+    # Items are detached with a bulk SET NULL that sends no signals
+    instance._detached_item_ids = list(instance.items.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def reindex_detached_items(sender, instance, **kwargs):
+    get_search_backend().index_items(getattr(instance, '_detached_item_ids', []))
+
+
+@receiver(post_save, sender=Items)
+def queue_item_for_related_rebuild(sender, instance, **kwargs):
+    """
+    Category or availability may have changed; rebuild this item's "You May Also Like"
+    """
+    mark_stale([instance.pk])
+
+
+@receiver(m2m_changed, sender=Items.Tag.through)
+def queue_retagged_items(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        mark_stale(instance.items_set.values_list('id', flat=True))
+    elif action in ('post_add', 'post_remove') or (action == 'post_clear' and not reverse):
+        mark_stale(pk_set if reverse else [instance.pk])
+
+
+@receiver(pre_delete, sender=Items)
+def queue_items_listing_deleted_item(sender, instance, **kwargs):
+    # The RelatedItem rows go with the item, so queue the lists that showed it now
+    mark_stale(RelatedItem.objects.filter(related=instance).values_list('item_id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def queue_detached_items(sender, instance, **kwargs):
+    mark_stale(getattr(instance, '_detached_item_ids', []))
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def queue_co_purchased_items(sender, instance, **kwargs):
+    """
+    Co-purchase scores change for every item in the order
+    """
+    mark_order_stale(instance.order_id, instance.item_id)
+
+
+@receiver(post_save, sender=Order)
+def queue_items_on_order_status_change(sender, instance, created, **kwargs):
+    # Cancelled and refunded orders stop counting as co-purchases
+    if not created:
+        mark_stale(instance.items.values_list('item_id', flat=True))
+
+
+NAV_ITEM_FIELDS = ('available', 'Category_id')
+
+
+def _nav_state(instance):
+    # Read __dict__ so deferred fields don't trigger a query; unknown counts as changed
+    return tuple(instance.__dict__.get(field) for field in NAV_ITEM_FIELDS)
+
+
+@receiver(post_init, sender=Items)
+def remember_nav_state(sender, instance, **kwargs):
+    instance._nav_state = _nav_state(instance)
+
+
+@receiver(post_save, sender=Items)
+def invalidate_nav_on_item_change(sender, instance, created, **kwargs):
+    """
+    Nav counts only depend on which category each available item is in
+    """
+    state = _nav_state(instance)
+    changed = instance.available if created else state != instance._nav_state
+    if changed:
+        invalidate_nav_categories()
+    instance._nav_state = state
+
+
+@receiver(post_delete, sender=Items)
+def invalidate_nav_on_item_delete(sender, instance, **kwargs):
+    if instance.available:
+        invalidate_nav_categories()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_nav_on_category_change(sender, **kwargs):
+    invalidate_nav_categories()
+
+
+@receiver(post_save, sender=Items)
+@receiver(post_delete, sender=Items)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(m2m_changed, sender=Items.Tag.through)
+def invalidate_catalog_on_change(sender, **kwargs):
+    """
+    Catalog pages, the JSON API, their ETags and the sitemaps all key off the
+    catalog version
+    """
+    if kwargs.get('action', 'post_').startswith('post_'):
+        invalidate_catalog()
+
+
+def _image_names(instance):
+    return {
+        field: getattr(instance.__dict__.get(field), 'name', instance.__dict__.get(field)) or ''
+        for field in image_fields_for(instance)
+    }
+
+
+@receiver(post_init, sender=Items)
+@receiver(post_init, sender=HomeHero)
+@receiver(post_init, sender=Category)
+@receiver(post_init, sender=HomePageSection)
+def remember_image_names(sender, instance, **kwargs):
+    instance._image_names = _image_names(instance)
+
+
+@receiver(post_save, sender=Items)
+@receiver(post_save, sender=HomeHero)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=HomePageSection)
+def queue_image_derivatives_on_upload(sender, instance, created, **kwargs):
+    """
+    Queue newly uploaded images for resizing by the image worker
+    """
+    names = _image_names(instance)
+    uploaded = {
+        name for field, name in names.items()
+        if name and (created or name != instance._image_names.get(field))
+    }
+    instance._image_names = names
+    for name in uploaded:
+        enqueue_derivatives(name)
@@ -1,18 +1,196 @@
-from django.contrib.sitemaps import Sitemap
-from .models import Items
-
-
-class ItemsSitemap(Sitemap):
-    """Sitemap for Items"""
-    changefreq = "weekly"
-    priority = 0.8
-    
-    def items(self):
-        return Items.objects.filter(available=True)
-    
-    def lastmod(self, obj):
-        return obj.created_at
-    
-    def location(self, obj):
-        return f'/post/{obj.slug}/'
+"""
+Sitemap index and sections.
 
+/sitemap.xml is an index of fixed-size sections: products, product images
+(Google image extension) and categories. Product sections are id ranges of
+SITEMAP_SECTION_SIZE, so a section's URL keeps covering the same items as
+the catalog grows. Each section is rendered by streaming a values_list()
+iterator and kept in the cache until the catalog version changes (see
+conditional.py).
+"""
+import hashlib
+from datetime import timezone as dt_timezone
+from xml.sax.saxutils import escape
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.db.models import Count, F, IntegerField, Max, Q
+from django.db.models.functions import Cast, Greatest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from .conditional import get_catalog_version
+from .models import Category, Items
+
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+IMAGE_NS = 'http://www.google.com/schemas/sitemap-image/1.1'
+CONTENT_TYPE = 'application/xml; charset=utf-8'
+
+
+def _section_size():
+    return getattr(settings, 'SITEMAP_SECTION_SIZE', 5000)
+
+
+def _sitemap_timeout():
+    return getattr(settings, 'SITEMAP_CACHE_TIMEOUT', 60 * 60 * 6)
+
+
+def _w3c(value):
+    return value.astimezone(dt_timezone.utc).isoformat(timespec='seconds') if value else ''
+
+
+def _absolute(base_url, url):
+    return url if '://' in url else base_url + url
+
+
+class SitemapSection:
+    """One kind of sitemap URL, split into pages of SITEMAP_SECTION_SIZE ids"""
+    name = None
+    fields = ()
+    namespaces = f'xmlns="{SITEMAP_NS}"'
+
+    def queryset(self):
+        raise NotImplementedError
+
+    def pages(self, size):
+        """[(page, lastmod)] for every non-empty page, from one GROUP BY"""
+        buckets = (
+            self.queryset()
+            .annotate(bucket=Cast(F('id') / size, IntegerField()))
+            .values('bucket').annotate(lastmod=Max('updated_at'))
+            .order_by('bucket')
+        )
+        return [(row['bucket'] + 1, row['lastmod']) for row in buckets]
+
+    def page_queryset(self, page, size):
+        return self.queryset().filter(id__gte=(page - 1) * size, id__lt=page * size)
+
+    def rows(self, page, size):
+        return self.page_queryset(page, size).order_by('id').values_list(*self.fields).iterator(chunk_size=1000)
+
+    def render_row(self, row, base_url):
+        raise NotImplementedError
+
+
+class ItemsSection(SitemapSection):
+    name = 'items'
+    fields = ('slug', 'updated_at')
+
+    def queryset(self):
+        return Items.objects.filter(available=True).exclude(slug__isnull=True).exclude(slug='')
+
+    def render_row(self, row, base_url):
+        slug, updated_at = row
+        location = _absolute(base_url, reverse('item-details', kwargs={'slug': slug}))
+        return (
+            f'<url><loc>{escape(location)}</loc><lastmod>{_w3c(updated_at)}</lastmod>'
+            '<changefreq>weekly</changefreq><priority>0.8</priority></url>\n'
+        )
+
+
+class ImagesSection(ItemsSection):
+    name = 'images'
+    fields = ('slug', 'name', 'image1', 'image2', 'image3')
+    namespaces = f'xmlns="{SITEMAP_NS}" xmlns:image="{IMAGE_NS}"'
+
+    def queryset(self):
+        return super().queryset().exclude(image1='')
+
+    def render_row(self, row, base_url):
+        slug, name, *images = row
+        location = _absolute(base_url, reverse('item-details', kwargs={'slug': slug}))
+        entries = ''.join(
+            f'<image:image><image:loc>{escape(_absolute(base_url, default_storage.url(image)))}</image:loc></image:image>'
+            for image in images if image
+        )
+        return f'<url><loc>{escape(location)}</loc>{entries}</url>\n'
+
+
+class CategoriesSection(SitemapSection):
+    name = 'categories'
+    fields = ('id', 'lastmod')
+
+    def queryset(self):
+        return Category.objects.annotate(
+            item_count=Count('items', filter=Q(items__available=True)),
+            lastmod=Greatest('updated_at', Max('items__updated_at', filter=Q(items__available=True))),
+        ).filter(item_count__gt=0)
+
+    def pages(self, size):
+        # A single page: the catalog has far fewer categories than a section holds
+        lastmod = max((row[1] for row in self.rows(1, size) if row[1]), default=None)
+        return [(1, lastmod)] if self.queryset().exists() else []
+
+    def page_queryset(self, page, size):
+        return self.queryset() if page == 1 else self.queryset().none()
+
+    def render_row(self, row, base_url):
+        category_id, lastmod = row
+        location = _absolute(base_url, f"{reverse('shop')}?category={category_id}")
+        return (
+            f'<url><loc>{escape(location)}</loc><lastmod>{_w3c(lastmod)}</lastmod>'
+            '<changefreq>weekly</changefreq><priority>0.6</priority></url>\n'
+        )
+
+
+SECTIONS = {section.name: section for section in (ItemsSection(), ImagesSection(), CategoriesSection())}
+
+
+def _base_url(request):
+    return f'{request.scheme}://{get_current_site(request).domain}'
+
+
+def _cache_key(base_url, *parts):
+    digest = hashlib.md5(base_url.encode()).hexdigest()[:12]
+    return ':'.join(['sitemap', str(get_catalog_version()), digest, *map(str, parts)])
+
+
+def sitemap_index(request):
+    """Sitemap index listing every non-empty section page"""
+    base_url = _base_url(request)
+    key = _cache_key(base_url, 'index')
+    content = cache.get(key)
+    if content is None:
+        size = _section_size()
+        entries = []
+        for name, section in SECTIONS.items():
+            for page, lastmod in section.pages(size):
+                location = _absolute(base_url, reverse('sitemap-section', kwargs={'section': name, 'page': page}))
+                lastmod_tag = f'<lastmod>{_w3c(lastmod)}</lastmod>' if lastmod else ''
+                entries.append(f'<sitemap><loc>{escape(location)}</loc>{lastmod_tag}</sitemap>\n')
+        content = (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n'
+            + ''.join(entries) + '</sitemapindex>\n'
+        )
+        cache.set(key, content, _sitemap_timeout())
+    return HttpResponse(content, content_type=CONTENT_TYPE)
+
+
+def _stream_section(section, page, size, base_url, key):
+    """Yield the section XML row by row, caching the whole document at the end"""
+    parts = [f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset {section.namespaces}>\n']
+    yield parts[0]
+    for row in section.rows(page, size):
+        part = section.render_row(row, base_url)
+        parts.append(part)
+        yield part
+    parts.append('</urlset>\n')
+    yield parts[-1]
+    cache.set(key, ''.join(parts), _sitemap_timeout())
+
+
+def sitemap_section(request, section, page):
+    """One page of one sitemap section"""
+    sitemap = SECTIONS.get(section)
+    if sitemap is None:
+        raise Http404("No such sitemap section")
+    base_url = _base_url(request)
+    key = _cache_key(base_url, section, page)
+    content = cache.get(key)
+    if content is not None:
+        return HttpResponse(content, content_type=CONTENT_TYPE)
+
+    size = _section_size()
+    if not sitemap.page_queryset(page, size).exists():
+        raise Http404("Empty sitemap section")
+    return StreamingHttpResponse(_stream_section(sitemap, page, size, base_url, key), content_type=CONTENT_TYPE)
@@ -0,0 +1,140 @@
+"""
+Compiled tax rate table.
+
+Checkout used to resolve a destination's rate with `iexact` queries, which
+can't use the (country, state) unique index. Instead, all active
+TaxConfiguration rows are compiled into a dict keyed by normalized
+(case-folded, whitespace-collapsed) (country, state), so a lookup is the
+state's rate or else the country-wide one, two dict probes with no query.
+The table is stored in the shared cache under a version key and memoized
+per process, as in navigation.py; TaxConfiguration signals and
+`load_tax_rates` bump the version, and every worker reloads on its next
+lookup. That relies on the cache being shared by all workers, which the
+resin_apps.E001 check (checks.py) requires outside DEBUG; as a safety net
+the per-process copy is also dropped after TAX_TABLE_CACHE_TIMEOUT.
+"""
+import time
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from .models import TaxConfiguration
+
+TAX_VERSION_KEY = 'tax:rates:version'
+LOAD_BATCH_SIZE = 500
+
+# Per-process (version, expires, table) copy of the last table read from the
+# shared cache; replaced as a whole so threads never see a mix
+_local = (None, 0, None)
+
+
+def _tax_timeout():
+    return getattr(settings, 'TAX_TABLE_CACHE_TIMEOUT', 60 * 60)
+
+
+def normalize_region(value):
+    return ' '.join((value or '').split()).casefold()
+
+
+def get_tax_version():
+    """Return the current tax table version, initialising it if missing"""
+    version = cache.get(TAX_VERSION_KEY)
+    if version is None:
+        cache.add(TAX_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(TAX_VERSION_KEY, 0)
+    return version
+
+
+def _bump_tax_version():
+    try:
+        cache.incr(TAX_VERSION_KEY)
+    except ValueError:
+        cache.set(TAX_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def invalidate_tax_rates():
+    """Reload the tax table everywhere, now and once the current transaction commits"""
+    _bump_tax_version()
+    transaction.on_commit(_bump_tax_version)
+
+
+def _build_table():
+    rows = TaxConfiguration.objects.filter(is_active=True).values_list('country', 'state', 'tax_rate')
+    return {(normalize_region(country), normalize_region(state)): rate for country, state, rate in rows}
+
+
+def get_tax_table():
+    """{(country, state): rate} of active rates, state '' for country-wide"""
+    global _local
+    version = get_tax_version()
+    local_version, expires, table = _local
+    if local_version == version and expires > time.monotonic():
+        return table
+
+    key = f'tax:rates:{version}'
+    table = cache.get(key)
+    if table is None:
+        table = _build_table()
+        cache.set(key, table, _tax_timeout())
+    _local = (version, time.monotonic() + _tax_timeout(), table)
+    return table
+
+
+def get_tax_rate(country, state=None):
+    """Rate for a destination: the state's rate, else the country-wide one, else 0"""
+    country = normalize_region(country)
+    if not country:
+        return Decimal('0')
+    table = get_tax_table()
+    state = normalize_region(state)
+    if state and (country, state) in table:
+        return table[(country, state)]
+    return table.get((country, ''), Decimal('0'))
+
+
+def load_tax_rates(rows):
+    """
+    Upsert (country, state, tax_rate[, is_active]) rows in bulk, in one
+    transaction, and reload the table once. Returns the number of rows.
+    Rows are matched on normalized country and state, so 'us ' updates an
+    existing 'US' row, and two rows for the same place are an error.
+    """
+    count = 0
+    with transaction.atomic():
+        # Stored spelling per normalized key, so matching rows hit the unique constraint
+        stored = {
+            (normalize_region(country), normalize_region(state)): (country, state)
+            for country, state in TaxConfiguration.objects.values_list('country', 'state')
+        }
+        seen = set()
+        batch = []
+        for row in rows:
+            country, state, rate = (' '.join(str(value if value is not None else '').split()) for value in row[:3])
+            is_active = row[3] if len(row) > 3 else True
+            try:
+                rate = Decimal(rate)
+            except InvalidOperation:
+                raise ValueError(f"Not a tax rate: {rate!r} ({country}, {state})")
+            if not country:
+                raise ValueError("Every tax rate needs a country")
+            key = (normalize_region(country), normalize_region(state))
+            if key in seen:
+                raise ValueError(f"Duplicate tax rate for {country}, {state}" if state else f"Duplicate tax rate for {country}")
+            seen.add(key)
+            country, state = stored.get(key, (country, state))
+            batch.append(TaxConfiguration(country=country, state=state, tax_rate=rate, is_active=is_active))
+            if len(batch) >= LOAD_BATCH_SIZE:
+                count += _upsert(batch)
+                batch = []
+        if batch:
+            count += _upsert(batch)
+        invalidate_tax_rates()
+    return count
+
+
+def _upsert(batch):
+    TaxConfiguration.objects.bulk_create(
+        batch, update_conflicts=True, unique_fields=['country', 'state'],
+        update_fields=['tax_rate', 'is_active', 'updated_at'],
+    )
+    return len(batch)
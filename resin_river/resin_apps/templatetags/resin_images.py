@@ -0,0 +1,60 @@
+from django import template
+from django.core.files.storage import default_storage
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+from ..images import available_variants, variant_name
+
+register = template.Library()
+
+DEFAULT_SIZES = '(min-width: 1024px) 33vw, 50vw'
+
+
+def _name(image):
+    """Storage name of an ImageField value or a plain name"""
+    return getattr(image, 'name', image) or ''
+
+
+def _srcset(name, variants, extension):
+    return ', '.join(
+        f'{default_storage.url(variant_name(name, variant, extension))} {width}w'
+        for variant, width in variants.items()
+    )
+
+
+@register.simple_tag
+def image_variant_url(image, variant='card'):
+    """URL of one derivative of `image`, or of the original until it exists"""
+    name = _name(image)
+    if not name:
+        return ''
+    variants = available_variants(name)
+    if variant in variants:
+        return default_storage.url(variant_name(name, variant, 'jpg'))
+    return default_storage.url(name)
+
+
+@register.simple_tag
+def responsive_image(image, sizes=DEFAULT_SIZES, variant='card', **attrs):
+    """
+    <picture> with WebP and JPEG srcsets for `image`; extra keyword arguments
+    become <img> attributes (loading defaults to lazy). Renders a plain <img>
+    of the original until derivatives exist.
+    """
+    name = _name(image)
+    if not name:
+        return ''
+    attrs.setdefault('loading', 'lazy')
+    variants = available_variants(name)
+    if not variants:
+        return format_html('<img src="{}"{}>', default_storage.url(name), flatatt(attrs))
+
+    fallback = variant if variant in variants else next(iter(variants))
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}"{}>'
+        '</picture>',
+        _srcset(name, variants, 'webp'), sizes,
+        default_storage.url(variant_name(name, fallback, 'jpg')),
+        _srcset(name, variants, 'jpg'), sizes, flatatt(attrs),
+    )
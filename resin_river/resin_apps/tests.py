@@ -1,16 +1,75 @@
-from django.test import TestCase, Client
-from django.contrib.auth.models import User
+from django.test import TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.contrib.messages import get_messages
+from django.contrib.auth.models import AnonymousUser, User
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Items, Category, Tag, Cart, CartItem, HomeHero
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from io import BytesIO, StringIO
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from PIL import Image
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.template import Context, Template
+from decimal import Decimal
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
+from .models import Items, Category, Tag, Cart, CartItem, HomeHero, Order, OrderItem, RelatedItem, StaleRelatedItems, ImageJob, ShippingMethod, TaxConfiguration, DiscountCode, DiscountRedemption, PaymentMethod
 from .forms import SignupForm, CheckoutForm
+from .homepage import get_homepage_context
+from .pagination import KeysetPaginator
+from .search import get_search_backend
+from .related import rebuild_related_items
+from .navigation import get_nav_categories
+from .facets import ShopFilters, get_shop_facets
+from .exports import export_rows
+from .context_processors import cart_context
+from .images import available_variants, generate_derivatives, variant_name
+from .pricing import CartPricer
+from .signals import migrate_session_cart_to_database
+from .carts import add_to_cart
+from .views import DISCOUNT_THROTTLED_MESSAGE
+from .checks import check_shared_cache
+from .shipping import get_shipping_table, get_shipping_version
+from .tax import get_tax_rate, get_tax_version, load_tax_rates
+from .conditional import get_catalog_version
+from .discounts import DiscountUnavailable, client_ip, get_discount_code, redeem_discount
 
 
-class ModelsTestCase(TestCase):
+class TemporaryMediaMixin:
+    """Run each test against an empty media root"""
+    
+    def setUp(self):
+        """Set up a throwaway media root"""
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+    
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+    
+    def store_image(self, name, size, mode='RGB', fmt='JPEG'):
+        buffer = BytesIO()
+        Image.new(mode, size, 'red').save(buffer, fmt)
+        return default_storage.save(name, ContentFile(buffer.getvalue()))
+
+
+class ModelsTestCase(TemporaryMediaMixin, TestCase):
     """Test cases for models"""
     
     def setUp(self):
         """Set up test data"""
+        super().setUp()
         self.category = Category.objects.create(name="Furniture")
         self.tag = Tag.objects.create(caption="Featured")
         self.user = User.objects.create_user(
@@ -82,11 +141,12 @@ class ModelsTestCase(TestCase):
         self.assertEqual(str(hero), "Test Hero")
 
 
-class ViewsTestCase(TestCase):
+class ViewsTestCase(TemporaryMediaMixin, TestCase):
     """Test cases for views"""
     
     def setUp(self):
         """Set up test data"""
+        super().setUp()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -280,11 +340,12 @@ class FormsTestCase(TestCase):
         self.assertFalse(form.is_valid())
 
 
-class ContextProcessorTestCase(TestCase):
+class ContextProcessorTestCase(TemporaryMediaMixin, TestCase):
     """Test cases for context processors"""
     
     def setUp(self):
         """Set up test data"""
+        super().setUp()
         self.client = Client()
         self.user = User.objects.create_user(
             username='testuser',
@@ -331,3 +392,1647 @@ class ContextProcessorTestCase(TestCase):
         """Test cart context processor with empty cart"""
         response = self.client.get(reverse('index'))
         self.assertEqual(response.context['cart_count'], 0)
+
+
+class SharedCacheCheckTestCase(TestCase):
+    """Test cases for the shared cache system check"""
+    
+    def test_process_local_cache_is_an_error(self):
+        """Test LocMemCache fails the check unless the site is single-process"""
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379/1'}}
+        with override_settings(CACHES=locmem, CACHE_SINGLE_PROCESS=False):
+            self.assertEqual([error.id for error in check_shared_cache(None)], ['resin_apps.E001'])
+        with override_settings(CACHES=locmem, CACHE_SINGLE_PROCESS=True):
+            self.assertEqual(check_shared_cache(None), [])
+        with override_settings(CACHES=redis, CACHE_SINGLE_PROCESS=False):
+            self.assertEqual(check_shared_cache(None), [])
+
+
+class HomepageCacheTestCase(TemporaryMediaMixin, TestCase):
+    """Test cases for the cached homepage data layer"""
+    
+    def setUp(self):
+        """Set up test data"""
+        super().setUp()
+        cache.clear()
+        self.category = Category.objects.create(name="Furniture", is_featured=True)
+        image = SimpleUploadedFile(
+            name='test_image.jpg',
+            content=b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR',
+            content_type='image/jpeg'
+        )
+        
+        self.item = Items.objects.create(
+            Category=self.category,
+            name="Test Item",
+            description="Test Description",
+            price=99.99,
+            image1=image,
+            available=True,
+            is_on_sale=True,
+            slug="test-item"
+        )
+    
+    def test_cache_hit_needs_no_queries(self):
+        """Test a warm homepage cache is served without touching the DB"""
+        get_homepage_context()
+        with self.assertNumQueries(0):
+            context = get_homepage_context()
+        self.assertEqual(context['featured_categories'][0].item_count, 1)
+        self.assertIn(self.item, context['sale_items'])
+        self.assertIn(self.item, context['latest_posts_page'].object_list)
+    
+    def test_item_save_invalidates_cache(self):
+        """Test saving an item rebuilds the cached homepage"""
+        get_homepage_context()
+        self.item.name = "Renamed Item"
+        self.item.save()
+        context = get_homepage_context()
+        self.assertEqual(context['sale_items'][0].name, "Renamed Item")
+    
+    def test_bulk_update_invalidates_cache(self):
+        """Test a queryset update (no signals) also rebuilds the cached homepage"""
+        get_homepage_context()
+        Items.objects.filter(pk=self.item.pk).update(is_on_sale=False)
+        self.assertEqual(get_homepage_context()['sale_items'], [])
+    
+    def test_category_delete_invalidates_cache(self):
+        """Test deleting a featured category removes it from the homepage"""
+        get_homepage_context()
+        self.category.delete()
+        context = get_homepage_context()
+        self.assertEqual(context['featured_categories'], [])
+    
+    def test_homepage_renders_from_cache(self):
+        """Test the homepage view renders featured categories and sale items"""
+        response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '1 Items')
+        self.assertContains(response, 'TEST ITEM')
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Test cases for cursor pagination of catalog listings"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.category = Category.objects.create(name="Furniture")
+        for i in range(14):
+            Items.objects.create(
+                Category=self.category,
+                name=f"Item {i}",
+                description="Test Description",
+                price=10 + (i % 3),
+                image1='images/test_image.jpg',
+                display_order=i % 2,
+                slug=f"item-{i}"
+            )
+    
+    def walk_forward(self, ordering):
+        paginator = KeysetPaginator(Items.objects.all(), ordering, 3)
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+        return paginator, pages
+    
+    def test_pages_cover_every_item_once(self):
+        """Test walking cursors visits items in sort order without gaps or repeats"""
+        for ordering in [('display_order', '-created_at', 'id'), ('price', 'id'), ('-price', '-id'), ('-created_at', '-id')]:
+            _, pages = self.walk_forward(ordering)
+            walked = [item.id for page in pages for item in page]
+            expected = list(Items.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(walked, expected)
+            self.assertEqual(len(pages), 5)
+    
+    def test_previous_cursor_returns_prior_page(self):
+        """Test a previous cursor seeks back to the preceding page"""
+        paginator, pages = self.walk_forward(('price', 'id'))
+        self.assertFalse(pages[0].has_previous())
+        back = paginator.page(pages[2].previous_cursor)
+        self.assertEqual(list(back), list(pages[1]))
+        self.assertEqual(back.next_cursor, pages[1].next_cursor)
+    
+    def test_deep_page_costs_one_query(self):
+        """Test any page is a single query regardless of depth"""
+        paginator, pages = self.walk_forward(('display_order', '-created_at', 'id'))
+        with self.assertNumQueries(1):
+            paginator.page(pages[-1].previous_cursor)
+    
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        """Test a tampered cursor serves the first page"""
+        paginator, pages = self.walk_forward(('price', 'id'))
+        self.assertEqual(list(paginator.page('not-a-cursor')), list(pages[0]))
+    
+    def test_shop_view_cursor_links(self):
+        """Test the shop renders next links and a cached total"""
+        response = self.client.get(reverse('shop'), {'sort': 'price_asc'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_items'], 14)
+        page = response.context['items']
+        self.assertTrue(page.has_next())
+        response = self.client.get(reverse('shop'), {'sort': 'price_asc', 'cursor': page.next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['items'].has_previous())
+
+
+class SearchIndexTestCase(TestCase):
+    """Test cases for the shop search index"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.tables = Category.objects.create(name="Tables")
+        self.art = Category.objects.create(name="Wall Art")
+        self.table = Items.objects.create(
+            Category=self.tables, name="Ocean Coffee Table", description="Walnut slab with blue epoxy",
+            price=500, image1='images/test_image.jpg', slug="ocean-coffee-table"
+        )
+        self.geode = Items.objects.create(
+            Category=self.art, name="Emerald Geode", description="Wall piece inspired by the ocean",
+            price=300, image1='images/test_image.jpg', slug="emerald-geode"
+        )
+    
+    def search(self, query):
+        queryset = get_search_backend().filter_queryset(Items.objects.all(), query)
+        return list(queryset.order_by('search_rank', 'id'))
+    
+    def test_ranked_prefix_search(self):
+        """Test name matches outrank description matches and prefixes match"""
+        self.assertEqual(self.search('ocea'), [self.table, self.geode])
+        self.assertEqual(self.search('walnut epoxy'), [self.table])
+        self.assertEqual(self.search('"!'), [])
+    
+    def test_index_follows_item_changes(self):
+        """Test saves and deletes update the index incrementally"""
+        self.geode.name = "Amber Geode"
+        self.geode.save()
+        self.assertEqual(self.search('amber'), [self.geode])
+        self.assertEqual(self.search('emerald'), [])
+        self.table.delete()
+        self.assertEqual(self.search('walnut'), [])
+    
+    def test_category_rename_reindexes_items(self):
+        """Test category names are searchable and follow renames"""
+        self.assertEqual(self.search('tables'), [self.table])
+        self.tables.name = "Furniture"
+        self.tables.save()
+        self.assertEqual(self.search('furniture'), [self.table])
+        self.art.delete()
+        self.assertEqual(self.search('wall art'), [])
+    
+    def test_rebuild(self):
+        """Test a bulk rebuild indexes every item"""
+        self.assertEqual(get_search_backend().rebuild(batch_size=1), 2)
+        self.assertEqual(self.search('geode'), [self.geode])
+    
+    def test_shop_search_relevance(self):
+        """Test shop search defaults to relevance ordering"""
+        response = self.client.get(reverse('shop'), {'search': 'ocean'})
+        self.assertEqual(response.context['sort_by'], 'relevance')
+        self.assertEqual(list(response.context['items']), [self.table, self.geode])
+    
+    def test_cursor_pages_through_ranked_results(self):
+        """Test keyset pagination can seek on the search_rank annotation"""
+        queryset = get_search_backend().filter_queryset(Items.objects.all(), 'ocean')
+        paginator = KeysetPaginator(queryset, ('search_rank', 'id'), 1)
+        first = paginator.page()
+        second = paginator.page(first.next_cursor)
+        self.assertEqual(list(first) + list(second), [self.table, self.geode])
+        self.assertFalse(second.has_next())
+
+
+class EffectivePriceTestCase(TestCase):
+    """Test cases for the denormalized Items.effective_price"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.category = Category.objects.create(name="Furniture")
+        self.item = Items.objects.create(
+            Category=self.category, name="Table", description="Test Description",
+            price=Decimal('100.00'), sale_price=Decimal('80.00'),
+            image1='images/test_image.jpg', slug="table"
+        )
+        self.other = Items.objects.create(
+            Category=self.category, name="Chair", description="Test Description",
+            price=Decimal('90.00'), image1='images/test_image.jpg', slug="chair"
+        )
+    
+    def assertEffectivePrice(self, item, expected):
+        item.refresh_from_db()
+        self.assertEqual(item.effective_price, Decimal(expected))
+    
+    def test_save_keeps_effective_price(self):
+        """Test save and save(update_fields) recompute the effective price"""
+        self.assertEffectivePrice(self.item, '80.00')
+        self.assertEffectivePrice(self.other, '90.00')
+        self.item.sale_price = None
+        self.item.save(update_fields=['sale_price'])
+        self.assertEffectivePrice(self.item, '100.00')
+    
+    def test_bulk_writes_keep_effective_price(self):
+        """Test queryset.update, bulk_update and bulk_create keep it in sync"""
+        Items.objects.filter(pk=self.other.pk).update(sale_price=Decimal('50.00'))
+        self.assertEffectivePrice(self.other, '50.00')
+        Items.objects.update(price=F('price') * 2, sale_price=None)
+        self.assertEffectivePrice(self.item, '200.00')
+        self.item.sale_price = Decimal('70.00')
+        Items.objects.bulk_update([self.item], ['sale_price'])
+        self.assertEffectivePrice(self.item, '70.00')
+        Items.objects.bulk_create([Items(
+            name="Lamp", description="Test Description", price=Decimal('30.00'),
+            sale_price=Decimal('25.00'), image1='images/test_image.jpg', slug="lamp"
+        )])
+        self.assertEffectivePrice(Items.objects.get(slug="lamp"), '25.00')
+    
+    def test_shop_filters_and_sorts_on_effective_price(self):
+        """Test the shop price filter, sort and range use the sale price"""
+        response = self.client.get(reverse('shop'), {'max_price': '85', 'sort': 'price_asc'})
+        self.assertEqual(list(response.context['items']), [self.item])
+        self.assertEqual(response.context['price_range']['min_price'], Decimal('80.00'))
+        response = self.client.get(reverse('shop'), {'sort': 'price_desc'})
+        self.assertEqual(list(response.context['items']), [self.other, self.item])
+    
+    def test_cart_total_uses_effective_price(self):
+        """Test cart pricing charges the sale price"""
+        user = User.objects.create_user(username='buyer', password='testpass123')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, item=self.item, quantity=2)
+        self.client.login(username='buyer', password='testpass123')
+        response = self.client.get(reverse('cart-list'))
+        self.assertEqual(response.context['total'], Decimal('160.00'))
+
+
+class QueryPlanTestCase(TestCase):
+    """Regression check that hot catalog and account queries use indexes"""
+    
+    def test_no_full_scans(self):
+        """Test check_query_plans passes against the migrated schema"""
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('no full scans', out.getvalue())
+    
+    def test_unmigrated_database(self):
+        """Test an unmigrated database is reported instead of failing mid-run"""
+        with mock.patch(
+            'resin_apps.management.commands.check_query_plans.MigrationExecutor.migration_plan',
+            return_value=[('migration', False)],
+        ):
+            with self.assertRaisesMessage(CommandError, "run 'python manage.py migrate' first"):
+                call_command('check_query_plans', stdout=StringIO())
+
+
+class RelatedItemsTestCase(TestCase):
+    """Test cases for the precomputed "You May Also Like" lists"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.lamps = Category.objects.create(name="Lamps")
+        self.tables = Category.objects.create(name="Tables")
+        self.ocean = Tag.objects.create(caption="ocean")
+        self.items = {}
+        for order, (slug, category) in enumerate([
+            ('lamp', self.lamps), ('lamp-2', self.lamps), ('lamp-3', self.lamps),
+            ('table', self.tables), ('tray', self.tables),
+        ]):
+            self.items[slug] = Items.objects.create(
+                Category=category, name=slug, description="Test Description", price=Decimal('10.00'),
+                image1='images/test_image.jpg', slug=slug, display_order=order,
+            )
+        self.items['lamp'].Tag.add(self.ocean)
+        self.items['table'].Tag.add(self.ocean)
+    
+    def related_slugs(self, slug):
+        return list(
+            RelatedItem.objects.filter(item=self.items[slug]).order_by('rank').values_list('related__slug', flat=True)
+        )
+    
+    def test_scoring(self):
+        """Test shared tags and co-purchases outrank plain category matches"""
+        order = Order.objects.create(
+            contact_email_phone='a@example.com', delivery_last_name='A', delivery_address='1 Way',
+            delivery_city='Lagos', delivery_state='Lagos', delivery_country='Nigeria', delivery_phone='000',
+            subtotal=Decimal('20.00'), total=Decimal('20.00'),
+        )
+        for slug in ('lamp', 'tray'):
+            OrderItem.objects.create(
+                order=order, item=self.items[slug], item_name=slug, item_price=Decimal('10.00'), subtotal=Decimal('10.00'),
+            )
+        rebuild_related_items(full=True)
+        self.assertEqual(self.related_slugs('lamp'), ['table', 'tray', 'lamp-2', 'lamp-3'])
+        self.assertEqual(self.related_slugs('lamp-2'), ['lamp', 'lamp-3'])
+        self.assertFalse(StaleRelatedItems.objects.exists())
+    
+    def test_incremental_rebuild(self):
+        """Test only queued items and their neighbours are rebuilt"""
+        rebuild_related_items(full=True)
+        self.assertEqual(rebuild_related_items(), 0)
+        self.items['lamp-3'].Tag.add(self.ocean)
+        # lamp-3, the two lamps listing it, and table which now shares its tag
+        self.assertEqual(rebuild_related_items(), 4)
+        self.assertEqual(self.related_slugs('table')[:2], ['lamp', 'lamp-3'])
+    
+    def test_order_lines_queued_once_per_transaction(self):
+        """Test an order's lines queue its items with one lookup and one upsert at commit"""
+        order = Order.objects.create(
+            contact_email_phone='a@example.com', delivery_last_name='A', delivery_address='1 Way',
+            delivery_city='Lagos', delivery_state='Lagos', delivery_country='Nigeria', delivery_phone='000',
+            subtotal=Decimal('30.00'), total=Decimal('30.00'),
+        )
+        StaleRelatedItems.objects.all().delete()
+        with self.captureOnCommitCallbacks() as callbacks:
+            for slug in ('lamp', 'table', 'tray'):
+                OrderItem.objects.create(
+                    order=order, item=self.items[slug], item_name=slug, item_price=Decimal('10.00'), subtotal=Decimal('10.00'),
+                )
+        self.assertEqual(len(callbacks), 1)
+        self.assertFalse(StaleRelatedItems.objects.exists())
+        with self.assertNumQueries(2):
+            callbacks[0]()
+        self.assertEqual(
+            set(StaleRelatedItems.objects.values_list('item__slug', flat=True)), {'lamp', 'table', 'tray'}
+        )
+    
+    def test_item_details_reads_table(self):
+        """Test the product page shows the stored list, skipping unavailable items"""
+        rebuild_related_items(full=True)
+        Items.objects.filter(slug='table').update(available=False)
+        response = Client().get(reverse('item-details', kwargs={'slug': 'lamp'}))
+        self.assertEqual(
+            [item.slug for item in response.context['related_items']], ['lamp-2', 'lamp-3']
+        )
+
+
+class NavCategoriesCacheTestCase(TestCase):
+    """Test cases for the cached navigation categories"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.category = Category.objects.create(name="Lamps")
+        self.other = Category.objects.create(name="Tables")
+        self.item = Items.objects.create(
+            Category=self.category, name="Lamp", description="Test Description",
+            price=Decimal('10.00'), image1='images/test_image.jpg', slug="lamp"
+        )
+    
+    def nav(self):
+        return [(category.name, category.item_count) for category in get_nav_categories()]
+    
+    def test_cache_hit(self):
+        """Test repeated renders don't run the GROUP BY"""
+        self.assertEqual(self.nav(), [('Lamps', 1)])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.nav(), [('Lamps', 1)])
+    
+    def test_invalidated_by_nav_fields(self):
+        """Test availability, category moves and category edits refresh the list"""
+        self.nav()
+        self.item.Category = self.other
+        self.item.save()
+        self.assertEqual(self.nav(), [('Tables', 1)])
+        Items.objects.filter(pk=self.item.pk).update(available=False)
+        self.assertEqual(self.nav(), [])
+        Items.objects.filter(pk=self.item.pk).update(available=True)
+        self.other.name = "Side tables"
+        self.other.save()
+        self.assertEqual(self.nav(), [('Side tables', 1)])
+    
+    def test_other_item_edits_keep_cache(self):
+        """Test saving unrelated item fields leaves the cached list alone"""
+        self.nav()
+        item = Items.objects.get(pk=self.item.pk)
+        item.price = Decimal('12.00')
+        item.save()
+        with self.assertNumQueries(0):
+            self.nav()
+
+
+class CartBadgeCountTestCase(TestCase):
+    """Test cases for the maintained Cart.total_quantity badge counter"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        category = Category.objects.create(name="Furniture")
+        self.item = Items.objects.create(
+            Category=category, name="Table", description="Test Description",
+            price=Decimal('100.00'), image1='images/test_image.jpg', slug="table"
+        )
+        self.other = Items.objects.create(
+            Category=category, name="Chair", description="Test Description",
+            price=Decimal('50.00'), image1='images/test_image.jpg', slug="chair"
+        )
+    
+    def total_quantity(self):
+        return Cart.objects.get(user=self.user).total_quantity
+    
+    def test_cart_views_keep_count(self):
+        """Test add, update and remove keep total_quantity in step with the rows"""
+        self.client.login(username='testuser', password='testpass123')
+        self.client.post(reverse('add-to-cart'), {'post_id': self.item.id, 'quantity': 2})
+        self.client.post(reverse('add-to-cart'), {'post_id': self.item.id, 'quantity': 1})
+        self.client.post(reverse('item-details', kwargs={'slug': self.other.slug}))
+        self.assertEqual(self.total_quantity(), 4)
+        
+        cart_item = CartItem.objects.get(cart__user=self.user, item=self.item)
+        self.client.post(reverse('cart-list'), {'action': 'update', 'cart_item_id': cart_item.id, 'quantity': 1})
+        self.assertEqual(self.total_quantity(), 2)
+        self.client.post(reverse('cart-list'), {'action': 'remove', 'cart_item_id': cart_item.id})
+        self.assertEqual(self.total_quantity(), 1)
+    
+    def test_login_merge_updates_count(self):
+        """Test the session cart merge on login updates the counter"""
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, item=self.item, quantity=1)
+        session = self.client.session
+        session['cart_dict'] = {str(self.item.id): 2, str(self.other.id): 1}
+        session.save()
+        self.client.post(reverse('login'), {'username': 'testuser', 'password': 'testpass123'})
+        self.assertEqual(self.total_quantity(), 4)
+    
+    def test_login_merge_query_count_independent_of_cart_size(self):
+        """Test merging a large session cart costs the same queries as a small one"""
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, item=self.item, quantity=1)
+        extra = [
+            Items.objects.create(
+                name=f"Stool {index}", description="Test Description", price=Decimal('10.00'),
+                image1='images/test_image.jpg', slug=f"stool-{index}",
+            )
+            for index in range(5)
+        ]
+        
+        def merge(items):
+            request = RequestFactory().get('/')
+            request.session = self.client.session
+            request.session['cart_dict'] = {'bogus': 1, **{str(item.id): 2 for item in items}}
+            with CaptureQueriesContext(connection) as queries:
+                migrate_session_cart_to_database(sender=User, request=request, user=self.user)
+            self.assertNotIn('cart_dict', request.session)
+            return len(queries)
+        
+        small = merge([self.item, self.other])
+        self.assertEqual(merge([self.item, self.other, *extra]), small)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('item_id', 'quantity')),
+            {self.item.id: 5, self.other.id: 4, **{item.id: 2 for item in extra}},
+        )
+        self.assertEqual(self.total_quantity(), 19)
+    
+    def test_badge_is_one_lookup(self):
+        """Test reading the authenticated badge costs a single query"""
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, item=self.item, quantity=3)
+        request = RequestFactory().get('/')
+        request.user = self.user
+        with self.assertNumQueries(1):
+            self.assertEqual(cart_context(request), {'cart_count': 3})
+
+
+class ImageDerivativesTestCase(TemporaryMediaMixin, TestCase):
+    """Test cases for the resized WebP/JPEG image derivatives"""
+    
+    def test_generates_variants(self):
+        """Test every variant is written in both formats, never upscaled"""
+        name = self.store_image('images/table.jpg', (2000, 1000))
+        self.assertEqual(generate_derivatives(name), {'card': 400, 'detail': 900, 'zoom': 1600})
+        with default_storage.open(variant_name(name, 'detail', 'webp')) as f:
+            image = Image.open(f)
+            self.assertEqual((image.format, image.size), ('WEBP', (900, 450)))
+        
+        small = self.store_image('images/lamp.png', (300, 200), mode='RGBA', fmt='PNG')
+        self.assertEqual(generate_derivatives(small), {'card': 300})
+        self.assertTrue(default_storage.exists('images/lamp.png.card.jpg'))
+    
+    def test_sources_differing_by_extension_keep_separate_variants(self):
+        """Test table.jpg and table.png don't overwrite each other's derivatives"""
+        jpg = self.store_image('images/table.jpg', (800, 400))
+        png = self.store_image('images/table.png', (500, 500), mode='RGBA', fmt='PNG')
+        generate_derivatives(jpg)
+        generate_derivatives(png)
+        self.assertNotEqual(variant_name(jpg, 'card', 'webp'), variant_name(png, 'card', 'webp'))
+        with default_storage.open(variant_name(jpg, 'card', 'webp')) as f:
+            self.assertEqual(Image.open(f).size, (400, 200))
+    
+    def test_template_tag_falls_back_to_original(self):
+        """Test the tag renders the original until derivatives exist, then a srcset"""
+        name = self.store_image('images/table.jpg', (1000, 500))
+        template = Template('{% load resin_images %}{% responsive_image image alt="Table" class="w-full" %}')
+        html = template.render(Context({'image': name}))
+        self.assertNotIn('srcset', html)
+        self.assertIn('/files/images/table.jpg', html)
+        
+        cache.clear()
+        generate_derivatives(name)
+        html = template.render(Context({'image': name}))
+        self.assertIn('type="image/webp" srcset="/files/images/table.jpg.card.webp 400w, /files/images/table.jpg.detail.webp 900w"', html)
+        self.assertIn('src="/files/images/table.jpg.card.jpg"', html)
+        self.assertIn('class="w-full"', html)
+    
+    def test_backfill_command(self):
+        """Test the backfill command processes images without derivatives"""
+        name = self.store_image('images/table.jpg', (1000, 500))
+        Items.objects.create(
+            name="Table", description="Test Description", price=Decimal('10.00'), image1=name, slug="table"
+        )
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        self.assertEqual(available_variants(name), {'card': 400, 'detail': 900})
+
+
+class ImageJobQueueTestCase(TemporaryMediaMixin, TestCase):
+    """Test cases for the queued image-processing worker"""
+    
+    def create_item(self, name, slug):
+        return Items.objects.create(
+            name=slug, description="Test Description", price=Decimal('10.00'), image1=name, slug=slug
+        )
+    
+    def test_upload_queues_job_and_worker_processes_it(self):
+        """Test saves queue one job per new image and the worker completes it"""
+        name = self.store_image('images/table.jpg', (1000, 500))
+        item = self.create_item(name, 'table')
+        item.save()
+        self.assertEqual(ImageJob.objects.filter(image=name, status=ImageJob.PENDING).count(), 1)
+        self.assertEqual(available_variants(name), {})
+        
+        call_command('process_image_jobs', once=True, workers=1, stdout=StringIO())
+        job = ImageJob.objects.get(image=name)
+        self.assertEqual((job.status, job.attempts), (ImageJob.DONE, 1))
+        self.assertIsNotNone(job.duration)
+        self.assertEqual(available_variants(name), {'card': 400, 'detail': 900})
+    
+    def test_failures_are_retried_then_recorded(self):
+        """Test an unreadable upload is retried and then marked failed"""
+        name = default_storage.save('images/broken.jpg', ContentFile(b'not an image'))
+        self.create_item(name, 'broken')
+        call_command('process_image_jobs', once=True, workers=1, max_attempts=2, stdout=StringIO(), stderr=StringIO())
+        job = ImageJob.objects.get(image=name)
+        self.assertEqual((job.status, job.attempts), (ImageJob.FAILED, 2))
+        self.assertIn('UnidentifiedImageError', job.error)
+    
+    def test_admin_shows_queue_depth(self):
+        """Test the job changelist reports queue depth"""
+        self.create_item(self.store_image('images/table.jpg', (100, 50)), 'table')
+        User.objects.create_superuser(username='admin', password='adminpass123')
+        self.client.login(username='admin', password='adminpass123')
+        response = self.client.get(reverse('admin:resin_apps_imagejob_changelist'))
+        self.assertContains(response, 'Queue: 1 pending')
+
+
+class MediaServingTestCase(TemporaryMediaMixin, TestCase):
+    """Test cases for the MEDIA_URL file view"""
+    
+    def setUp(self):
+        """Store a small file to serve"""
+        super().setUp()
+        self.name = default_storage.save('images/data.jpg', ContentFile(b'0123456789'))
+        self.url = f'/files/{self.name}'
+    
+    def test_validators_and_not_modified(self):
+        """Test ETag/Last-Modified are sent and conditional requests get 304"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(
+            self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304
+        )
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+    
+    def test_byte_ranges(self):
+        """Test single ranges, suffix ranges, stale If-Range and unsatisfiable ranges"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-4/10')
+        self.assertEqual(b''.join(response.streaming_content), b'234')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE='"stale"').status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+    
+    def test_derivatives_revalidate(self):
+        """Test regenerated variants aren't cached as immutable and get a new ETag"""
+        name = default_storage.save('images/data.jpg.card.webp', ContentFile(b'webp'))
+        response = self.client.get(f'/files/{name}')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=86400')
+        stat = os.stat(default_storage.path(name))
+        with default_storage.open(name, 'wb') as f:
+            f.write(b'webp v2')
+        os.utime(default_storage.path(name), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        self.assertEqual(self.client.get(f'/files/{name}', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+    
+    def test_sendfile_offload_and_traversal(self):
+        """Test X-Accel-Redirect offload sends no body and paths can't escape MEDIA_ROOT"""
+        with self.settings(MEDIA_SENDFILE='x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.client.get('/files/../manage.py').status_code, 404)
+
+
+@override_settings(SITEMAP_SECTION_SIZE=2)
+class SitemapTestCase(TestCase):
+    """Test cases for the sitemap index and its cached sections"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.category = Category.objects.create(name="Lamps")
+        self.items = [
+            Items.objects.create(
+                Category=self.category, name=f"Lamp {n}", description="Test Description",
+                price=Decimal('10.00'), image1='images/test_image.jpg', slug=f"lamp-{n}"
+            )
+            for n in range(3)
+        ]
+    
+    def section(self, name, item):
+        response = self.client.get(f'/sitemap-{name}-{item.id // 2 + 1}.xml')
+        if response.streaming:
+            return b''.join(response.streaming_content).decode()
+        return response.content.decode()
+    
+    def test_index_lists_sections(self):
+        """Test the index lists one items/images page per id range plus categories"""
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response.status_code, 200)
+        for page in {item.id // 2 + 1 for item in self.items}:
+            self.assertContains(response, f'http://example.com/sitemap-items-{page}.xml')
+            self.assertContains(response, f'http://example.com/sitemap-images-{page}.xml')
+        self.assertContains(response, 'http://example.com/sitemap-categories-1.xml')
+    
+    def test_section_streams_then_caches(self):
+        """Test a section streams on the first request and is served from cache after"""
+        url = f'/sitemap-items-{self.items[0].id // 2 + 1}.xml'
+        response = self.client.get(url)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn('<loc>http://example.com/post/lamp-0</loc>', content)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        self.assertEqual(cached.content.decode(), content)
+    
+    def test_changes_invalidate(self):
+        """Test bulk updates drop cached sections and unknown sections are 404s"""
+        self.assertIn('lamp-2<', self.section('items', self.items[2]))
+        Items.objects.filter(pk=self.items[2].pk).update(available=False)
+        self.assertNotIn('lamp-2<', self.section('items', self.items[2]))
+        self.assertEqual(self.client.get('/sitemap-items-999.xml').status_code, 404)
+        self.assertEqual(self.client.get('/sitemap-other-1.xml').status_code, 404)
+    
+    def test_images_and_categories(self):
+        """Test image entries and category listing URLs"""
+        self.assertIn(
+            '<image:loc>http://example.com/files/images/test_image.jpg</image:loc>',
+            self.section('images', self.items[0]),
+        )
+        response = self.client.get('/sitemap-categories-1.xml')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(f'<loc>http://example.com/shop/?category={self.category.id}</loc>', content)
+
+
+class ConditionalGetTestCase(TestCase):
+    """Test cases for ETag/Last-Modified on catalog pages"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name="Lamps")
+        self.item = Items.objects.create(
+            Category=self.category, name="Lamp", description="Test Description",
+            price=Decimal('10.00'), image1='images/test_image.jpg', slug="lamp"
+        )
+        self.url = reverse('item-details', kwargs={'slug': 'lamp'})
+    
+    def revalidate(self, url, response):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+    
+    def test_not_modified_skips_view(self):
+        """Test a matching ETag gets an empty 304 without the page queries"""
+        # The first view adds the item to the session's recently viewed list
+        self.client.get(self.url)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('no-cache', response['Cache-Control'])
+        # Only the session lookup runs
+        with self.assertNumQueries(1):
+            not_modified = self.revalidate(self.url, response)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], response['ETag'])
+        since = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+    
+    def test_catalog_changes_invalidate(self):
+        """Test item saves, bulk updates and category edits change the validators"""
+        for change in (
+            lambda: self.item.save(),
+            lambda: Items.objects.filter(pk=self.item.pk).update(price=Decimal('12.00')),
+            lambda: self.category.save(),
+        ):
+            response = self.client.get(self.url)
+            change()
+            self.assertEqual(self.revalidate(self.url, response).status_code, 200)
+    
+    def test_visitor_state_and_url_in_etag(self):
+        """Test the cart badge and the query string change the ETag"""
+        self.client.login(username='testuser', password='testpass123')
+        shop = reverse('shop')
+        response = self.client.get(shop)
+        self.assertEqual(self.revalidate(shop, response).status_code, 304)
+        self.assertEqual(self.revalidate(shop + '?sort=price_low', response).status_code, 200)
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, item=self.item, quantity=1)
+        self.assertEqual(self.revalidate(shop, response).status_code, 200)
+    
+    def test_homepage_content_changes(self):
+        """Test homepage-only content (hero, sections) also changes its ETag"""
+        home = reverse('index')
+        response = self.client.get(home)
+        self.assertEqual(self.revalidate(home, response).status_code, 304)
+        HomeHero.objects.create(title="Hero", subtitle="Sub", image='heroes/hero.jpg', is_active=True)
+        self.assertEqual(self.revalidate(home, response).status_code, 200)
+
+
+class ShopFacetsTestCase(TestCase):
+    """Test cases for the shop sidebar facets"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.lamps = Category.objects.create(name="Lamps")
+        self.tables = Category.objects.create(name="Tables")
+        for name, category, price, available in (
+            ("Lamp", self.lamps, '30.00', True),
+            ("Lamp Big", self.lamps, '120.00', True),
+            ("Lamp Old", self.lamps, '40.00', False),
+            ("Table", self.tables, '300.00', True),
+        ):
+            Items.objects.create(
+                Category=category, name=name, description="Test Description", price=Decimal(price),
+                image1='images/test_image.jpg', slug=name.lower().replace(' ', '-'), available=available,
+            )
+    
+    def facets(self, **params):
+        return get_shop_facets(ShopFilters.from_query(params))
+    
+    def test_one_query_then_cached(self):
+        """Test facets cost one aggregate query and are cached per normalized filters"""
+        with self.assertNumQueries(1):
+            facets = self.facets(min_price='25')
+        self.assertEqual(facets['total'], 3)
+        with self.assertNumQueries(0):
+            self.facets(min_price='25.00', sort='name_asc')
+    
+    def test_counts_follow_other_filters(self):
+        """Test each facet counts items matching the other active filters"""
+        facets = self.facets(category=str(self.lamps.id), max_price='100')
+        # Category counts ignore the category filter but honour the price
+        self.assertEqual([(c.name, c.item_count) for c in facets['categories']], [('Lamps', 1)])
+        self.assertEqual((facets['in_stock_count'], facets['out_of_stock_count']), (1, 1))
+        # The price facets ignore the price filter but honour the category
+        self.assertEqual(facets['price_range'], {'min_price': Decimal('30.00'), 'max_price': Decimal('120.00')})
+        self.assertEqual([bucket['count'] for bucket in facets['price_buckets']][:3], [1, 0, 1])
+        self.assertEqual(facets['total'], 1)
+    
+    def test_shop_view_uses_facets(self):
+        """Test the shop view shows facet counts and a total for the filtered listing"""
+        response = self.client.get(reverse('shop'), {'search': 'lamp', 'min_price': 'oops'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_items'], 2)
+        self.assertEqual(len(response.context['items']), 2)
+        self.assertEqual([c.item_count for c in response.context['categories']], [2])
+        self.assertContains(response, '$100 - $249.99 (1)')
+    
+    def test_category_strip_query_count_independent_of_categories(self):
+        """Test category covers come with the facets instead of a query per category"""
+        self.assertEqual([c.first_item_image for c in self.facets()['categories']], ['images/test_image.jpg'] * 2)
+        self.client.get(reverse('shop'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('shop'))
+        for index in range(3):
+            Items.objects.create(
+                Category=Category.objects.create(name=f"Stools {index}"), name=f"Stool {index}", description="Test Description",
+                price=Decimal('10.00'), image1='images/test_image.jpg', slug=f"stool-{index}",
+            )
+        self.client.get(reverse('shop'))
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('shop'))
+        self.assertEqual(len(response.context['categories']), 5)
+        self.assertEqual(len(many), len(few))
+
+
+class ImportCatalogTestCase(TestCase):
+    """Test cases for the import_catalog command"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.lamps = Category.objects.create(name="Lamps")
+        self.existing = Items.objects.create(
+            Category=self.lamps, name="Old Lamp", description="Old", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="old-lamp"
+        )
+        self.existing.Tag.add(Tag.objects.create(caption="vintage"))
+    
+    def run_import(self, name, content, *args):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+    
+    def test_csv_upsert(self):
+        """Test CSV rows create and update items, categories and tags"""
+        out, err = self.run_import('catalog.csv', (
+            "slug,name,description,price,sale_price,category,tags,image1\n"
+            "old-lamp,Old Lamp,Restored,12.00,9.00,Lamps,ocean|resin,images/test_image.jpg\n"
+            ",River Table,Walnut,300,,Tables,resin,images/table.jpg\n"
+            "broken,Broken,,abc,,Lamps,,\n"
+        ), '--batch-size', '2')
+        self.assertIn('rows/s', out)
+        self.assertIn('line 4: price is not a number', err)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.description, self.existing.effective_price), ('Restored', Decimal('9.00')))
+        self.assertEqual(sorted(self.existing.Tag.values_list('caption', flat=True)), ['ocean', 'resin'])
+        table = Items.objects.get(slug='river-table')
+        self.assertEqual((table.Category.name, table.effective_price), ('Tables', Decimal('300')))
+        self.assertEqual(list(table.Tag.values_list('caption', flat=True)), ['resin'])
+        self.assertEqual(Tag.objects.filter(caption='resin').count(), 1)
+        self.assertEqual([item.slug for item in get_search_backend().filter_queryset(Items.objects.all(), 'walnut')], ['river-table'])
+        self.assertTrue(ImageJob.objects.filter(image='images/table.jpg').exists())
+        self.assertTrue(StaleRelatedItems.objects.filter(item=table).exists())
+    
+    def test_import_refreshes_homepage(self):
+        """Test bulk-imported changes show on the cached homepage straight away"""
+        cache.clear()
+        self.assertEqual(get_homepage_context()['sale_items'], [])
+        self.run_import('catalog.jsonl', '{"slug": "old-lamp", "sale_price": "8.00", "is_on_sale": true}\n')
+        sale_items = get_homepage_context()['sale_items']
+        self.assertEqual([(item.slug, item.effective_price) for item in sale_items], [('old-lamp', Decimal('8.00'))])
+    
+    def test_tags_only_import_bumps_catalog(self):
+        """Test a batch that only changes tags still invalidates catalog pages"""
+        version = get_catalog_version()
+        self.run_import('catalog.jsonl', '{"slug": "old-lamp", "tags": ["vintage", "brass"]}\n')
+        self.assertEqual(sorted(self.existing.Tag.values_list('caption', flat=True)), ['brass', 'vintage'])
+        self.assertGreater(get_catalog_version(), version)
+    
+    def test_jsonl_partial_update(self):
+        """Test JSONL rows only touch the columns they carry"""
+        self.run_import('catalog.jsonl', (
+            '{"slug": "old-lamp", "price": "15.50", "available": false}\n'
+            '\n'
+            '{"slug": "new-lamp", "description": "no name or price"}\n'
+        ))
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.price, self.existing.available), ('Old Lamp', Decimal('15.50'), False))
+        self.assertEqual(list(self.existing.Tag.values_list('caption', flat=True)), ['vintage'])
+        self.assertFalse(Items.objects.filter(slug='new-lamp').exists())
+    
+    def test_queries_per_batch_not_per_row(self):
+        """Test the query count doesn't grow with the rows in a batch"""
+        def import_rows(count, offset):
+            rows = ''.join(
+                f'{{"slug": "item-{n}", "name": "Item {n}", "price": "5", "category": "Lamps", "tags": ["a", "b"]}}\n'
+                for n in range(offset, offset + count)
+            )
+            self.run_import(f'rows-{offset}.jsonl', rows, '--batch-size', '100')
+        # Create the category and tags first so both runs resolve them the same way
+        import_rows(1, 1000)
+        with CaptureQueriesContext(connection) as small:
+            import_rows(5, 0)
+        with CaptureQueriesContext(connection) as large:
+            import_rows(50, 100)
+        self.assertEqual(len(small), len(large))
+
+
+class ExportTestCase(TestCase):
+    """Test cases for the streaming CSV/JSONL exports"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123', email='a@example.com')
+        category = Category.objects.create(name="Lamps")
+        self.item = Items.objects.create(
+            Category=category, name="Lamp, large", description="Test Description",
+            price=Decimal('10.00'), image1='images/test_image.jpg', slug="lamp"
+        )
+        self.orders = []
+        for day in (1, 2):
+            order = Order.objects.create(
+                contact_email_phone='a@example.com', delivery_last_name='A', delivery_address='1 Way',
+                delivery_city='Lagos', delivery_state='Lagos', delivery_country='Nigeria', delivery_phone='000',
+                subtotal=Decimal('10.00'), total=Decimal('10.00'),
+            )
+            Order.objects.filter(pk=order.pk).update(created_at=f'2026-01-0{day}T12:00:00Z')
+            OrderItem.objects.create(
+                order=order, item=self.item, item_name="Lamp", item_price=Decimal('10.00'), subtotal=Decimal('10.00'),
+            )
+            self.orders.append(order)
+    
+    def test_command_date_range(self):
+        """Test export_data filters on the date range and writes JSONL rows"""
+        out = StringIO()
+        call_command('export_data', 'orders', '--format', 'jsonl', '--since', '2026-01-02', stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['order_number'] for row in rows], [self.orders[1].order_number])
+        out = StringIO()
+        call_command('export_data', 'order_items', '--until', '2026-01-01', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith('id,order_number,order_created_at'))
+        self.assertEqual(len(lines), 2)
+        self.assertIn(self.orders[0].order_number, lines[1])
+    
+    def test_admin_action_streams_csv(self):
+        """Test the admin export action streams the selected items as CSV"""
+        self.client.login(username='admin', password='testpass123')
+        response = self.client.post(reverse('admin:resin_apps_items_changelist'), {
+            'action': 'export_csv', '_selected_action': [self.item.pk],
+        })
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment; filename="items-', response['Content-Disposition'])
+        rows = list(csv.DictReader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['slug'], row['name'], row['category']) for row in rows], [('lamp', 'Lamp, large', 'Lamps')])
+    
+    def test_rows_are_not_models(self):
+        """Test exports read values() rows without building model instances"""
+        from django.db.models.signals import post_init
+        built = []
+        receiver = lambda sender, **kwargs: built.append(sender)
+        post_init.connect(receiver)
+        self.addCleanup(post_init.disconnect, receiver)
+        self.assertEqual(len(list(export_rows('order_items'))), 2)
+        self.assertEqual(built, [])
+
+
+class CatalogApiTestCase(TestCase):
+    """Test cases for the read-only JSON catalog API"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.category = Category.objects.create(name="Lamps")
+        self.tags = [Tag.objects.create(caption=caption) for caption in ("blue", "glass")]
+        self.items = []
+        for index in range(5):
+            item = Items.objects.create(
+                Category=self.category, name=f"Lamp {index}", description="Test Description",
+                price=Decimal('10.00') + index, image1='images/test_image.jpg', slug=f"lamp-{index}",
+                display_order=index,
+            )
+            item.Tag.set(self.tags)
+            self.items.append(item)
+        Items.objects.create(
+            name="Hidden", description="Test Description", price=Decimal('1.00'),
+            image1='images/test_image.jpg', slug="hidden", available=False,
+        )
+        self.url = reverse('api-item-list')
+    
+    def test_item_list(self):
+        """Test the list shows available items with their category and tags"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([item['slug'] for item in data['results']], [f"lamp-{index}" for index in range(5)])
+        first = data['results'][0]
+        self.assertEqual(first['category'], {'id': self.category.id, 'name': "Lamps"})
+        self.assertEqual(sorted(first['tags']), ["blue", "glass"])
+        self.assertEqual(first['price'], '10.00')
+        self.assertTrue(first['url'].endswith(reverse('item-details', kwargs={'slug': 'lamp-0'})))
+        self.assertIsNone(data['next'])
+    
+    def test_cursor_pagination(self):
+        """Test next/previous links walk the list without overlap"""
+        data = self.client.get(self.url, {'page_size': 2}).json()
+        slugs = [item['slug'] for item in data['results']]
+        while data['next']:
+            data = self.client.get(data['next']).json()
+            slugs += [item['slug'] for item in data['results']]
+        self.assertEqual(slugs, [f"lamp-{index}" for index in range(5)])
+        previous = self.client.get(data['previous']).json()
+        self.assertEqual([item['slug'] for item in previous['results']], ["lamp-2", "lamp-3"])
+    
+    def test_sparse_fields(self):
+        """Test ?fields= trims the payload and skips unrequested relations"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, {'fields': 'id,name,price'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'name', 'price'})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('description', queries[0]['sql'])
+        self.assertNotIn('resin_apps_category', queries[0]['sql'])
+    
+    def test_query_count_independent_of_page_size(self):
+        """Test a page costs the same queries for 1 or 5 items"""
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(self.url, {'page_size': 1})
+        with CaptureQueriesContext(connection) as large:
+            self.client.get(self.url, {'page_size': 5})
+        self.assertEqual(len(small), len(large))
+        self.assertLessEqual(len(large), 2)
+    
+    def test_not_modified(self):
+        """Test responses are public and revalidate with 304 until the catalog changes"""
+        response = self.client.get(self.url)
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('max-age', response['Cache-Control'])
+        self.assertNotIn('Cookie', response.get('Vary', ''))
+        with self.settings(API_CACHE_MAX_AGE=300):
+            self.assertIn('max-age=300', self.client.get(self.url)['Cache-Control'])
+        with self.assertNumQueries(0):
+            not_modified = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.tags[0].save()
+        changed = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(changed.status_code, 200)
+    
+    def test_detail_and_other_endpoints(self):
+        """Test item detail by slug, categories with counts and tags"""
+        item = self.client.get(reverse('api-item-detail', kwargs={'slug': 'lamp-3'})).json()
+        self.assertEqual(item['name'], "Lamp 3")
+        self.assertEqual(self.client.get(reverse('api-item-detail', kwargs={'slug': 'hidden'})).status_code, 404)
+        categories = self.client.get(reverse('api-category-list')).json()['results']
+        self.assertEqual([(c['name'], c['item_count']) for c in categories], [("Lamps", 5)])
+        tags = self.client.get(reverse('api-tag-list'), {'fields': 'caption'}).json()['results']
+        self.assertEqual(tags, [{'caption': "blue"}, {'caption': "glass"}])
+
+
+class CartPricerTestCase(TestCase):
+    """Test cases for the shared cart pricing engine"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.items = [
+            Items.objects.create(
+                name=f"Vase {index}", description="Test Description", price=Decimal('10.00'),
+                sale_price=Decimal('8.00') if index == 0 else None,
+                image1='images/test_image.jpg', slug=f"vase-{index}",
+            )
+            for index in range(4)
+        ]
+        self.standard = ShippingMethod.objects.create(name="Standard", base_cost=Decimal('5.00'), display_order=1)
+        self.express = ShippingMethod.objects.create(name="Express", base_cost=Decimal('15.00'), display_order=2)
+        TaxConfiguration.objects.create(country="US", tax_rate=Decimal('0.0500'))
+        TaxConfiguration.objects.create(country="US", state="CA", tax_rate=Decimal('0.1000'))
+        DiscountCode.objects.create(code="SAVE10", discount_value=Decimal('10'))
+        DiscountCode.objects.create(code="BIGSPEND", discount_value=Decimal('10'), minimum_order_total=Decimal('500'))
+    
+    def fill_cart(self, count):
+        cart, _ = Cart.objects.get_or_create(user=self.user)
+        for item in self.items[:count]:
+            CartItem.objects.create(cart=cart, item=item, quantity=2)
+    
+    def pricer(self):
+        request = RequestFactory().get('/')
+        request.user = self.user
+        return CartPricer.for_request(request)
+    
+    def test_quote(self):
+        """Test line totals use sale prices and shipping, tax and discount add up"""
+        self.fill_cart(2)
+        quote = self.pricer().quote(self.express.id, "save10", "us", "ca")
+        self.assertEqual([line['item_total'] for line in quote.cart_items], [Decimal('16.00'), Decimal('20.00')])
+        self.assertEqual(quote.subtotal, Decimal('36.00'))
+        self.assertEqual(quote.shipping, Decimal('15.00'))
+        self.assertEqual(quote.estimated_tax, Decimal('3.60'))
+        self.assertEqual(quote.discount_amount, Decimal('3.60'))
+        self.assertEqual(quote.total, Decimal('51.00'))
+    
+    def test_defaults_and_fallbacks(self):
+        """Test the first shipping method, the country-wide rate and rejected codes"""
+        self.fill_cart(1)
+        pricer = self.pricer()
+        quote = pricer.quote(None, "BIGSPEND", "US", "NY")
+        self.assertEqual(quote.shipping_method, self.standard)
+        self.assertEqual(quote.tax_rate, Decimal('0.0500'))
+        self.assertIsNone(quote.applied_discount)
+        self.assertIn("Minimum order total", quote.discount_error)
+        self.assertIsNone(pricer.quote(None, "NOPE").discount_error)
+    
+    def test_memoized_per_request(self):
+        """Test the cart loads once and repeated quotes are free"""
+        self.fill_cart(2)
+        pricer = self.pricer()
+        pricer.quote(self.standard.id, "SAVE10", "US", "CA")
+        with self.assertNumQueries(0):
+            pricer.quote(self.standard.id, "SAVE10", "US", "CA")
+            pricer.shipping_options()
+        with self.assertNumQueries(2):
+            # Only the new discount lookup and its per-user redemption count
+            # run; tax rates come from the compiled table
+            pricer.quote(self.express.id, "BIGSPEND", "US", "")
+    
+    def test_checkout_query_count_independent_of_cart_size(self):
+        """Test a checkout render costs the same queries for 1 or 4 lines"""
+        self.client.login(username='testuser', password='testpass123')
+        url = reverse('checkout') + '?delivery_country=US&delivery_state=CA&discount_code=SAVE10'
+        self.fill_cart(1)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        CartItem.objects.all().delete()
+        self.fill_cart(4)
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(response.context['cart_count'], 8)
+        self.assertEqual(len(small), len(large))
+    
+    def test_ajax_discount_error(self):
+        """Test the AJAX discount check reports why a known code was rejected"""
+        self.fill_cart(1)
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.post(
+            reverse('checkout'), {'discount_code': 'BIGSPEND'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("Minimum order total", response.json()['message'])
+        response = self.client.post(
+            reverse('checkout'), {'discount_code': 'SAVE10'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+        )
+        self.assertEqual(response.json()['discount_amount'], 1.6)
+    
+    def test_quote_cache(self):
+        """Test a repeated quote is a cache hit until the cart, prices or rules change"""
+        self.fill_cart(2)
+        choices = (self.express.id, "SAVE10", "US", "CA")
+        first = self.pricer().quote(*choices)
+        with self.assertNumQueries(0):
+            cached = self.pricer().quote(*choices)
+        self.assertEqual(cached.total, first.total)
+        CartItem.objects.filter(item=self.items[0]).first().delete()
+        self.assertEqual(self.pricer().quote(*choices).subtotal, Decimal('20.00'))
+        Items.objects.filter(pk=self.items[1].pk).update(price=Decimal('20.00'))
+        self.assertEqual(self.pricer().quote(*choices).subtotal, Decimal('40.00'))
+        TaxConfiguration.objects.filter(state="CA").get().delete()
+        self.assertEqual(self.pricer().quote(*choices).tax_rate, Decimal('0.0500'))
+    
+    def test_session_cart_quote_cache(self):
+        """Test session carts are cached by their contents"""
+        request = RequestFactory().get('/')
+        request.user = AnonymousUser()
+        request.session = {'cart_dict': {str(self.items[0].id): 1}}
+        self.assertEqual(CartPricer(request).quote().subtotal, Decimal('8.00'))
+        with self.assertNumQueries(0):
+            CartPricer(request).quote()
+        request.session['cart_dict'][str(self.items[1].id)] = 1
+        self.assertEqual(CartPricer(request).quote().subtotal, Decimal('18.00'))
+
+
+class TaxRatesTestCase(TestCase):
+    """Test cases for the compiled tax rate table"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        TaxConfiguration.objects.create(country="US", tax_rate=Decimal('0.0500'))
+        TaxConfiguration.objects.create(country="US", state="California", tax_rate=Decimal('0.0725'))
+        TaxConfiguration.objects.create(country="US", state="Oregon", tax_rate=Decimal('0.0100'), is_active=False)
+    
+    def test_resolution(self):
+        """Test state rates win, then the country rate, case- and space-insensitively"""
+        self.assertEqual(get_tax_rate(" us ", "CALIFORNIA"), Decimal('0.0725'))
+        self.assertEqual(get_tax_rate("US", "Nevada"), Decimal('0.0500'))
+        self.assertEqual(get_tax_rate("US", "Oregon"), Decimal('0.0500'))
+        self.assertEqual(get_tax_rate("US"), Decimal('0.0500'))
+        self.assertEqual(get_tax_rate("CA", "Ontario"), Decimal('0'))
+        self.assertEqual(get_tax_rate(""), Decimal('0'))
+    
+    def test_lookups_are_free_until_rates_change(self):
+        """Test a warm table answers without queries and reloads after edits"""
+        get_tax_rate("US")
+        with self.assertNumQueries(0):
+            for _ in range(10):
+                get_tax_rate("US", "California")
+        TaxConfiguration.objects.filter(state="California").get().delete()
+        self.assertEqual(get_tax_rate("US", "California"), Decimal('0.0500'))
+    
+    def test_process_copy_expires(self):
+        """Test an edit whose version bump never reached this worker shows up after the timeout"""
+        get_tax_rate("US")
+        # As if another worker with its own cache had saved the change
+        TaxConfiguration.objects.filter(country="US", state="").update(tax_rate=Decimal('0.0600'))
+        cache.delete(f'tax:rates:{get_tax_version()}')
+        self.assertEqual(get_tax_rate("US"), Decimal('0.0500'))
+        with mock.patch('resin_apps.tax.time.monotonic', return_value=time.monotonic() + 60 * 60 + 1):
+            self.assertEqual(get_tax_rate("US"), Decimal('0.0600'))
+    
+    def test_bulk_load(self):
+        """Test the import command upserts thousands of rates in a few queries"""
+        lines = ["country,state,tax_rate,is_active", "US,California,0.0800,yes", "US,Oregon,0.0000,1"]
+        lines += [f"DE,Region {index},0.{index:04d},yes" for index in range(2000)]
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = f'{directory}/rates.csv'
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines))
+        with CaptureQueriesContext(connection) as queries:
+            call_command('import_tax_rates', path, stdout=StringIO())
+        # One read of the stored places, then the batched upserts
+        self.assertLess(len(queries), 21)
+        self.assertEqual(TaxConfiguration.objects.count(), 2003)
+        self.assertEqual(get_tax_rate("us", "california"), Decimal('0.0800'))
+        self.assertEqual(get_tax_rate("US", "Oregon"), Decimal('0'))
+        self.assertEqual(get_tax_rate("DE", "Region 1999"), Decimal('0.1999'))
+    
+    def test_load_matches_normalized_places(self):
+        """Test differently spelled rows update the stored rate and duplicates are refused"""
+        self.assertEqual(load_tax_rates([("us ", " california", "0.0900")]), 1)
+        self.assertEqual(TaxConfiguration.objects.filter(country="US").count(), 3)
+        self.assertEqual(TaxConfiguration.objects.get(state="California").tax_rate, Decimal('0.0900'))
+        with self.assertRaisesMessage(ValueError, "Duplicate tax rate for us"):
+            load_tax_rates([("CA", "", "0.05"), ("US", "", "0.06"), ("us", "", "0.07")])
+        self.assertEqual(get_tax_rate("US"), Decimal('0.0500'))
+        self.assertFalse(TaxConfiguration.objects.filter(country="CA").exists())
+
+
+class ShippingRatesTestCase(TestCase):
+    """Test cases for the compiled shipping-rate table"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.standard = ShippingMethod.objects.create(name="Standard", base_cost=Decimal('5.00'), display_order=1)
+        self.domestic = ShippingMethod.objects.create(
+            name="Next day", base_cost=Decimal('12.00'), display_order=2, available_countries="US, ca ",
+        )
+        self.europe = ShippingMethod.objects.create(
+            name="EU Express", base_cost=Decimal('20.00'), display_order=3, available_countries="DE,fr",
+        )
+        ShippingMethod.objects.create(name="Retired", is_active=False)
+    
+    def test_eligibility(self):
+        """Test restricted methods only show up for their countries"""
+        table = get_shipping_table()
+        self.assertEqual(table.methods_for(" us"), [self.standard, self.domestic])
+        self.assertEqual(table.methods_for("FR"), [self.standard, self.europe])
+        self.assertEqual(table.methods_for("JP"), [self.standard])
+        self.assertEqual(table.methods_for(""), [self.standard, self.domestic, self.europe])
+        options = table.options_for("CA", Decimal('30.00'), 2)
+        self.assertEqual([option['cost'] for option in options], [Decimal('5.00'), Decimal('12.00')])
+    
+    def test_lookups_are_free_until_methods_change(self):
+        """Test a warm table answers without queries and reloads after edits"""
+        get_shipping_table()
+        with self.assertNumQueries(0):
+            get_shipping_table().methods_for("US")
+        self.standard.available_countries = "GB"
+        self.standard.save()
+        self.assertEqual(get_shipping_table().methods_for("JP"), [])
+    
+    def test_country_names_match_codes(self):
+        """Test countries typed by name match methods restricted by code"""
+        table = get_shipping_table()
+        self.assertEqual(table.methods_for("United States"), [self.standard, self.domestic])
+        self.assertEqual(table.methods_for(" united kingdom"), [self.standard])
+        self.assertEqual(table.methods_for("Germany"), [self.standard, self.europe])
+    
+    def test_checkout_form_default_country(self):
+        """Test the form's default 'United States' gets and pays for a US-only method"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), item=item)
+        payment_method = PaymentMethod.objects.create(method_type='bank_deposit', display_name='Bank Deposit')
+        self.client.login(username='testuser', password='testpass123')
+        country = CheckoutForm().fields['delivery_country'].initial
+        self.assertEqual(country, 'United States')
+        data = {
+            'contact_email_phone': 'a@example.com', 'delivery_country': country, 'delivery_last_name': 'A',
+            'delivery_address': '1 Way', 'delivery_city': 'Austin', 'delivery_state': 'TX',
+            'delivery_phone': '000', 'payment_method': payment_method.id, 'shipping_method': self.domestic.id,
+        }
+        response = self.client.post(reverse('checkout'), data)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('payment', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual(order.shipping_cost, Decimal('12.00'))
+        
+        # A method that doesn't ship there is refused, not swapped for another
+        CartItem.objects.create(cart=Cart.objects.get(user=user), item=item)
+        response = self.client.post(reverse('checkout'), {**data, 'shipping_method': self.europe.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('delivery_country', response.context['form'].errors)
+        self.assertEqual(Order.objects.count(), 1)
+    
+    def test_process_copy_expires(self):
+        """Test an edit whose version bump never reached this worker shows up after the timeout"""
+        get_shipping_table()
+        # As if another worker with its own cache had saved the change
+        ShippingMethod.objects.filter(pk=self.standard.pk).update(is_active=False)
+        cache.delete(f'shipping:rates:{get_shipping_version()}')
+        self.assertIn(self.standard, get_shipping_table().methods)
+        with mock.patch('resin_apps.shipping.time.monotonic', return_value=time.monotonic() + 60 * 60 + 1):
+            self.assertNotIn(self.standard, get_shipping_table().methods)
+    
+    def test_checkout_honours_restrictions(self):
+        """Test checkout lists eligible methods and won't price an ineligible choice"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), item=item)
+        self.client.login(username='testuser', password='testpass123')
+        response = self.client.get(reverse('checkout'), {'delivery_country': 'DE', 'shipping_method': self.domestic.id})
+        self.assertEqual([option['method'] for option in response.context['shipping_methods']], [self.standard, self.europe])
+        self.assertEqual(response.context['selected_shipping_method'], self.standard)
+
+
+class DiscountLookupTestCase(TestCase):
+    """Test cases for cached discount code lookups and attempt throttling"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.discount = DiscountCode.objects.create(code="Spring10", discount_value=Decimal('10'))
+    
+    def test_cached_lookups(self):
+        """Test hits and misses are cached until a code changes"""
+        self.assertEqual(get_discount_code(" spring10 "), self.discount)
+        self.assertIsNone(get_discount_code("GUESS"))
+        with self.assertNumQueries(0):
+            self.assertEqual(get_discount_code("SPRING10"), self.discount)
+            self.assertIsNone(get_discount_code("guess"))
+            self.assertIsNone(get_discount_code(""))
+        created = DiscountCode.objects.create(code="GUESS", discount_value=Decimal('5'))
+        self.assertEqual(get_discount_code("guess"), created)
+    
+    @override_settings(DISCOUNT_ATTEMPT_BURST=3, DISCOUNT_ATTEMPTS_PER_MINUTE=1)
+    def test_failed_attempts_are_throttled(self):
+        """Test guessing is cut off with 429 while a valid code keeps working"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), item=item)
+        self.client.login(username='testuser', password='testpass123')
+        
+        def attempt(code):
+            return self.client.post(reverse('checkout'), {'discount_code': code}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        
+        for _ in range(5):
+            self.assertEqual(attempt("SPRING10").status_code, 200)
+        self.assertEqual([attempt(f"GUESS{index}").status_code for index in range(4)], [400, 400, 400, 429])
+        with self.assertNumQueries(0):
+            # Rejected before the session, cart or code is loaded
+            self.assertEqual(attempt("GUESS9").status_code, 429)
+        response = self.client.get(reverse('checkout'), {'discount_code': 'GUESS9'})
+        self.assertIsNone(response.context['applied_discount'])
+    
+    @override_settings(DISCOUNT_ATTEMPT_BURST=3, DISCOUNT_ATTEMPTS_PER_MINUTE=1)
+    def test_form_posts_are_throttled(self):
+        """Test guessing through the checkout form or ?discount_code= is limited too"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=user), item=item)
+        self.client.login(username='testuser', password='testpass123')
+        
+        for index in range(3):
+            response = self.client.post(reverse('checkout'), {'discount_code': f"GUESS{index}"})
+            self.assertEqual(response.status_code, 200)
+            self.assertIsNone(response.context['applied_discount'])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('checkout') + '?discount_code=GUESS9')
+        # Rejected without looking the code up
+        self.assertFalse(any('resin_apps_discountcode' in query['sql'] for query in queries))
+        self.assertIn(DISCOUNT_THROTTLED_MESSAGE, [str(message) for message in response.context['messages']])
+        self.assertEqual(response.context['discount_code'], '')
+        
+        # A throttled code is dropped, not the order
+        payment_method = PaymentMethod.objects.create(method_type='bank_deposit', display_name='Bank Deposit')
+        response = self.client.post(reverse('checkout'), {
+            'contact_email_phone': 'a@example.com', 'delivery_country': 'Nigeria', 'delivery_last_name': 'A',
+            'delivery_address': '1 Way', 'delivery_city': 'Lagos', 'delivery_state': 'Lagos',
+            'delivery_phone': '000', 'payment_method': payment_method.id, 'discount_code': 'SPRING10',
+        })
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('payment', args=[order.id]), fetch_redirect_response=False)
+        self.assertIsNone(order.discount_code)
+        self.assertIn(DISCOUNT_THROTTLED_MESSAGE, [str(message) for message in get_messages(response.wsgi_request)])
+    
+    def test_client_ip_from_trusted_proxy(self):
+        """Test the throttle's IP comes from the configured proxy header, not the proxy itself"""
+        request = RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7')
+        self.assertEqual(client_ip(request), '10.0.0.1')
+        with self.settings(DISCOUNT_CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR'):
+            self.assertEqual(client_ip(request), '203.0.113.7')
+            self.assertEqual(client_ip(RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')), '10.0.0.1')
+
+
+def make_order(**kwargs):
+    return Order.objects.create(
+        contact_email_phone='a@example.com', delivery_last_name='A', delivery_address='1 Way',
+        delivery_city='Lagos', delivery_state='Lagos', delivery_country='Nigeria', delivery_phone='000',
+        subtotal=Decimal('20.00'), total=Decimal('20.00'), **kwargs
+    )
+
+
+class DiscountRedemptionTestCase(TestCase):
+    """Test cases for atomic discount redemption and the redemption ledger"""
+    
+    def setUp(self):
+        """Set up test data"""
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.discount = DiscountCode.objects.create(code="ONCE", discount_value=Decimal('10'), usage_limit=2, per_user_limit=1)
+    
+    def test_usage_and_per_user_limits(self):
+        """Test each redemption is counted and limits are enforced by the update"""
+        redeem_discount(self.discount, make_order(user=self.user), user=self.user)
+        with self.assertRaisesMessage(DiscountUnavailable, "You have already used this discount code."):
+            redeem_discount(self.discount, make_order(user=self.user), user=self.user)
+        redeem_discount(self.discount, make_order(guest_email='Guest@Example.com'), user=AnonymousUser(), email='Guest@Example.com')
+        with self.assertRaisesMessage(DiscountUnavailable, "usage limit"):
+            redeem_discount(self.discount, make_order(), email='other@example.com')
+        self.discount.refresh_from_db()
+        self.assertEqual(self.discount.usage_count, 2)
+        self.assertEqual(DiscountRedemption.objects.filter(discount=self.discount).count(), 2)
+        self.assertTrue(DiscountRedemption.objects.filter(email='guest@example.com', user=None).exists())
+        self.assertEqual(self.discount.is_valid(user=self.user)[1], "This discount code has reached its usage limit.")
+    
+    def test_guest_limit_by_email(self):
+        """Test a guest email counts towards per_user_limit"""
+        self.discount.usage_limit = None
+        self.discount.save()
+        redeem_discount(self.discount, make_order(), email='guest@example.com')
+        self.assertFalse(self.discount.is_valid(email=' GUEST@example.com')[0])
+        with self.assertRaises(DiscountUnavailable):
+            redeem_discount(self.discount, make_order(), email='guest@example.com')
+        # Without an email there is nothing to limit per customer
+        redeem_discount(self.discount, make_order())
+        self.discount.refresh_from_db()
+        self.assertEqual(self.discount.usage_count, 2)
+    
+    def test_checkout_rolls_back_when_code_runs_out(self):
+        """Test a code used up after it was applied leaves no order behind"""
+        payment_method = PaymentMethod.objects.create(method_type='bank_deposit', display_name='Bank Deposit')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), item=item)
+        self.client.login(username='testuser', password='testpass123')
+        data = {
+            'contact_email_phone': 'a@example.com', 'delivery_country': 'Nigeria', 'delivery_last_name': 'A',
+            'delivery_address': '1 Way', 'delivery_city': 'Lagos', 'delivery_state': 'Lagos',
+            'delivery_phone': '000', 'payment_method': payment_method.id, 'discount_code': 'once',
+        }
+        # Applied (and quoted) while a use was left, then taken by someone else
+        self.client.get(reverse('checkout'), {'discount_code': 'once'})
+        DiscountCode.objects.filter(pk=self.discount.pk).update(usage_count=2)
+        
+        response = self.client.post(reverse('checkout'), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.context['applied_discount'])
+        self.assertEqual(response.context['discount_amount'], Decimal('0'))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(CartItem.objects.filter(cart__user=self.user).count(), 1)
+        
+        DiscountCode.objects.filter(pk=self.discount.pk).update(usage_count=0)
+        response = self.client.post(reverse('checkout'), data)
+        order = Order.objects.get()
+        self.assertRedirects(response, reverse('payment', args=[order.id]), fetch_redirect_response=False)
+        self.assertEqual(order.discount_code, self.discount)
+        self.assertEqual(order.discount_redemption.user, self.user)
+        self.assertEqual(DiscountCode.objects.get(pk=self.discount.pk).usage_count, 1)
+
+
+class ConcurrentDiscountRedemptionTestCase(TransactionTestCase):
+    """Test concurrent checkouts can't redeem a code more often than its limit allows"""
+    
+    def test_no_over_redemption(self):
+        """Test many threads racing for a few uses"""
+        cache.clear()
+        discount = DiscountCode.objects.create(code="RACE", discount_value=Decimal('10'), usage_limit=5, per_user_limit=0)
+        orders = [make_order() for _ in range(20)]
+        start = threading.Barrier(len(orders))
+        results = []
+        
+        def checkout(order):
+            try:
+                start.wait()
+                while True:
+                    try:
+                        with transaction.atomic():
+                            redeem_discount(discount, order)
+                        results.append(True)
+                        return
+                    except DiscountUnavailable:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        # Locked by another writer; retry like a fresh request would
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=checkout, args=(order,)) for order in orders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        discount.refresh_from_db()
+        self.assertEqual(len(results), len(orders))
+        self.assertEqual(results.count(True), 5)
+        self.assertEqual(discount.usage_count, 5)
+        self.assertEqual(DiscountRedemption.objects.filter(discount=discount).count(), 5)
+
+
+class AddToCartTestCase(TestCase):
+    """Test cases for the atomic add-to-cart upsert"""
+    
+    def setUp(self):
+        """Set up test data"""
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+    
+    def assertCart(self, quantity):
+        cart = Cart.objects.get(user=self.user)
+        self.assertEqual(CartItem.objects.get(cart=cart, item=self.item).quantity, quantity)
+        self.assertEqual(cart.total_quantity, quantity)
+    
+    def test_upsert_adds_to_existing_line(self):
+        """Test the first add creates the cart and line and later adds increment it"""
+        add_to_cart(self.user, self.item.id, 2)
+        with CaptureQueriesContext(connection) as queries:
+            add_to_cart(self.user, self.item.id, 3)
+        # The upsert and the badge counter (plus the test's savepoint)
+        statements = [query['sql'] for query in queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 2)
+        self.assertCart(5)
+    
+    def test_fallback_without_on_conflict(self):
+        """Test the F() update path when the database has no ON CONFLICT"""
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            add_to_cart(self.user, self.item.id, 2)
+            add_to_cart(self.user, self.item.id)
+        self.assertCart(3)
+    
+    def test_views_use_upsert(self):
+        """Test both add-to-cart views add to the line and drop cached quotes"""
+        self.client.login(username='testuser', password='testpass123')
+        self.client.post(reverse('add-to-cart'), {'post_id': self.item.id, 'quantity': 2})
+        self.assertEqual(self.client.get(reverse('cart-list')).context['total'], Decimal('20.00'))
+        self.client.post(reverse('item-details', kwargs={'slug': self.item.slug}))
+        self.assertEqual(self.client.get(reverse('cart-list')).context['total'], Decimal('30.00'))
+        self.assertCart(3)
+
+
+class ConcurrentAddToCartTestCase(TransactionTestCase):
+    """Test concurrent adds to one cart line are never lost"""
+    
+    def test_no_lost_updates(self):
+        """Test many threads adding the same item at once"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        item = Items.objects.create(
+            name="Vase", description="Test Description", price=Decimal('10.00'),
+            image1='images/test_image.jpg', slug="vase",
+        )
+        adds = 10
+        start = threading.Barrier(adds)
+        
+        def add():
+            try:
+                start.wait()
+                while True:
+                    try:
+                        add_to_cart(user, item.id)
+                        return
+                    except OperationalError:
+                        # Locked by another writer; retry like a fresh request would
+                        time.sleep(0.01)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=add) for _ in range(adds)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        cart = Cart.objects.get(user=user)
+        self.assertEqual(CartItem.objects.get(cart=cart, item=item).quantity, adds)
+        self.assertEqual(cart.total_quantity, adds)
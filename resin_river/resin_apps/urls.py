@@ -1,13 +1,15 @@
-from django.urls import path 
+from django.urls import include, path 
 from . import views
 from django.contrib.auth import views as auth_views
-from django.contrib.sitemaps.views import sitemap
 from .forms import LoginForm
-from .sitemap import ItemsSitemap
+from rest_framework.routers import DefaultRouter
+from . import api
+from .sitemap import sitemap_index, sitemap_section
 
-sitemaps = {
-    'items': ItemsSitemap,
-}
+api_router = DefaultRouter(trailing_slash=False)
+api_router.register('items', api.ItemViewSet, basename='api-item')
+api_router.register('categories', api.CategoryViewSet, basename='api-category')
+api_router.register('tags', api.TagViewSet, basename='api-tag')
 
 urlpatterns = [
     path('', views.startingpage, name='index' ),
@@ -31,5 +33,7 @@ urlpatterns = [
     path('login/',auth_views.LoginView.as_view(template_name='resin_apps/login.html', authentication_form=LoginForm), name='login'),
     path('logout/', auth_views.LogoutView.as_view(), name ='logout'),
     path('robots.txt', views.robots_txt, name='robots_txt'),
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', sitemap_index, name='sitemap'),
+    path('sitemap-<slug:section>-<int:page>.xml', sitemap_section, name='sitemap-section'),
+    path('api/', include(api_router.urls)),
 ]
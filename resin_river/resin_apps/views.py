@@ -1,78 +1,46 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from .models import Items, Category, Cart, CartItem, HomeHero, HomePageSection, Testimonial, PaymentMethod, Order, OrderItem, ShippingMethod, TaxConfiguration, DiscountCode, SavedAddress
+from django.utils.decorators import method_decorator
+from .models import Items, Category, Cart, CartItem, PaymentMethod, Order, OrderItem, SavedAddress
 from django.views import View
 from django.http import HttpResponseRedirect, JsonResponse, Http404, HttpResponse
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.contrib import messages
 from django.conf import settings
-from django.db.models import Q, Count, Min, Max, Sum
+from django.db.models import Sum
 from decimal import Decimal
 from .forms import SignupForm, CheckoutForm
+from .homepage import get_homepage_context, get_homepage_version
+from .conditional import catalog_condition
+from .pagination import paginate_catalog, CURSOR_PARAM
+from .search import get_search_backend
+from .facets import ShopFilters, get_shop_facets
+from .related import get_related_items
+from .pricing import CartPricer
+from .carts import add_to_cart
+from .shipping import get_shipping_table
+from .discounts import DiscountAttemptThrottle, DiscountUnavailable, redeem_discount
 
 # Create your views here.
 
+@catalog_condition(get_homepage_version)
 def startingpage(request):
-    # Get active hero (first by display_order, then by updated_at)
-    hero = HomeHero.objects.filter(is_active=True).first()
-    
-    # Get featured categories for collections section
-    featured_categories = Category.objects.filter(is_featured=True)[:5]
-    
-    # Get all items for pagination
-    all_items = Items.objects.filter(available=True).order_by('display_order', '-created_at')
-    paginator = Paginator(all_items, 12)
-    page_number = request.GET.get('page', 1)
-    try:
-        latest_posts_page = paginator.page(page_number)
-    except PageNotAnInteger:
-        latest_posts_page = paginator.page(1)
-    except EmptyPage:
-        latest_posts_page = paginator.page(paginator.num_pages)
-
-    # Get items for Sale tab
-    sale_items = Items.objects.filter(is_on_sale=True, available=True).order_by('display_order', '-created_at')
-    
-    # Get items for Collection tab (featured items)
-    collection_items = Items.objects.filter(is_featured=True, available=True).order_by('display_order', '-created_at')
-    
-    # Get latest arrivals
-    latest_arrivals = Items.objects.filter(is_latest_arrival=True, available=True).order_by('display_order', '-created_at')[:2]
-    
-    # Get promotional banner
-    promotional_banner = HomePageSection.objects.filter(
-        section_type='promotional', 
-        is_active=True
-    ).first()
-    
-    # Get active testimonial
-    testimonial = Testimonial.objects.filter(is_active=True).first()
-
-    context = {
-        'hero': hero,
-        'featured_categories': featured_categories,
-        'latest_posts_page': latest_posts_page,
-        'sale_items': sale_items,
-        'collection_items': collection_items,
-        'latest_arrivals': latest_arrivals,
-        'promotional_banner': promotional_banner,
-        'testimonial': testimonial,
-    }
+    # Hero, collections, item grid, sale/collection tabs, banner and
+    # testimonial are assembled once and served from cache (see homepage.py)
+    context = get_homepage_context(request.GET.get('page'), request.GET.get(CURSOR_PARAM))
 
     return render (request, 'resin_apps/index.html', context)
 
 
 
 class ItemDetails(View):
+    @method_decorator(catalog_condition())
     def get(self, request, slug):
         post = get_object_or_404(Items, slug=slug, available=True)
-        # Get related items from same category, limit to 4 for "You May Also Like"
-        related_items = Items.objects.filter(
-            Category=post.Category, 
-            available=True
-        ).exclude(slug=slug).order_by('display_order', '-created_at')[:4]
+        # Precomputed "You May Also Like" list, limit to 4
+        related_items = get_related_items(post, 4)
         
         # Store in session for recently viewed
         recently_viewed = request.session.get('recently_viewed', [])
@@ -106,11 +74,7 @@ class ItemDetails(View):
             request.session['wish_list'] = wish_list
             request.session.modified = True
         if request.user.is_authenticated:
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            cart_item, created = CartItem.objects.get_or_create(cart=cart, item=post)
-            if not created:
-                cart_item.quantity += 1
-                cart_item.save()
+            add_to_cart(request.user, post_id)
         else:
             cart_list = request.session.get('cart_list', [])
             if post_id not in cart_list:
@@ -187,13 +151,7 @@ class AddToCart(View):
         
         if request.user.is_authenticated:
             try:
-                cart, _ = Cart.objects.get_or_create(user=request.user)
-                cart_item, created = CartItem.objects.get_or_create(cart=cart, item=item)
-                if not created:
-                    cart_item.quantity += quantity
-                else:
-                    cart_item.quantity = quantity
-                cart_item.save()
+                add_to_cart(request.user, item.id, quantity)
             except IntegrityError:
                 if request.headers.get('x-requested-with') == 'XMLHttpRequest':
                     return JsonResponse({'success': False, 'error': 'Failed to add item to cart'}, status=500)
@@ -223,58 +181,12 @@ class AddToCart(View):
         
 class CartList(View):
     def get(self, request):
-        context = {}
-        cart_items = []
-        total = 0
-        
-        if request.user.is_authenticated:
-            cart, _ = Cart.objects.get_or_create(user=request.user)
-            cart_items_list = cart.items.select_related('item').all()
-            for cart_item in cart_items_list:
-                item_total = cart_item.item.price * cart_item.quantity
-                if cart_item.item.sale_price:
-                    item_total = cart_item.item.sale_price * cart_item.quantity
-                total += item_total
-                cart_items.append({
-                    'item': cart_item.item,
-                    'quantity': cart_item.quantity,
-                    'cart_item_id': cart_item.id,
-                    'item_total': item_total
-                })
-        else:
-            cart_dict = request.session.get('cart_dict', {})
-            # Migrate old cart_list format to cart_dict if needed
-            cart_list = request.session.get('cart_list', [])
-            if cart_list and not cart_dict:
-                # Convert old list format to dict
-                for item_id in cart_list:
-                    item_id_str = str(item_id)
-                    cart_dict[item_id_str] = cart_dict.get(item_id_str, 0) + 1
-                request.session['cart_dict'] = cart_dict
-                del request.session['cart_list']
-                request.session.modified = True
-            
-            if cart_dict:
-                item_ids = [int(item_id) for item_id in cart_dict.keys()]
-                items = Items.objects.filter(id__in=item_ids, available=True)
-                for item in items:
-                    quantity = cart_dict.get(str(item.id), 0)
-                    if quantity > 0:
-                        item_total = item.price * quantity
-                        if item.sale_price:
-                            item_total = item.sale_price * quantity
-                        total += item_total
-                        cart_items.append({
-                            'item': item,
-                            'quantity': quantity,
-                            'item_id': item.id,
-                            'item_total': item_total
-                        })
-        
-        context['cart_items'] = cart_items
-        context['total'] = total
-        context['has_post'] = bool(cart_items)
-        
+        pricer = CartPricer.for_request(request)
+        context = {
+            'cart_items': pricer.cart_items,
+            'total': pricer.subtotal,
+            'has_post': bool(pricer.cart_items),
+        }
         return render(request,'resin_apps/cart-list.html', context)
     
     def post(self, request):
@@ -333,13 +245,20 @@ class CartList(View):
         return HttpResponseRedirect(request.path)
 
 
+SHOP_SORT_ORDERINGS = {
+    'name_asc': ('name', 'id'),
+    'name_desc': ('-name', '-id'),
+    'price_asc': ('effective_price', 'id'),
+    'price_desc': ('-effective_price', '-id'),
+    'newest': ('-created_at', '-id'),
+    'display_order': ('display_order', '-created_at', 'id'),
+    'relevance': ('search_rank', 'id'),
+}
+
+
 class ShopView(View):
+    @method_decorator(catalog_condition())
     def get(self, request):
-        # Get all categories with item counts
-        categories = Category.objects.annotate(
-            item_count=Count('items', filter=Q(items__available=True))
-        ).filter(item_count__gt=0).order_by('display_order', 'name')
-        
         # Get filter parameters
         category_filter = request.GET.get('category', '')
         availability_filter = request.GET.get('availability', '')
@@ -347,189 +266,50 @@ class ShopView(View):
         max_price = request.GET.get('max_price', '')
         sort_by = request.GET.get('sort', 'display_order')
         search_query = request.GET.get('search', '')
+        filters = ShopFilters.from_query(request.GET)
         
-        # Start with all available items
-        items = Items.objects.filter(available=True)
-        
-        # Apply filters
-        if category_filter:
-            items = items.filter(Category__id=category_filter)
-        
-        if availability_filter == 'in_stock':
-            items = items.filter(available=True)
-        elif availability_filter == 'out_of_stock':
-            items = items.filter(available=False)
-        
-        if min_price:
-            try:
-                items = items.filter(price__gte=float(min_price))
-            except ValueError:
-                pass
-        
-        if max_price:
-            try:
-                items = items.filter(price__lte=float(max_price))
-            except ValueError:
-                pass
+        # Available items matching the category, availability and price filters
+        items = Items.objects.filter(filters.availability_q() & filters.category_q() & filters.price_q())
         
-        if search_query:
-            items = items.filter(
-                Q(name__icontains=search_query) |
-                Q(description__icontains=search_query) |
-                Q(Category__name__icontains=search_query)
-            )
+        if filters.search:
+            # Indexed, ranked search (see search.py); defaults to relevance order
+            items = get_search_backend().filter_queryset(items, filters.search)
+            if 'sort' not in request.GET:
+                sort_by = 'relevance'
         
-        # Apply sorting
-        if sort_by == 'name_asc':
-            items = items.order_by('name')
-        elif sort_by == 'name_desc':
-            items = items.order_by('-name')
-        elif sort_by == 'price_asc':
-            items = items.order_by('price')
-        elif sort_by == 'price_desc':
-            items = items.order_by('-price')
-        elif sort_by == 'newest':
-            items = items.order_by('-created_at')
-        else:  # default: display_order
-            items = items.order_by('display_order', '-created_at')
+        # Apply sorting; the last key of each tuple is unique so the
+        # ordering doubles as a keyset for cursor pagination
+        if sort_by == 'relevance' and not filters.search:
+            sort_by = 'display_order'
+        ordering = SHOP_SORT_ORDERINGS.get(sort_by, SHOP_SORT_ORDERINGS['display_order'])
         
-        # Get price range for filter
-        price_range = Items.objects.filter(available=True).aggregate(
-            min_price=Min('price'),
-            max_price=Max('price')
-        )
-        
-        # Pagination
-        paginator = Paginator(items, 12)  # 12 items per page
-        page_number = request.GET.get('page', 1)
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
+        # Category, availability and price facets plus the listing total in
+        # one cached aggregate (see facets.py)
+        facets = get_shop_facets(filters)
         
-        # Count available items
-        in_stock_count = Items.objects.filter(available=True).count()
-        out_of_stock_count = Items.objects.filter(available=False).count()
+        # Pagination (12 items per page)
+        page_obj, total_items = paginate_catalog(request, items, ordering, 12, total=facets['total'])
         
         context = {
-            'categories': categories,
+            'categories': facets['categories'],
             'items': page_obj,
             'category_filter': category_filter,
             'availability_filter': availability_filter,
             'min_price': min_price,
             'max_price': max_price,
-            'price_range': price_range,
+            'price_range': facets['price_range'],
+            'price_buckets': facets['price_buckets'],
             'sort_by': sort_by,
             'search_query': search_query,
-            'in_stock_count': in_stock_count,
-            'out_of_stock_count': out_of_stock_count,
-            'total_items': items.count(),
+            'in_stock_count': facets['in_stock_count'],
+            'out_of_stock_count': facets['out_of_stock_count'],
+            'total_items': total_items,
         }
         
         return render(request, 'resin_apps/shop.html', context)
 
 
-def get_cart_items_and_total(request, shipping_method_id=None, discount_code=None, delivery_country=None, delivery_state=None):
-    """Helper function to get cart items and calculate totals for both authenticated and anonymous users"""
-    cart_items = []
-    subtotal = Decimal('0')
-    item_count = 0
-    
-    if request.user.is_authenticated:
-        cart, _ = Cart.objects.get_or_create(user=request.user)
-        cart_items_list = cart.items.select_related('item').all()
-        for cart_item in cart_items_list:
-            item_total = cart_item.item.price * cart_item.quantity
-            if cart_item.item.sale_price:
-                item_total = cart_item.item.sale_price * cart_item.quantity
-            subtotal += item_total
-            item_count += cart_item.quantity
-            cart_items.append({
-                'item': cart_item.item,
-                'quantity': cart_item.quantity,
-                'item_total': item_total,
-                'cart_item_id': cart_item.id
-            })
-    else:
-        # Anonymous user - get from session
-        cart_dict = request.session.get('cart_dict', {})
-        if cart_dict:
-            item_ids = [int(item_id) for item_id in cart_dict.keys()]
-            items = Items.objects.filter(id__in=item_ids, available=True)
-            for item in items:
-                quantity = cart_dict.get(str(item.id), 0)
-                if quantity > 0:
-                    item_total = item.price * quantity
-                    if item.sale_price:
-                        item_total = item.sale_price * quantity
-                    subtotal += item_total
-                    item_count += quantity
-                    cart_items.append({
-                        'item': item,
-                        'quantity': quantity,
-                        'item_total': item_total,
-                        'item_id': item.id
-                    })
-    
-    # Calculate shipping
-    shipping = Decimal('0')
-    shipping_method = None
-    if shipping_method_id:
-        try:
-            shipping_method = ShippingMethod.objects.get(id=shipping_method_id, is_active=True)
-            shipping = shipping_method.calculate_cost(subtotal, item_count)
-        except ShippingMethod.DoesNotExist:
-            pass
-    
-    # If no shipping method selected, use default (first active method)
-    if not shipping_method:
-        shipping_method = ShippingMethod.objects.filter(is_active=True).order_by('display_order').first()
-        if shipping_method:
-            shipping = shipping_method.calculate_cost(subtotal, item_count)
-    
-    # Calculate tax based on delivery location
-    tax_rate = Decimal('0')
-    estimated_tax = Decimal('0')
-    if delivery_country:
-        # Try to find tax configuration for country/state
-        tax_config = None
-        if delivery_state:
-            tax_config = TaxConfiguration.objects.filter(
-                country__iexact=delivery_country,
-                state__iexact=delivery_state,
-                is_active=True
-            ).first()
-        if not tax_config:
-            tax_config = TaxConfiguration.objects.filter(
-                country__iexact=delivery_country,
-                state='',
-                is_active=True
-            ).first()
-        if tax_config:
-            tax_rate = tax_config.tax_rate
-            estimated_tax = subtotal * tax_rate
-    
-    # Calculate discount
-    discount_amount = Decimal('0')
-    applied_discount_code = None
-    if discount_code:
-        try:
-            discount = DiscountCode.objects.get(code__iexact=discount_code.strip())
-            is_valid, message = discount.is_valid(user=request.user if request.user.is_authenticated else None, order_total=subtotal)
-            if is_valid:
-                discount_amount = discount.calculate_discount(subtotal)
-                applied_discount_code = discount
-        except DiscountCode.DoesNotExist:
-            pass
-    
-    # Calculate total
-    total = subtotal + shipping + estimated_tax - discount_amount
-    if total < 0:
-        total = Decimal('0')
-    
-    return cart_items, subtotal, shipping, estimated_tax, discount_amount, total, shipping_method, applied_discount_code
+DISCOUNT_THROTTLED_MESSAGE = 'Too many discount code attempts. Please wait a minute and try again.'
 
 
 class Checkout(View):
@@ -540,36 +320,29 @@ class Checkout(View):
         delivery_country = request.GET.get('delivery_country')
         delivery_state = request.GET.get('delivery_state')
         
-        cart_items, subtotal, shipping, estimated_tax, discount_amount, total, shipping_method, applied_discount = get_cart_items_and_total(
-            request, shipping_method_id, discount_code, delivery_country, delivery_state
-        )
+        throttle = DiscountAttemptThrottle(request)
+        if discount_code and not throttle.allowed:
+            messages.error(request, DISCOUNT_THROTTLED_MESSAGE)
+            discount_code = None
         
-        if not cart_items:
+        pricer = CartPricer.for_request(request)
+        quote = pricer.quote(shipping_method_id, discount_code, delivery_country, delivery_state)
+        if discount_code and not quote.applied_discount:
+            throttle.spend()
+        
+        if not quote.cart_items:
             messages.warning(request, 'Your cart is empty.')
             return redirect('cart-list')
         
         # Get active payment methods
         payment_methods = PaymentMethod.objects.filter(is_active=True).order_by('display_order', 'method_type')
         
-        # Get active shipping methods and calculate costs
-        shipping_methods = ShippingMethod.objects.filter(is_active=True).order_by('display_order', 'name')
-        item_count = sum(item['quantity'] for item in cart_items)
-        
-        # Calculate shipping cost for each method
-        shipping_methods_with_costs = []
-        for method in shipping_methods:
-            method_cost = method.calculate_cost(subtotal, item_count)
-            shipping_methods_with_costs.append({
-                'method': method,
-                'cost': method_cost
-            })
-        
         # Get saved addresses for authenticated users
         saved_addresses = []
         default_address = None
         if request.user.is_authenticated:
-            saved_addresses = SavedAddress.objects.filter(user=request.user, is_active=True).order_by('-is_default', '-created_at')
-            default_address = saved_addresses.filter(is_default=True).first()
+            saved_addresses = list(SavedAddress.objects.filter(user=request.user, is_active=True).order_by('-is_default', '-created_at'))
+            default_address = next((address for address in saved_addresses if address.is_default), None)
         
         form = CheckoutForm(payment_methods=payment_methods)
         
@@ -585,18 +358,18 @@ class Checkout(View):
             form.fields['delivery_phone'].initial = default_address.phone
         
         context = {
-            'cart_items': cart_items,
-            'subtotal': subtotal,
-            'shipping': shipping,
-            'estimated_tax': estimated_tax,
-            'discount_amount': discount_amount,
-            'total': total,
-            'has_post': bool(cart_items),
+            'cart_items': quote.cart_items,
+            'subtotal': quote.subtotal,
+            'shipping': quote.shipping,
+            'estimated_tax': quote.estimated_tax,
+            'discount_amount': quote.discount_amount,
+            'total': quote.total,
+            'has_post': bool(quote.cart_items),
             'form': form,
             'payment_methods': payment_methods,
-            'shipping_methods': shipping_methods_with_costs,
-            'selected_shipping_method': shipping_method,
-            'applied_discount': applied_discount,
+            'shipping_methods': pricer.shipping_options(delivery_country),
+            'selected_shipping_method': quote.shipping_method,
+            'applied_discount': quote.applied_discount,
             'discount_code': discount_code,
             'saved_addresses': saved_addresses,
             'default_address': default_address,
@@ -611,38 +384,27 @@ class Checkout(View):
             delivery_state = request.POST.get('delivery_state', '')
             shipping_method_id = request.POST.get('shipping_method')
             
-            cart_items, subtotal, shipping, estimated_tax, discount_amount, total, shipping_method, applied_discount = get_cart_items_and_total(
-                request, shipping_method_id, discount_code, delivery_country, delivery_state
-            )
+            throttle = DiscountAttemptThrottle(request)
+            if not throttle.allowed:
+                return JsonResponse({'success': False, 'message': DISCOUNT_THROTTLED_MESSAGE}, status=429)
+            
+            quote = CartPricer.for_request(request).quote(shipping_method_id, discount_code, delivery_country, delivery_state)
             
-            if applied_discount:
+            if quote.applied_discount:
                 return JsonResponse({
                     'success': True,
-                    'discount_amount': float(discount_amount),
-                    'subtotal': float(subtotal),
-                    'shipping': float(shipping),
-                    'tax': float(estimated_tax),
-                    'total': float(total),
-                    'message': f'Discount code "{applied_discount.code}" applied successfully!'
+                    'discount_amount': float(quote.discount_amount),
+                    'subtotal': float(quote.subtotal),
+                    'shipping': float(quote.shipping),
+                    'tax': float(quote.estimated_tax),
+                    'total': float(quote.total),
+                    'message': f'Discount code "{quote.applied_discount.code}" applied successfully!'
                 })
-            else:
-                # Try to get the error message from validation
-                if discount_code:
-                    try:
-                        discount = DiscountCode.objects.get(code__iexact=discount_code.strip())
-                        is_valid, error_message = discount.is_valid(user=request.user if request.user.is_authenticated else None, order_total=subtotal)
-                        if not is_valid:
-                            return JsonResponse({
-                                'success': False,
-                                'message': error_message
-                            }, status=400)
-                    except DiscountCode.DoesNotExist:
-                        pass
-                
-                return JsonResponse({
-                    'success': False,
-                    'message': 'Invalid or expired discount code.'
-                }, status=400)
+            throttle.spend()
+            return JsonResponse({
+                'success': False,
+                'message': quote.discount_error or 'Invalid or expired discount code.'
+            }, status=400)
         
         form = CheckoutForm(request.POST)
         delivery_country = request.POST.get('delivery_country', '')
@@ -655,9 +417,18 @@ class Checkout(View):
             request.GET.get('discount_code', '').strip()
         )
         
-        cart_items, subtotal, shipping, estimated_tax, discount_amount, total, shipping_method, applied_discount = get_cart_items_and_total(
-            request, shipping_method_id, discount_code, delivery_country, delivery_state
-        )
+        # Form posts are limited like the AJAX check, or guessing would just move here;
+        # a throttled code is dropped and the order goes ahead without it
+        throttle = DiscountAttemptThrottle(request)
+        if discount_code and not throttle.allowed:
+            messages.error(request, DISCOUNT_THROTTLED_MESSAGE)
+            discount_code = ''
+        
+        pricer = CartPricer.for_request(request)
+        quote = pricer.quote(shipping_method_id, discount_code, delivery_country, delivery_state)
+        cart_items, applied_discount = quote.cart_items, quote.applied_discount
+        if discount_code and not applied_discount:
+            throttle.spend()
         
         if not cart_items:
             messages.warning(request, 'Your cart is empty.')
@@ -665,19 +436,15 @@ class Checkout(View):
         
         # Get active payment methods
         payment_methods = PaymentMethod.objects.filter(is_active=True).order_by('display_order', 'method_type')
-        shipping_methods_list = ShippingMethod.objects.filter(is_active=True).order_by('display_order', 'name')
-        item_count = sum(item['quantity'] for item in cart_items)
-        
-        # Calculate shipping cost for each method
-        shipping_methods = []
-        for method in shipping_methods_list:
-            method_cost = method.calculate_cost(subtotal, item_count)
-            shipping_methods.append({
-                'method': method,
-                'cost': method_cost
-            })
         
         form = CheckoutForm(request.POST, payment_methods=payment_methods)
+        shipping_methods = pricer.shipping_options(delivery_country)
+        if form.is_valid() and not shipping_methods and get_shipping_table().methods:
+            # Every method is restricted to other countries
+            form.add_error('delivery_country', "Sorry, we don't ship to this country yet.")
+        elif form.is_valid() and shipping_method_id and quote.shipping_method and str(quote.shipping_method.id) != str(shipping_method_id):
+            # Don't charge a different method than the one the shopper picked
+            form.add_error('delivery_country', "The selected shipping method isn't available for this country.")
         
         if form.is_valid() and cart_items:
             # Get selected payment method
@@ -688,126 +455,110 @@ class Checkout(View):
                 messages.error(request, 'Invalid payment method selected.')
                 context = {
                     'cart_items': cart_items,
-                    'subtotal': subtotal,
-                    'shipping': shipping,
-                    'estimated_tax': estimated_tax,
-                    'total': total,
+                    'subtotal': quote.subtotal,
+                    'shipping': quote.shipping,
+                    'estimated_tax': quote.estimated_tax,
+                    'total': quote.total,
                     'has_post': bool(cart_items),
                     'form': form,
                     'payment_methods': payment_methods,
                 }
                 return render(request, 'resin_apps/checkout.html', context)
             
-            # Create order
-            order_data = form.cleaned_data.copy()
-            order = Order.objects.create(
-                user=request.user if request.user.is_authenticated else None,
-                guest_email=order_data.get('contact_email_phone') if '@' in order_data.get('contact_email_phone', '') else '',
-                guest_phone=order_data.get('delivery_phone', ''),
-                contact_email_phone=order_data.get('contact_email_phone', ''),
-                email_news=order_data.get('email_news', False),
-                delivery_first_name=order_data.get('delivery_first_name', ''),
-                delivery_last_name=order_data.get('delivery_last_name', ''),
-                delivery_address=order_data.get('delivery_address', ''),
-                delivery_city=order_data.get('delivery_city', ''),
-                delivery_state=order_data.get('delivery_state', ''),
-                delivery_postal_code=order_data.get('delivery_postal_code', ''),
-                delivery_country=order_data.get('delivery_country', ''),
-                delivery_phone=order_data.get('delivery_phone', ''),
-                billing_same_as_shipping=order_data.get('billing_same_as_shipping', True),
-                billing_first_name=order_data.get('billing_first_name', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_first_name', ''),
-                billing_last_name=order_data.get('billing_last_name', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_last_name', ''),
-                billing_address=order_data.get('billing_address', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_address', ''),
-                billing_city=order_data.get('billing_city', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_city', ''),
-                billing_state=order_data.get('billing_state', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_state', ''),
-                billing_postal_code=order_data.get('billing_postal_code', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_postal_code', ''),
-                billing_country=order_data.get('billing_country', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_country', ''),
-                billing_phone=order_data.get('billing_phone', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_phone', ''),
-                payment_method=payment_method,
-                discount_code=applied_discount if applied_discount else None,
-                subtotal=subtotal,
-                shipping_cost=shipping,
-                tax_amount=estimated_tax,
-                discount_amount=discount_amount,
-                total=total,
-                status='pending',
-            )
-            
-            # Increment discount code usage if applied
-            if applied_discount:
-                # Use select_for_update to prevent race conditions
-                from django.db import transaction
+            # Order, discount redemption, order items and emptying the cart
+            # commit together; a code that ran out meanwhile undoes them all
+            try:
                 with transaction.atomic():
-                    discount = DiscountCode.objects.select_for_update().get(id=applied_discount.id)
-                    discount.usage_count += 1
-                    discount.save(update_fields=['usage_count'])
-                    # Log for debugging
-                    print(f"Discount code {discount.code} usage count incremented to {discount.usage_count}")
-            elif discount_code:
-                # Try to get and increment even if not in applied_discount (fallback)
-                try:
-                    from django.db import transaction
-                    with transaction.atomic():
-                        discount = DiscountCode.objects.select_for_update().get(code__iexact=discount_code.strip())
-                        discount.usage_count += 1
-                        discount.save(update_fields=['usage_count'])
-                        # Update order with discount code
-                        order.discount_code = discount
-                        order.save(update_fields=['discount_code'])
-                        print(f"Discount code {discount.code} usage count incremented to {discount.usage_count} (fallback)")
-                except DiscountCode.DoesNotExist:
-                    pass
-            
-            # Create order items
-            for cart_item_data in cart_items:
-                item = cart_item_data['item']
-                quantity = cart_item_data['quantity']
-                item_price = item.sale_price if item.sale_price else item.price
+                    order_data = form.cleaned_data.copy()
+                    order = Order.objects.create(
+                        user=request.user if request.user.is_authenticated else None,
+                        guest_email=order_data.get('contact_email_phone') if '@' in order_data.get('contact_email_phone', '') else '',
+                        guest_phone=order_data.get('delivery_phone', ''),
+                        contact_email_phone=order_data.get('contact_email_phone', ''),
+                        email_news=order_data.get('email_news', False),
+                        delivery_first_name=order_data.get('delivery_first_name', ''),
+                        delivery_last_name=order_data.get('delivery_last_name', ''),
+                        delivery_address=order_data.get('delivery_address', ''),
+                        delivery_city=order_data.get('delivery_city', ''),
+                        delivery_state=order_data.get('delivery_state', ''),
+                        delivery_postal_code=order_data.get('delivery_postal_code', ''),
+                        delivery_country=order_data.get('delivery_country', ''),
+                        delivery_phone=order_data.get('delivery_phone', ''),
+                        billing_same_as_shipping=order_data.get('billing_same_as_shipping', True),
+                        billing_first_name=order_data.get('billing_first_name', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_first_name', ''),
+                        billing_last_name=order_data.get('billing_last_name', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_last_name', ''),
+                        billing_address=order_data.get('billing_address', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_address', ''),
+                        billing_city=order_data.get('billing_city', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_city', ''),
+                        billing_state=order_data.get('billing_state', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_state', ''),
+                        billing_postal_code=order_data.get('billing_postal_code', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_postal_code', ''),
+                        billing_country=order_data.get('billing_country', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_country', ''),
+                        billing_phone=order_data.get('billing_phone', '') if not order_data.get('billing_same_as_shipping', True) else order_data.get('delivery_phone', ''),
+                        payment_method=payment_method,
+                        discount_code=applied_discount if applied_discount else None,
+                        subtotal=quote.subtotal,
+                        shipping_cost=quote.shipping,
+                        tax_amount=quote.estimated_tax,
+                        discount_amount=quote.discount_amount,
+                        total=quote.total,
+                        status='pending',
+                    )
+                    if applied_discount:
+                        redeem_discount(applied_discount, order, user=request.user, email=order.guest_email)
+                    
+                    # Create order items
+                    for cart_item_data in cart_items:
+                        item = cart_item_data['item']
+                        quantity = cart_item_data['quantity']
+                        item_price = item.effective_price
                 
-                OrderItem.objects.create(
-                    order=order,
-                    item=item,
-                    item_name=item.name,
-                    item_price=item_price,
-                    quantity=quantity,
-                    subtotal=cart_item_data['item_total']
-                )
+                        OrderItem.objects.create(
+                            order=order,
+                            item=item,
+                            item_name=item.name,
+                            item_price=item_price,
+                            quantity=quantity,
+                            subtotal=cart_item_data['item_total']
+                        )
             
-            # Clear cart after order creation
-            if request.user.is_authenticated:
-                cart, _ = Cart.objects.get_or_create(user=request.user)
-                cart.items.all().delete()
+                    # Clear cart after order creation
+                    if request.user.is_authenticated:
+                        cart, _ = Cart.objects.get_or_create(user=request.user)
+                        cart.items.all().delete()
+            except DiscountUnavailable as e:
+                messages.error(request, str(e))
+                quote = pricer.quote(shipping_method_id, None, delivery_country, delivery_state)
+                cart_items, applied_discount = quote.cart_items, None
             else:
-                request.session['cart_dict'] = {}
+                if not request.user.is_authenticated:
+                    request.session['cart_dict'] = {}
+                
+                # Store order ID in session for payment page
+                request.session['order_id'] = order.id
                 request.session.modified = True
-            
-            # Store order ID in session for payment page
-            request.session['order_id'] = order.id
-            request.session.modified = True
-            
-            # Send order confirmation email
-            try:
-                from .email_utils import send_order_confirmation_email
-                send_order_confirmation_email(order)
-            except Exception as e:
-                print(f"Error sending order confirmation email: {e}")
-                # Don't fail the order creation if email fails
-            
-            messages.success(request, f'Order {order.order_number} created successfully!')
-            return redirect('payment', order_id=order.id)
+                
+                # Send order confirmation email
+                try:
+                    from .email_utils import send_order_confirmation_email
+                    send_order_confirmation_email(order)
+                except Exception as e:
+                    print(f"Error sending order confirmation email: {e}")
+                    # Don't fail the order creation if email fails
+                
+                messages.success(request, f'Order {order.order_number} created successfully!')
+                return redirect('payment', order_id=order.id)
 
         context = {
             'cart_items': cart_items,
-            'subtotal': subtotal,
-            'shipping': shipping,
-            'estimated_tax': estimated_tax,
-            'discount_amount': discount_amount,
-            'total': total,
+            'subtotal': quote.subtotal,
+            'shipping': quote.shipping,
+            'estimated_tax': quote.estimated_tax,
+            'discount_amount': quote.discount_amount,
+            'total': quote.total,
             'has_post': bool(cart_items),
             'form': form,
             'payment_methods': payment_methods,
             'shipping_methods': shipping_methods,
-            'selected_shipping_method': shipping_method,
+            'selected_shipping_method': quote.shipping_method,
             'applied_discount': applied_discount,
             'discount_code': discount_code,
         }
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'django.contrib.sites',
     'django.contrib.sitemaps',
+    'rest_framework',
     'allauth',
     'allauth.account',
     'allauth.socialaccount',
@@ -70,6 +71,7 @@ ACCOUNT_EMAIL_VERIFICATION = 'none'
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'resin_apps.middleware.StatelessApiMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -174,3 +176,76 @@ SERVER_EMAIL = DEFAULT_FROM_EMAIL
 SITE_NAME = 'Resin River'
 SITE_URL = os.getenv('SITE_URL', 'http://localhost:8000')
 
+
+# Homepage cache (invalidated by model signals, timeout is a safety net)
+HOMEPAGE_CACHE_TIMEOUT = int(os.getenv('HOMEPAGE_CACHE_TIMEOUT', '900'))
+
+# Catalog listings: 'cursor' (keyset, constant cost per page) or 'page'
+# (numbered pages via Paginator). CATALOG_TOTALS shows a cached product count.
+CATALOG_PAGINATION = os.getenv('CATALOG_PAGINATION', 'cursor')
+CATALOG_TOTALS = os.getenv('CATALOG_TOTALS', 'True') == 'True'
+
+# Related items stored per product by `manage.py rebuild_related_items`
+RELATED_ITEMS_K = int(os.getenv('RELATED_ITEMS_K', '8'))
+
+# Cache backend. Every cache in resin_apps is invalidated by bumping a
+# version key in this cache, so all workers must share it: with DEBUG off the
+# default is Redis (CACHE_LOCATION, default redis://127.0.0.1:6379/1). The
+# per-process LocMemCache is the default only for the DEBUG dev server; using
+# it with DEBUG off fails the resin_apps.E001 system check unless
+# CACHE_SINGLE_PROCESS=True says the site really runs in a single process.
+CACHE_SINGLE_PROCESS = os.getenv('CACHE_SINGLE_PROCESS', str(DEBUG)) == 'True'
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', (
+            'django.core.cache.backends.locmem.LocMemCache' if DEBUG
+            else 'django.core.cache.backends.redis.RedisCache'
+        )),
+        'LOCATION': os.getenv('CACHE_LOCATION', '' if DEBUG else 'redis://127.0.0.1:6379/1'),
+    }
+}
+NAV_CATEGORIES_CACHE_TIMEOUT = int(os.getenv('NAV_CATEGORIES_CACHE_TIMEOUT', '3600'))
+
+# Media serving (resin_apps.media.serve_media). MEDIA_SENDFILE hands file
+# bodies to the front-end server: 'x-accel-redirect' (nginx, with an
+# internal location aliasing MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT) or
+# 'x-sendfile' (Apache mod_xsendfile / lighttpd). Empty streams from Django.
+MEDIA_SENDFILE = os.getenv('MEDIA_SENDFILE', '')
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+MEDIA_MAX_AGE = int(os.getenv('MEDIA_MAX_AGE', str(60 * 60 * 24)))
+
+# Sitemaps (resin_apps.sitemap): products per id-range section and how long
+# a rendered section is cached (catalog changes invalidate it immediately)
+SITEMAP_SECTION_SIZE = int(os.getenv('SITEMAP_SECTION_SIZE', '5000'))
+SITEMAP_CACHE_TIMEOUT = int(os.getenv('SITEMAP_CACHE_TIMEOUT', str(60 * 60 * 6)))
+
+# Shop sidebar facets (resin_apps.facets): lower edges of the price buckets
+# and how long the counts for one filter set are cached
+SHOP_PRICE_BUCKETS = tuple(int(edge) for edge in os.getenv('SHOP_PRICE_BUCKETS', '0,50,100,250,500,1000').split(','))
+SHOP_FACETS_CACHE_TIMEOUT = int(os.getenv('SHOP_FACETS_CACHE_TIMEOUT', str(60 * 15)))
+
+# Read-only catalog API (resin_apps.api): default and largest page size, and
+# how long shared caches may keep a response (Cache-Control: public, max-age)
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', '24'))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', '100'))
+API_CACHE_MAX_AGE = int(os.getenv('API_CACHE_MAX_AGE', '60'))
+
+# Checkout quotes (resin_apps.pricing): how long a priced cart is reused for
+# the same cart, prices and checkout choices (any change invalidates it)
+CART_QUOTE_CACHE_TIMEOUT = int(os.getenv('CART_QUOTE_CACHE_TIMEOUT', '60'))
+
+# Compiled tax table (resin_apps.tax): how long it is cached and memoized per
+# process (edits reload it immediately)
+TAX_TABLE_CACHE_TIMEOUT = int(os.getenv('TAX_TABLE_CACHE_TIMEOUT', str(60 * 60)))
+
+# Compiled shipping-rate table (resin_apps.shipping), as for the tax table
+SHIPPING_TABLE_CACHE_TIMEOUT = int(os.getenv('SHIPPING_TABLE_CACHE_TIMEOUT', str(60 * 60)))
+
+# Discount codes (resin_apps.discounts): how long a code lookup (or a miss) is
+# cached, and the per-session/IP budget of failed attempts
+DISCOUNT_CACHE_TIMEOUT = int(os.getenv('DISCOUNT_CACHE_TIMEOUT', str(60 * 5)))
+DISCOUNT_ATTEMPT_BURST = int(os.getenv('DISCOUNT_ATTEMPT_BURST', '10'))
+DISCOUNT_ATTEMPTS_PER_MINUTE = int(os.getenv('DISCOUNT_ATTEMPTS_PER_MINUTE', '10'))
+# META key of the header the reverse proxy puts the client address in (e.g.
+# HTTP_X_FORWARDED_FOR behind nginx); empty means REMOTE_ADDR is the client
+DISCOUNT_CLIENT_IP_HEADER = os.getenv('DISCOUNT_CLIENT_IP_HEADER', '')